@@ -0,0 +1,221 @@
+"""
+End-to-end latency of RefactoringAgent.run, replayed from a cassette.
+
+Every LLM call (and feedback question) is answered from a recorded cassette
+by a fake chat model, so the time measured is the agent's own: Jedi and the
+symbol index, file I/O, prompt rendering and graph overhead. Runs against
+fixture repositories of increasing size and reports wall time, per-node time
+and peak traced allocations. The first run of each size starts with a cold
+symbol index.
+
+    python -m benchmarks.agent_run_bench [--sizes 10 1000 10000] [--repeat 3] [--json out.json] [--mode fused]
+
+Each graph mode has its own cassette. Re-record one from a real run (needs
+OPENAI_API_KEY), or from the scripted local endpoint that produced the
+committed one:
+
+    python -m benchmarks.agent_run_bench --record [--fake-endpoint] [--mode fused]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from benchmarks.fixtures import (
+    TARGET_FILE,
+    make_fixture_repo,
+    reset_target,
+)
+from src.agent import FUSED, LOOP, MODES, RefactoringAgent
+from src.common.definitions import ProjectContext
+from src.llm.cache import use_llm_cache
+from src.llm.cassette import Cassette, CassetteChatModel, RecordingChatModel
+from src.utilities.file_buffers import get_buffer_cache
+from src.utilities.jedi_session import clear_jedi_sessions
+from src.utilities.tracing import SummarySink, tracing
+
+CASSETTE = os.path.join(os.path.dirname(__file__), "cassettes", "rename_variables.json")
+CASSETTES = {
+    LOOP: CASSETTE,
+    FUSED: os.path.join(
+        os.path.dirname(__file__), "cassettes", "rename_variables_fused.json"
+    ),
+}
+GOAL = (
+    f"In the file {TARGET_FILE}, give the variables of the function `legacy_total`"
+    " descriptive names. Do not rename the function."
+)
+RENAMED_SOURCE = """def legacy_total(values):
+    total = 0
+    for value in values:
+        total += value
+    return total"""
+RENAME_ARGS = {
+    "file": TARGET_FILE,
+    "start_line": 4,
+    "end_line": 9,
+    "replacement_code": RENAMED_SOURCE,
+    "change_summary": "Renamed xs, x and t",
+}
+
+
+def run_once(agent: RefactoringAgent, repo: str):
+    reset_target(repo)
+    context = ProjectContext(folder_path=repo, eval_project_id="benchmark")
+    get_buffer_cache(context).clear()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return agent.run(GOAL, context)
+
+
+def measure(cassette: Cassette, repo: str, repeat: int, mode: str = LOOP) -> dict:
+    agent = RefactoringAgent(llm=CassetteChatModel(cassette=cassette), mode=mode)
+    walls, nodes = [], defaultdict(list)
+    for _ in range(repeat):
+        cassette.rewind()
+        summary = SummarySink()
+        start = time.perf_counter()
+        with tracing(summary):
+            result = run_once(agent, repo)
+        walls.append(time.perf_counter() - start)
+        for node, totals in summary.summary()["node"].items():
+            nodes[node].append(totals["wall_s"])
+
+    cassette.rewind()
+    tracemalloc.start()
+    run_once(agent, repo)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    warm = walls[1:] or walls
+    return {
+        "cold_wall_s": walls[0],
+        "warm_wall_s": statistics.median(warm),
+        "node_s": {node: statistics.median(times) for node, times in nodes.items()},
+        "peak_alloc_bytes": peak,
+        "thoughts": len(result["thoughts"]),
+        "feedback": len(result["feedback"]),
+    }
+
+
+def scripted_response(body: dict):
+    """Plays the agent's part for the local endpoint used by --fake-endpoint."""
+    messages = body["messages"]
+    # The rendered state; tool calling requests lead with a system message
+    content = next(m["content"] for m in messages if m["role"] == "user")
+    if "tools" in body:
+        tools = {tool["function"]["name"] for tool in body["tools"]}
+        if "step" in tools:
+            # A fused step: the thought, action and decision of both steps below
+            if "**Empty History**" in content:
+                step = {
+                    "thought": "find legacy_total with code_search; read it before editing",
+                    "action": "code_search",
+                    "args": {"query": "legacy_total", "file_path": TARGET_FILE},
+                    "should_continue": True,
+                }
+            else:
+                step = {
+                    "thought": "rename xs, x, t in legacy_total with edit_code; keep the name",
+                    "action": "edit_code",
+                    "args": RENAME_ARGS,
+                    "should_continue": False,
+                }
+            return {"tool_calls": [{"name": "step", "args": step}]}
+        if messages[-1]["role"] == "tool":
+            return "Done"
+        if "print_message" in tools:
+            message = "Renamed the variables of legacy_total"
+            return {
+                "tool_calls": [{"name": "print_message", "args": {"message": message}}]
+            }
+        if "**Empty History**" in content:
+            args = {"query": "legacy_total", "file_path": TARGET_FILE}
+            return {"tool_calls": [{"name": "code_search", "args": args}]}
+        return {"tool_calls": [{"name": "edit_code", "args": RENAME_ARGS}]}
+    if "NEXT_THOUGHT" in messages[-1]["content"]:
+        return "0.8"
+    if "Decide whether to think & execute again" in content:
+        return "false" if "edit_code" in content else "true"
+    if "**Empty History**" in content:
+        return "find legacy_total with code_search; read it before editing"
+    return "rename xs, x, t in legacy_total with edit_code; keep the name"
+
+
+def record(fake_endpoint: bool, mode: str = LOOP):
+    from langchain_openai import ChatOpenAI
+
+    from src.execution import DEFAULT_MODEL
+    from src.llm.fake_server import FakeOpenAIServer
+
+    path = CASSETTES[mode]
+    cassette = Cassette(path, mode="record")
+    server = None
+    if fake_endpoint:
+        server = FakeOpenAIServer(scripted_response).start()
+        os.environ["OPENAI_API_KEY"] = "fake"
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        inner = ChatOpenAI(base_url=server.base_url, api_key="fake")
+    else:
+        inner = ChatOpenAI(model=DEFAULT_MODEL)
+    use_llm_cache(cassette)
+    try:
+        with tempfile.TemporaryDirectory() as repo:
+            make_fixture_repo(repo, 10)
+            agent = RefactoringAgent(
+                llm=RecordingChatModel(inner=inner, cassette=cassette), mode=mode
+            )
+            run_once(agent, repo)
+            # Feedbacks are scored in the background
+            cassette.settle()
+    finally:
+        use_llm_cache(None)
+        if server is not None:
+            server.stop()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cassette.save()
+    print(f"Recorded {len(cassette.interactions)} interactions to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", metavar="PATH", help="also write the results here")
+    parser.add_argument("--record", action="store_true")
+    parser.add_argument("--fake-endpoint", action="store_true")
+    parser.add_argument("--mode", choices=MODES, default=LOOP)
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.fake_endpoint, args.mode)
+        return
+
+    cassette = Cassette(CASSETTES[args.mode])
+    use_llm_cache(cassette)
+    results = {"cassette": os.path.basename(CASSETTES[args.mode]), "sizes": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        # A private cache directory, so each size starts with a cold index
+        os.environ["LESS_CACHE_DIR"] = os.path.join(workdir, "cache")
+        for size in args.sizes:
+            repo = make_fixture_repo(os.path.join(workdir, f"repo_{size}"), size)
+            clear_jedi_sessions()
+            results["sizes"][str(size)] = measure(
+                cassette, repo, args.repeat, args.mode
+            )
+    use_llm_cache(None)
+
+    text = json.dumps(results, indent=2)
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Per-step overhead of LLMController.run_with_tools, excluding the model call.
+
+A scripted chat model answers instantly with one tool call and then "Done",
+so the time measured is building (or reusing) the tools and AgentExecutor,
+rendering the prompt and dispatching the tool. Each step runs on a fresh
+state, so a history growing across steps does not hide the construction
+cost.
+
+    python -m benchmarks.controller_step_bench [--steps 200] [--json]
+"""
+
+import argparse
+import json
+import time
+
+from src.actions.basic_actions import create_logging_action, create_no_op_action
+from src.common.definitions import ProjectContext
+from src.execution import LLMController
+from src.llm.fake import ScriptedChatModel
+from src.planning.state import initial_state
+
+
+def make_state():
+    context = ProjectContext(folder_path=".", eval_project_id="bench")
+    return initial_state("benchmark", context)
+
+
+def make_controller():
+    actions = [
+        create_no_op_action(f"no_op_{i}", f"Does nothing ({i})") for i in range(8)
+    ]
+    llm = ScriptedChatModel(
+        responses=[{"tool_calls": [{"name": "no_op_0", "args": {}}]}, "Done"]
+    )
+    return LLMController(actions, "Benchmark", verbose=False, llm=llm)
+
+
+def measure(steps, rebuild):
+    controller = make_controller()
+    controller.run(make_state())  # warm up
+    elapsed = 0.0
+    for _ in range(steps):
+        state = make_state()
+        start = time.perf_counter()
+        if rebuild:
+            # What every step paid before the tools and executor were cached
+            controller._tools = controller._agent_executor = None
+        controller.run(state)
+        elapsed += time.perf_counter() - start
+    return elapsed / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    rebuilt = measure(args.steps, rebuild=True) * 1000
+    reused = measure(args.steps, rebuild=False) * 1000
+    result = {
+        "steps": args.steps,
+        "rebuild_per_step_ms": rebuilt,
+        "reused_per_step_ms": reused,
+        "saved_per_step_ms": rebuilt - reused,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"rebuilt executor: {rebuilt:.3f} ms/step")
+        print(f"reused executor:  {reused:.3f} ms/step")
+        print(f"saved:            {rebuilt - reused:.3f} ms/step")
+
+
+if __name__ == "__main__":
+    main()
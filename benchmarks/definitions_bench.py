@@ -0,0 +1,119 @@
+"""
+Search result conversion at ~10k symbols: slotted records vs. pydantic models.
+
+A fixture repository is indexed, every symbol is looked up, and the rows are
+converted to `Definition`s, both from the symbol index and (as Jedi
+completions) through `completions_to_definitions`. Each conversion runs with
+the current slotted records and again with the pydantic v1 models they
+replaced swapped in. Reports the best time of `--repeat` runs and the memory
+the resulting definitions hold on to.
+
+    python -m benchmarks.definitions_bench [--files 2000] [--repeat 5]
+"""
+
+import argparse
+import contextlib
+import tempfile
+import time
+import tracemalloc
+
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+from benchmarks.fixtures import make_fixture_repo
+from src.common.definitions import ProjectContext
+from src.indexing import symbol_index
+from src.indexing.symbol_index import get_symbol_index
+from src.utilities import jedi_utils
+from src.utilities.jedi_workers import JediName
+
+
+class PydanticSymbol(BaseModel):
+    name: str = Field(description="The name of the symbol")
+    file_path: str = Field(description="The file path of the symbol")
+    line: int = Field(description="The line number of the symbol")
+    column: int = Field(description="The column number of the symbol")
+
+
+class PydanticCodeSpan(BaseModel):
+    file_path: str = Field(description="The file location of the span")
+    start_line: int = Field(description="The starting line number of the span")
+    end_line: int = Field(description="The ending line number of the span")
+
+
+class PydanticDefinition(BaseModel):
+    symbol: PydanticSymbol = Field(description="The symbol of the definition")
+    span: PydanticCodeSpan = Field(description="The span of the definition")
+
+
+@contextlib.contextmanager
+def pydantic_records():
+    """Builds definitions from the pydantic models, as before."""
+    modules = (symbol_index, jedi_utils)
+    saved = [(m, m.Symbol, m.CodeSpan, m.Definition) for m in modules]
+    for module in modules:
+        module.Symbol = PydanticSymbol
+        module.CodeSpan = PydanticCodeSpan
+        module.Definition = PydanticDefinition
+    try:
+        yield
+    finally:
+        for module, *records in saved:
+            module.Symbol, module.CodeSpan, module.Definition = records
+
+
+def measure(convert, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    definitions = convert()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, retained - before, definitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as repo:
+        make_fixture_repo(repo, args.files)
+        context = ProjectContext(folder_path=repo, eval_project_id="bench")
+        index = get_symbol_index(context)
+
+        start = time.perf_counter()
+        symbols = index.lookup("")
+        search = time.perf_counter() - start
+        print(f"lookup of {len(symbols)} symbols: {search * 1e3:.1f} ms")
+
+        names = [
+            JediName(
+                s.name, repo + s.path, s.line, s.column, (s.line, 0), (s.end_line, 0)
+            )
+            for s in symbols
+        ]
+        conversions = {
+            "index rows": lambda: [s.to_definition() for s in symbols],
+            "jedi names": lambda: jedi_utils.completions_to_definitions(names, context),
+        }
+        for name, convert in conversions.items():
+            with pydantic_records():
+                old_time, old_bytes, _ = measure(convert, args.repeat)
+            new_time, new_bytes, definitions = measure(convert, args.repeat)
+            paths = {id(d.span.file_path) for d in definitions}
+            print(
+                f"{name:>11}: pydantic {old_time * 1e3:7.1f} ms {old_bytes / 1e6:6.1f} MB"
+                f" | slotted {new_time * 1e3:7.1f} ms {new_bytes / 1e6:6.1f} MB"
+                f" | {old_time / new_time:4.1f}x faster,"
+                f" {old_bytes / new_bytes:4.1f}x smaller,"
+                f" {len(paths)} path strings"
+            )
+
+
+if __name__ == "__main__":
+    main()
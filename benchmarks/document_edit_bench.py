@@ -0,0 +1,119 @@
+"""
+Compares the old list-based editing path with the LineDocument piece table.
+
+Each workload applies a number of small edits spread across a generated
+module and reads a span after every edit, as the agent does when it renders
+code snippets between edits.
+
+    python -m benchmarks.document_edit_bench [--edits 300] [--json]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from src.utilities.text_document import LineDocument
+
+SIZES = [1_000, 10_000, 100_000]
+SPAN = 30
+
+
+def generate_lines(n):
+    return [f"    value_{i} = compute({i}, {i * 7 % 13})\n" for i in range(n)]
+
+
+def generate_edits(n_lines, n_edits, seed=0):
+    rng = random.Random(seed)
+    edits = []
+    for i in range(n_edits):
+        start = rng.randint(1, n_lines - 2)
+        edits.append((start, start + 2, f"    edited_{i} = 1\n    edited_{i}_b = 2"))
+    return edits
+
+
+def list_file_path(path, edits):
+    # What apply_change_to_file and load_code did before the buffer cache
+    for start_line, end_line, code in edits:
+        with open(path, "r") as file:
+            code_lines = file.readlines()
+        code_lines[start_line - 1 : end_line - 1] = [
+            f"{line}\n" for line in code.split("\n")
+        ]
+        with open(path, "w") as file:
+            file.write("".join(code_lines))
+        with open(path, "r") as file:
+            "".join(file.readlines()[start_line - 1 : start_line - 1 + SPAN])
+
+
+def list_memory_path(lines, edits):
+    lines = list(lines)
+    for start_line, end_line, code in edits:
+        lines[start_line - 1 : end_line - 1] = [
+            f"{line}\n" for line in code.split("\n")
+        ]
+        "".join(lines)  # the whole file was re-joined for every write
+        "".join(lines[start_line - 1 : start_line - 1 + SPAN])
+
+
+def document_path(lines, edits):
+    document = LineDocument(lines)
+    for start_line, end_line, code in edits:
+        document.replace_lines(
+            start_line - 1, end_line - 1, [f"{line}\n" for line in code.split("\n")]
+        )
+        "".join(document.slice_lines(start_line - 1, start_line - 1 + SPAN))
+    document.text()  # written once, on flush
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def run(n_edits):
+    results = []
+    for size in SIZES:
+        lines = generate_lines(size)
+        edits = generate_edits(size, n_edits)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "module.py")
+            with open(path, "w") as file:
+                file.write("".join(lines))
+            list_file = timed(list_file_path, path, edits)
+        results.append(
+            {
+                "lines": size,
+                "edits": n_edits,
+                "list_file_s": list_file,
+                "list_memory_s": timed(list_memory_path, lines, edits),
+                "document_s": timed(document_path, lines, edits),
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--edits", type=int, default=300)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.edits)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'lines':>8} {'list+file':>11} {'list':>9} {'document':>9} {'speedup':>8}")
+    for r in results:
+        speedup = r["list_file_s"] / r["document_s"]
+        print(
+            f"{r['lines']:>8} {r['list_file_s']:>10.4f}s {r['list_memory_s']:>8.4f}s "
+            f"{r['document_s']:>8.4f}s {speedup:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Synthetic Python repositories of a given size, for the end-to-end benchmarks.
+
+Modules are laid out 100 to a package. Only the first module defines
+`legacy_total`, so searching for it finds the same single definition at
+every size and a recorded run replays unchanged.
+"""
+
+import os
+
+MODULES_PER_PACKAGE = 100
+TARGET_FILE = "/pkg_000/module_000.py"
+TARGET_FUNCTION = "legacy_total"
+
+TARGET_SOURCE = '''"""Totals of recorded values."""
+
+
+def legacy_total(xs):
+    t = 0
+    for x in xs:
+        t += x
+    return t
+
+
+def legacy_mean(xs):
+    return legacy_total(xs) / len(xs)
+'''
+
+
+def module_source(package: int, module: int) -> str:
+    suffix = f"{package}_{module}"
+    return f'''"""Module {module} of package {package}."""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class Record{suffix}:
+    name: str
+    values: list
+
+    def scaled(self, factor):
+        return [value * factor for value in self.values]
+
+    def largest(self):
+        return max(self.values)
+
+
+def summarize_{suffix}(records):
+    return {{record.name: record.largest() for record in records}}
+
+
+def merge_{suffix}(left, right):
+    merged = dict(left)
+    for key, value in right.items():
+        merged[key] = max(merged.get(key, value), value)
+    return merged
+'''
+
+
+def file_path(index: int) -> str:
+    package, module = divmod(index, MODULES_PER_PACKAGE)
+    return f"/pkg_{package:03d}/module_{module:03d}.py"
+
+
+def make_fixture_repo(root: str, n_files: int) -> str:
+    """Writes (or tops up) a repository of `n_files` modules under `root`."""
+    for index in range(n_files):
+        package, module = divmod(index, MODULES_PER_PACKAGE)
+        path = os.path.join(root, file_path(index).lstrip("/"))
+        if module == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(os.path.join(os.path.dirname(path), "__init__.py"), "w"):
+                pass
+        if os.path.exists(path) and index != 0:
+            continue
+        with open(path, "w") as file:
+            file.write(TARGET_SOURCE if index == 0 else module_source(package, module))
+    return root
+
+
+def reset_target(root: str):
+    """Undoes the benchmark's edit so every run starts from the same tree."""
+    with open(os.path.join(root, TARGET_FILE.lstrip("/")), "w") as file:
+        file.write(TARGET_SOURCE)
@@ -0,0 +1,118 @@
+"""
+The three-node loop against fused steps, replayed from recorded sessions.
+
+Each mode replays its cassette (see `agent_run_bench`) of the same goal on
+the same fixture repository: two steps, a search then an edit, then the
+finish node. Every LLM call waits `--latency` seconds, standing in for the
+model's round trip, and the tokens each call sends (messages and tool
+schemas) are counted. Reports per step, leaving out the finish node (the
+same in both modes): LLM calls, tokens sent and median wall time.
+
+    python -m benchmarks.fused_step_bench [--latency 0.5] [--repeat 3]
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from typing import Any, List, Optional
+
+from langchain_core.messages import BaseMessage
+from langchain_core.pydantic_v1 import Field
+
+from benchmarks.agent_run_bench import CASSETTES, RENAMED_SOURCE, run_once
+from benchmarks.fixtures import TARGET_FILE, make_fixture_repo
+from src.agent import MODES, RefactoringAgent
+from src.llm.cache import use_llm_cache
+from src.llm.cassette import Cassette, CassetteChatModel
+from src.utilities.tokens import count_tokens
+from src.utilities.tracing import SummarySink, tracing
+
+# The finish node's tool; its calls are left out of the per-step figures
+FINISH_TOOL = "print_message"
+
+
+class TimedCassetteChatModel(CassetteChatModel):
+    """Answers from the cassette after `latency` seconds, noting what was sent."""
+
+    latency: float = 0.0
+    # (tool names, tokens sent) of each call
+    requests: List[Any] = Field(default_factory=list)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ):
+        tools = kwargs.get("tools") or []
+        tokens = sum(count_tokens(str(m.content)) for m in messages)
+        if tools:
+            tokens += count_tokens(json.dumps(tools))
+        self.requests.append(({t["function"]["name"] for t in tools}, tokens))
+        time.sleep(self.latency)
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+def measure(mode: str, repo: str, latency: float, repeat: int) -> dict:
+    cassette = Cassette(CASSETTES[mode])
+    use_llm_cache(cassette)
+    llm = TimedCassetteChatModel(cassette=cassette, latency=latency)
+    agent = RefactoringAgent(llm=llm, mode=mode)
+    walls = []
+    try:
+        for _ in range(repeat):
+            cassette.rewind()
+            llm.requests.clear()
+            summary = SummarySink()
+            with tracing(summary):
+                result = run_once(agent, repo)
+            nodes = summary.summary()["node"]
+            walls.append(
+                sum(t["wall_s"] for node, t in nodes.items() if node != "finish")
+            )
+            with open(f"{repo}/{TARGET_FILE}") as file:
+                assert RENAMED_SOURCE in file.read(), f"{mode} did not edit"
+    finally:
+        use_llm_cache(None)
+
+    steps = len(result["thoughts"])
+    step_calls = [tokens for tools, tokens in llm.requests if FINISH_TOOL not in tools]
+    return {
+        "steps": steps,
+        "calls_per_step": len(step_calls) / steps,
+        "tokens_per_step": sum(step_calls) / steps,
+        "wall_per_step_s": statistics.median(walls) / steps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as repo:
+        make_fixture_repo(repo, 10)
+        results = {
+            mode: measure(mode, repo, args.latency, args.repeat) for mode in MODES
+        }
+
+    print(f"per step, {args.latency:.2f} s per LLM call:")
+    for mode, r in results.items():
+        print(
+            f"{mode:>6}: {r['steps']} steps | {r['calls_per_step']:4.1f} LLM calls"
+            f" | {r['tokens_per_step']:7.0f} tokens sent"
+            f" | {r['wall_per_step_s']:6.2f} s"
+        )
+    loop, fused = (results[mode] for mode in MODES)
+    print(
+        f" fused: {loop['wall_per_step_s'] / fused['wall_per_step_s']:.1f}x faster,"
+        f" {loop['tokens_per_step'] / fused['tokens_per_step']:.1f}x fewer tokens"
+    )
+
+
+if __name__ == "__main__":
+    main()
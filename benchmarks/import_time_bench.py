@@ -0,0 +1,112 @@
+"""
+Import cost of the CLI, from `python -X importtime`, checked against a budget.
+
+Short invocations (`cli.py --help`, `init-repo`) should only pay for click
+and the CLI module itself; the agent's dependencies are imported by the
+commands that use them. Each target is imported in a fresh interpreter;
+the report lists the slowest top-level imports and fails (exit status 1) if
+the CLI's import exceeds the budget or pulls in one of `HEAVY_MODULES`.
+
+    python -m benchmarks.import_time_bench [--budget-ms 150] [--top 10] [--repeat 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Imported lazily by the commands that need them
+HEAVY_MODULES = (
+    "jedi",
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "langgraph",
+    "numpy",
+    "openai",
+    "pygit2",
+    "tiktoken",
+    "trulens_eval",
+)
+DEFAULT_BUDGET_MS = 150
+
+
+def import_times(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Imports `module` in a fresh interpreter: its cumulative import time and
+    that of each module it imports directly, in milliseconds.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total, imports, pending = 0.0, {}, {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Each level of nesting is indented by two more spaces; a module is
+        # listed after the imports it triggered (site's come first)
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        ms = int(cumulative) / 1e3
+        if level == 1:
+            pending[name.strip()] = ms
+        elif level == 0:
+            if name.strip() == module:
+                total, imports = ms, pending
+            pending = {}
+    return total, imports
+
+
+def loaded_heavy_modules(module: str) -> List[str]:
+    code = (
+        f"import sys, {module}\n"
+        "print('\\n'.join(sorted({m.split('.')[0] for m in sys.modules})))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    loaded = set(completed.stdout.split())
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    over_budget = False
+    for module, budget in (("cli", args.budget_ms), ("src.agent", None)):
+        runs = [import_times(module) for _ in range(args.repeat)]
+        total = statistics.median(total for total, _ in runs)
+        _, imports = runs[-1]
+        verdict = ""
+        if budget is not None:
+            over_budget = total > budget
+            verdict = f" (budget {budget:.0f} ms: {'OVER' if over_budget else 'ok'})"
+        print(f"import {module}: {total:8.1f} ms{verdict}")
+        slowest = sorted(imports.items(), key=lambda item: -item[1])
+        for name, ms in slowest[: args.top]:
+            print(f"    {ms:8.1f} ms  {name}")
+
+    heavy = loaded_heavy_modules("cli")
+    if heavy:
+        print(f"import cli loads {', '.join(heavy)}")
+    if over_budget or heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
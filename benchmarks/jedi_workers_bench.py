@@ -0,0 +1,57 @@
+"""
+Concurrent Jedi searches: threads over in-process sessions vs. worker processes.
+
+Each round searches every file of a fixture repository from a thread pool,
+as concurrent plan entries or sessions would. In-process, the searches
+serialise on the GIL; with workers they spread across processes.
+
+    python -m benchmarks.jedi_workers_bench [--files 64] [--workers 4]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import file_path, make_fixture_repo
+from src.utilities.jedi_session import clear_jedi_sessions
+from src.utilities.jedi_workers import JediWorkers
+
+
+def search_all(workers: JediWorkers, repo: str, n_files: int, threads: int) -> float:
+    def search(index: int):
+        path = os.path.join(repo, file_path(index).lstrip("/"))
+        return workers.complete_search(repo, "merge", path).result()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(search, range(n_files)))
+    # The first module only defines legacy_total
+    assert all(results[1:])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as repo:
+        make_fixture_repo(repo, args.files)
+        for name, workers in (
+            ("in-process", JediWorkers(0)),
+            (f"{args.workers} workers", JediWorkers(args.workers)),
+        ):
+            clear_jedi_sessions()
+            # Start the worker processes outside the measurement
+            search_all(workers, repo, args.workers, args.workers)
+            cold = search_all(workers, repo, args.files, args.workers)
+            warm = search_all(workers, repo, args.files, args.workers)
+            workers.shutdown()
+            print(f"{name:>12}: cold {cold * 1e3:8.1f} ms, warm {warm * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,22 @@
 import click
+import contextlib
 import os
+import uuid
+from typing import Optional
 import dotenv
-import pygit2 as git
-from src.agent import RefactoringAgent
-from src.common.definitions import ProjectContext
-from src.planning.state import state_to_str
+from src.utilities.tracing import (
+    ChromeTraceSink,
+    JSONLSink,
+    SamplingProfiler,
+    SummarySink,
+    tracing,
+)
 
 dotenv.load_dotenv()
 
+# The agent's dependencies (langchain, langgraph, jedi, pygit2, trulens) are
+# imported by the commands that use them, so `--help` and `init-repo` start fast
+
 
 # init click
 @click.group()
@@ -20,6 +29,8 @@ def cli():
 @click.option("--repo", default=os.getenv("DEMO_REPO"), help="The repo to download")
 @click.option("--folder", default="demo", help="The folder to download the repo to")
 def init_repo(repo: str, folder: str):
+    import pygit2 as git
+
     # Check if the repo is already downloaded
     if os.path.exists(folder):
         click.echo(f"{folder} already exists")
@@ -35,9 +46,132 @@ def init_repo(repo: str, folder: str):
 
 
 @click.command()
-@click.argument("query")
+@click.argument("query", required=False)
 @click.option("--repo", default="./demo", help="The repo to download")
-def run(query, repo: str):
+@click.option(
+    "--resume",
+    "resume_id",
+    default=None,
+    help="Continue the run with this id from its last completed step",
+)
+@click.option(
+    "--checkpoint/--no-checkpoint",
+    default=True,
+    help="Save the state after every step, so the run can be resumed (not with --worktree)",
+)
+@click.option(
+    "--flush-policy",
+    type=click.Choice(["action", "step", "run"]),
+    default="action",
+    help="When edits are written to disk",
+)
+@click.option(
+    "--async/--sync",
+    "use_async",
+    default=False,
+    help="Run the graph on an asyncio event loop",
+)
+@click.option(
+    "--llm-cache",
+    type=click.Choice(["none", "memory", "sqlite"]),
+    default="none",
+    help="Reuse responses to identical LLM calls",
+)
+@click.option(
+    "--llm-cache-ttl",
+    type=float,
+    default=None,
+    help="Seconds a cached response stays valid",
+)
+@click.option(
+    "--eval",
+    "evaluate",
+    is_flag=True,
+    help="Score the agent's thoughts with trulens feedback functions (LLM calls)",
+)
+@click.option(
+    "--mode",
+    type=click.Choice(["loop", "fused"]),
+    default="loop",
+    help="Think, execute and decide in three LLM calls per step, or in one",
+)
+@click.option(
+    "--context-budget",
+    type=int,
+    default=8000,
+    help="Tokens the state may take in each prompt (0 for no limit)",
+)
+@click.option(
+    "--worktree",
+    "use_worktree",
+    is_flag=True,
+    help="Edit a throwaway git worktree of the repo and commit the result to a branch",
+)
+@click.option(
+    "--stream",
+    "stream_console",
+    is_flag=True,
+    help="Print the run's progress (tokens, thoughts, actions, edits) as it happens",
+)
+@click.option(
+    "--events",
+    "events_path",
+    default=None,
+    help="Write the run's progress events to this JSONL file as they happen",
+)
+@click.option(
+    "--trace-summary",
+    is_flag=True,
+    help="Print the time and counters of each node and action",
+)
+@click.option("--trace-jsonl", default=None, help="Write every span to this file")
+@click.option(
+    "--trace-chrome", default=None, help="Write a Chrome trace-event file here"
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Sample the run's stacks and print the hottest functions",
+)
+@click.option(
+    "--profile-output",
+    default="profile.folded",
+    help="Where --profile writes the folded stacks (for flamegraph.pl/speedscope)",
+)
+def run(
+    query: Optional[str],
+    repo: str,
+    resume_id: Optional[str],
+    checkpoint: bool,
+    flush_policy: str,
+    use_async: bool,
+    llm_cache: str,
+    llm_cache_ttl: Optional[float],
+    evaluate: bool,
+    mode: str,
+    context_budget: int,
+    use_worktree: bool,
+    stream_console: bool,
+    events_path: Optional[str],
+    trace_summary: bool,
+    trace_jsonl: Optional[str],
+    trace_chrome: Optional[str],
+    profile: bool,
+    profile_output: str,
+):
+    import asyncio
+    from src.agent import RefactoringAgent
+    from src.common.definitions import ProjectContext
+    from src.llm.cache import create_llm_cache, use_llm_cache
+    from src.planning.state import state_to_str
+    from src.utilities.checkpoints import CheckpointStore
+    from src.utilities.worktrees import open_worktree
+
+    if (query is None) == (resume_id is None):
+        raise click.UsageError("Give either a QUERY or --resume RUN_ID")
+    if resume_id is not None and use_worktree:
+        # The worktree of the run was removed with its edits
+        raise click.UsageError("--resume runs in the repo, not in a worktree")
 
     # click.echo("Running the demo")
 
@@ -47,13 +181,188 @@ def run(query, repo: str):
     context = ProjectContext(
         folder_path=repo,
         eval_project_id="demo",
+        flush_policy=flush_policy,
+        context_token_budget=context_budget or None,
+    )
+    cache = create_llm_cache(llm_cache, ttl=llm_cache_ttl)
+    use_llm_cache(cache)
+    # A worktree run cannot be resumed (see above), so is not checkpointed
+    checkpointer = None
+    if resume_id is not None or (checkpoint and not use_worktree):
+        checkpointer = CheckpointStore()
+    agent = RefactoringAgent(evaluate=evaluate, checkpointer=checkpointer, mode=mode)
+    if resume_id is not None and checkpointer.latest(resume_id) is None:
+        raise click.ClickException(f"No checkpoint of run {resume_id}")
+    run_id = resume_id or uuid.uuid4().hex[:12]
+    if checkpointer is not None:
+        click.echo(f"Run {run_id} (resume with --resume {run_id})")
+
+    summary = SummarySink() if trace_summary else None
+    sinks = [summary] if summary is not None else []
+    if trace_jsonl:
+        sinks.append(JSONLSink(trace_jsonl))
+    if trace_chrome:
+        sinks.append(ChromeTraceSink(trace_chrome))
+    profiler = SamplingProfiler() if profile else None
+    worktree = None
+    if use_worktree:
+        worktree = open_worktree(repo, f"run-{uuid.uuid4().hex[:12]}")
+        worktree.reset()
+        context.folder_path = worktree.path_of(repo)
+    try:
+        with contextlib.ExitStack() as stack:
+            if sinks:
+                stack.enter_context(tracing(*sinks))
+            if profiler is not None:
+                stack.enter_context(profiler)
+            if stream_console or events_path:
+                from src.streaming import (
+                    ConsoleEventWriter,
+                    JSONLEventWriter,
+                    RunEvents,
+                    write_events,
+                )
+
+                writers = [ConsoleEventWriter()] if stream_console else []
+                if events_path:
+                    events_file = stack.enter_context(open(events_path, "w"))
+                    writers.append(JSONLEventWriter(events_file))
+                events = RunEvents(
+                    agent,
+                    None if resume_id else query,
+                    None if resume_id else context,
+                    worktree=worktree,
+                    run_id=run_id,
+                    use_async=use_async,
+                )
+                result = write_events(events, writers)
+            elif resume_id is not None:
+                if use_async:
+                    result = asyncio.run(agent.aresume(resume_id))
+                else:
+                    result = agent.resume(resume_id)
+            elif use_async:
+                result = asyncio.run(
+                    agent.arun(query, context, worktree=worktree, run_id=run_id)
+                )
+            else:
+                result = agent.run(query, context, worktree=worktree, run_id=run_id)
+            if worktree is not None and worktree.head != worktree.base:
+                branch = worktree.branch(worktree.name)
+                click.echo(f"Committed the changes to {branch}")
+        if not stream_console:
+            click.echo(state_to_str(result))
+        if cache is not None:
+            click.echo(f"LLM cache: {cache.stats()}")
+        if summary is not None:
+            click.echo(summary.format())
+        if profiler is not None:
+            profiler.write_folded(profile_output)
+            for function, samples in profiler.top():
+                click.echo(f"{samples:>8}  {function}")
+            click.echo(f"Folded stacks written to {profile_output}")
+    finally:
+        if worktree is not None:
+            worktree.remove()
+
+
+# Serve goals from a job queue, reusing one agent and its warm indices
+@click.command()
+@click.option("--host", default="127.0.0.1", help="The address to listen on")
+@click.option("--port", type=int, default=8765, help="The port to listen on")
+@click.option("--unix-socket", default=None, help="Listen on this Unix socket instead")
+@click.option(
+    "--sessions", type=int, default=4, help="Jobs that may run at the same time"
+)
+@click.option(
+    "--max-queue", type=int, default=64, help="Queued jobs before new ones get 429"
+)
+@click.option(
+    "--worktrees/--shared-checkout",
+    default=True,
+    help="Give each session its own worktree of a git repo, or edit the repo itself",
+)
+@click.option(
+    "--flush-policy",
+    type=click.Choice(["action", "step", "run"]),
+    default="action",
+    help="When edits are written to disk",
+)
+@click.option(
+    "--llm-cache",
+    type=click.Choice(["none", "memory", "sqlite"]),
+    default="none",
+    help="Reuse responses to identical LLM calls",
+)
+@click.option(
+    "--eval",
+    "evaluate",
+    is_flag=True,
+    help="Score the agent's thoughts with trulens feedback functions (LLM calls)",
+)
+@click.option(
+    "--mode",
+    type=click.Choice(["loop", "fused"]),
+    default="loop",
+    help="Think, execute and decide in three LLM calls per step, or in one",
+)
+@click.option(
+    "--context-budget",
+    type=int,
+    default=8000,
+    help="Tokens the state may take in each prompt (0 for no limit)",
+)
+def serve(
+    host: str,
+    port: int,
+    unix_socket: Optional[str],
+    sessions: int,
+    max_queue: int,
+    worktrees: bool,
+    flush_policy: str,
+    llm_cache: str,
+    evaluate: bool,
+    mode: str,
+    context_budget: int,
+):
+    from src import server
+    from src.llm.cache import create_llm_cache, use_llm_cache
+
+    use_llm_cache(create_llm_cache(llm_cache))
+    service = server.AgentService(
+        max_sessions=sessions,
+        max_queue=max_queue,
+        flush_policy=flush_policy,
+        context_token_budget=context_budget or None,
+        use_worktrees=worktrees,
+        evaluate=evaluate,
+        mode=mode,
     )
-    agent = RefactoringAgent()
-    click.echo(state_to_str(agent.run(query, context)))
+    http = server.serve(service, host, port, unix_socket)
+    where = unix_socket or f"http://{host}:{port}"
+    click.echo(f"Serving {sessions} sessions on {where}")
+    with service:
+        try:
+            http.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http.server_close()
+
+
+# Refresh the locally cached agent prompt from the LangChain hub
+@click.command()
+def pull_prompts():
+    from src.llm.prompts import pull_agent_prompt
+
+    digest = pull_agent_prompt()
+    click.echo(f"Cached agent prompt {digest}")
 
 
 cli.add_command(init_repo)
 cli.add_command(run)
+cli.add_command(pull_prompts)
+cli.add_command(serve)
 
 if __name__ == "__main__":
     cli()
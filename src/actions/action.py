@@ -1,11 +1,22 @@
 import json
 from uuid import UUID
 from langchain.callbacks.base import BaseCallbackHandler
-from typing import Optional, TypeVar, Generic, Callable, Type, TypedDict
+from typing import (
+    FrozenSet,
+    NamedTuple,
+    Optional,
+    TypeVar,
+    Generic,
+    Callable,
+    Type,
+    TypedDict,
+)
 from unittest.mock import Base
 from src.common.definitions import FailureReason
 
 from src.planning.state import ActionRequest, FeedbackMessage, RefactoringAgentState
+from src.utilities import tracing
+from src.utilities.paths import standardize_code_path
 from ..common import ProjectContext
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.output_parsers import JsonOutputParser
@@ -20,6 +31,69 @@ ActionArgs = TypeVar("ActionArgs", bound=BaseModel)
 ActionReturnType = TypeVar("ActionReturnType")
 
 
+# Stands for every file of the project in `Effects`
+ALL_FILES = "*"
+
+
+def _touches(files: FrozenSet[str], others: FrozenSet[str]) -> bool:
+    if not files or not others:
+        return False
+    return ALL_FILES in files or ALL_FILES in others or not files.isdisjoint(others)
+
+
+class Effects(NamedTuple):
+    """
+    What running an action touches, so that plan entries whose effects do
+    not conflict can run concurrently. Files are project-relative paths;
+    `changes` names the state fields the action appends to or applies
+    changes to (e.g. "code_blocks"), which are changed in plan order.
+    """
+
+    reads: FrozenSet[str] = frozenset()
+    writes: FrozenSet[str] = frozenset()
+    # Changes the state beyond its own record (e.g. the plan): runs alone
+    exclusive: bool = False
+    changes: FrozenSet[str] = frozenset()
+
+    @classmethod
+    def reading(cls, *files: Optional[str], changes=()) -> "Effects":
+        """Reads `files`, or the whole project for a file of None."""
+        paths = [ALL_FILES if f is None else standardize_code_path(f) for f in files]
+        return cls(reads=frozenset(paths), changes=frozenset(changes))
+
+    @classmethod
+    def writing(cls, *files: str, changes=()) -> "Effects":
+        paths = frozenset(standardize_code_path(f) for f in files)
+        return cls(reads=paths, writes=paths, changes=frozenset(changes))
+
+    def conflicts_with(self, other: "Effects") -> bool:
+        if self.exclusive or other.exclusive:
+            return True
+        return _touches(self.writes, other.reads | other.writes) or _touches(
+            other.writes, self.reads
+        )
+
+
+# Actions that do not declare their effects
+EXCLUSIVE = Effects(exclusive=True)
+
+
+class _ToolCallbacks(BaseCallbackHandler):
+    def __init__(self, get_state: Callable[[], RefactoringAgentState]):
+        self.get_state = get_state
+
+    def on_tool_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs,
+    ):
+        if error is FeedbackMessage:
+            self.get_state()["feedback"].append(error)
+
+
 class Action(Generic[ActionArgs, ActionReturnType]):
     def __init__(
         self,
@@ -28,6 +102,7 @@ class Action(Generic[ActionArgs, ActionReturnType]):
         model_cls: Type[ActionArgs],
         f: Callable[[RefactoringAgentState, ActionArgs], ActionReturnType],
         return_direct=False,
+        effects: Optional[Callable[[ActionArgs], Effects]] = None,
     ):
         self.id = id
         self.description = description
@@ -35,24 +110,30 @@ class Action(Generic[ActionArgs, ActionReturnType]):
         self.f = f
         self.cls = model_cls
         self.return_direct = return_direct
+        self.effects = effects
+
+    def effects_of(self, args: ActionArgs) -> Effects:
+        """What running the action with `args` touches; everything if undeclared."""
+        if self.effects is None:
+            return EXCLUSIVE
+        return self.effects(args)
 
     def execute(
         self, state: RefactoringAgentState, args: ActionArgs
     ) -> ActionReturnType:
-        return self.f(state, args)
+        with tracing.span(self.id, "action"):
+            return self.f(state, args)
 
     def to_tool(self, state: RefactoringAgentState) -> StructuredTool:
-        class Callbacks(BaseCallbackHandler):
-            def on_tool_error(
-                self,
-                error: BaseException,
-                *,
-                run_id: UUID,
-                parent_run_id: UUID | None = None,
-                **kwargs,
-            ):
-                if error is FeedbackMessage:
-                    state["feedback"].append(error)
+        return self.to_bound_tool(lambda: state)
+
+    def to_bound_tool(
+        self, get_state: Callable[[], RefactoringAgentState]
+    ) -> StructuredTool:
+        """
+        Creates a tool that runs against whatever state `get_state` returns
+        when it is called, so the tool can be built once and reused.
+        """
 
         def tool_f(**kwargs) -> ActionReturnType:
             args_str = json.dumps(kwargs)
@@ -60,7 +141,7 @@ class Action(Generic[ActionArgs, ActionReturnType]):
                 args = self.cls(**kwargs)
                 request = ActionRequest(id=self.id, args=args)
                 try:
-                    return self.f(state, args)
+                    return self.execute(get_state(), args)
                 except FeedbackMessage as f:
                     raise f
                 except Exception as e:
@@ -75,7 +156,7 @@ class Action(Generic[ActionArgs, ActionReturnType]):
 
         return StructuredTool(
             name=self.id,
-            callbacks=[Callbacks()],
+            callbacks=[_ToolCallbacks(get_state)],
             description=self.description,
             args_schema=self.cls,
             func=tool_f,
@@ -1,7 +1,7 @@
 from typing import Type, Optional, List
 from src.actions.action import Action
 
-from src.common.definitions import CodeSpan, Symbol
+from src.common.definitions import CodeSpanInput, Symbol
 from src.planning.state import RefactoringAgentState
 from src.utilities.jedi_utils import jedi_name_to_symbol, load_code, span_to_snippet
 
@@ -17,13 +17,13 @@ import os
 
 
 class ReadCodeSnippetInput(BaseModel):
-    code_span: CodeSpan = Field(description="The code span to read")
+    code_span: CodeSpanInput = Field(description="The code span to read")
 
 
 # TODO: Error handling
 def create_code_loader():
     def code_reader(state: RefactoringAgentState, args: ReadCodeSnippetInput) -> str:
-        span = args.code_span
+        span = args.code_span.to_span()
         snippet = span_to_snippet(span, state["project_context"])
 
         state["code_snippets"].append(snippet)
@@ -1,15 +1,20 @@
 from typing import Optional, List
-from src.actions.action import Action
+from src.actions.action import Action, Effects
 from src.common import Symbol
-from src.common.definitions import Definition, pydantic_to_str
+from src.common.definitions import Definition, SymbolInput
 
+from src.indexing.symbol_index import get_symbol_index
 from src.planning.state import RefactoringAgentState
 from src.utilities.jedi_utils import (
+    completions_to_definitions,
     goto_symbol,
+    goto_symbol_future,
     jedi_name_to_symbol,
     span_to_snippet,
     symbol_to_definition,
 )
+from src.utilities.file_buffers import get_buffer_cache
+from src.utilities.jedi_workers import get_jedi_workers
 from src.utilities.paths import add_path_to_prefix, remove_path_prefix
 from ..common import ProjectContext, Symbol
 
@@ -19,43 +24,45 @@ from langchain.tools import tool
 import jedi
 import os
 
-
 ###########################################
 # Tools
 
 
 class SearchInput(BaseModel):
     query: str = Field(description="a symbol to search for in repository.")
-    # fuzzy: bool = Field(description="whether to use fuzzy search", default=False)
+    fuzzy: bool = Field(description="whether to use fuzzy search", default=False)
     file_path: Optional[str] = Field(
-        description="whether to narrow the search to a specific file. If not provided, search the entire repository.",
+        description="whether to narrow the search to a specific file. If not provided, search the entire repository. With fuzzy search, results near this file are ranked first instead.",
         default=None,
     )
 
 
-def create_code_search():
+def create_code_search(top_k: int = 10):
 
     def code_search(state: RefactoringAgentState, args: SearchInput) -> str:
         context = state["project_context"]
         folder_path = context.folder_path
         query = args.query
-        # fuzzy = args.fuzzy
+        fuzzy = args.fuzzy
         file_path = args.file_path
 
-        # searcher
-        if file_path is None:
-            # folder path
-            searcher = jedi.Project(folder_path)
-        else:
-            # folder path / file path
-            path = os.path.join(folder_path, file_path)
-            searcher = jedi.Script(path=path)
-
-        completions = list(searcher.complete_search(query))
-        symbols = [
-            jedi_name_to_symbol(completion, context) for completion in completions
-        ]
-        definitions = list(map(lambda s: symbol_to_definition(s, context), symbols))
+        # Ranked lookup in the prebuilt index; Jedi covers what it cannot see
+        # (e.g. names only reachable through imports)
+        index = get_symbol_index(context, None if fuzzy else file_path)
+        symbols = index.search(query, fuzzy=fuzzy, file_path=file_path, limit=top_k)
+        definitions = [symbol.to_definition() for symbol in symbols]
+        if len(definitions) == 0 and not fuzzy:
+            workers = get_jedi_workers()
+            if file_path is None:
+                # folder path
+                completions = workers.complete_search(folder_path, query)
+            else:
+                # folder path / file path
+                path = os.path.join(folder_path, file_path)
+                code = get_buffer_cache(context).dirty_text(file_path)
+                completions = workers.complete_search(folder_path, query, path, code)
+            definitions = completions_to_definitions(completions.result(), context)
+            definitions = definitions[:top_k]
 
         # Save the code snippets
         for definition in definitions:
@@ -68,11 +75,14 @@ def create_code_search():
         description="Performs a search for a the definition of a symbol in a file or folder. Stores the definitions under the '<Code Snippets>' block",
         model_cls=SearchInput,
         f=code_search,
+        effects=lambda args: Effects.reading(
+            None if args.fuzzy else args.file_path, changes=("code_blocks",)
+        ),
     )
 
 
 class GotoDefinitionInput(BaseModel):
-    symbol: Symbol = Field(description="The symbol to get the definition of.")
+    symbol: SymbolInput = Field(description="The symbol to get the definition of.")
 
 
 # TODO: Error handling
@@ -80,13 +90,12 @@ def create_definition_gotoer():
     def code_goto_definition(
         state: RefactoringAgentState, args: GotoDefinitionInput
     ) -> Symbol:
-        symbol = args.symbol
-
-        source_name = goto_symbol(state["project_context"], symbol)
+        symbol = args.symbol.to_symbol()
 
-        assert len(source_name) == 1
-
-        definition_name = source_name[0].goto()
+        future = goto_symbol_future(
+            state["project_context"], symbol, follow_imports=True
+        )
+        definition_name = future.result()
 
         assert len(definition_name) == 1
 
@@ -101,4 +110,6 @@ def create_definition_gotoer():
         description="Goes the definition of a symbol in the project",
         model_cls=GotoDefinitionInput,
         f=code_goto_definition,
+        # The definition may be in any file
+        effects=lambda args: Effects.reading(None),
     )
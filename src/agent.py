@@ -1,23 +1,156 @@
+import contextlib
+import uuid
+from typing import AsyncIterator, Iterator, Optional, Tuple
 from langgraph.graph import StateGraph, END
 from src.actions.code_inspection import create_code_loader
 from src.actions.code_manipulation import create_apply_change
 from src.actions.code_search import create_definition_gotoer
 from src.actions.code_search import create_code_search
-from src.planning.planner import LLMExecutor, ShouldContinue, Planner, Thinker
-from src.planning.state import RefactoringAgentState
+from src.planning.planner import (
+    FusedStep,
+    LLMExecutor,
+    NextNode,
+    ShouldContinue,
+    Planner,
+    Thinker,
+)
+from src.planning.state import RefactoringAgentState, initial_state
 from .common.definitions import ProjectContext
 from .execution import ActionDispatcher, ExecutePlan, ExecuteTopOfPlan, LLMController
+from .utilities.file_buffers import FlushPolicy, get_buffer_cache
+from .utilities import tracing
+from .utilities.checkpoints import CheckpointStore
+from .utilities.worktrees import Worktree
 from .actions.basic_actions import create_logging_action
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnableConfig
-from trulens_eval import Tru
-from langchain import hub
-from langchain.agents import AgentExecutor, create_openai_functions_agent
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+
+@contextlib.contextmanager
+def worktree_step(state: RefactoringAgentState, config: RunnableConfig):
+    """
+    Snapshots the run's worktree (if any) after a step, or rolls it back to
+    the previous step's snapshot if the step fails.
+    """
+    worktree = config.get("configurable", {}).get("worktree")
+    if worktree is None:
+        yield
+        return
+    buffers = get_buffer_cache(state["project_context"])
+    try:
+        yield
+    except BaseException:
+        buffers.discard()
+        worktree.rollback()
+        raise
+    buffers.flush()
+    worktree.snapshot()
+
+
+def _checkpointed(config: RunnableConfig) -> bool:
+    # Resumable: a run in a worktree cannot be resumed, so is rolled back instead
+    configurable = config.get("configurable", {})
+    worktree = configurable.get("worktree")
+    return configurable.get("thread_id") is not None and worktree is None
+
+
+@contextlib.contextmanager
+def checkpointed_node(state: RefactoringAgentState, config: RunnableConfig):
+    """
+    Keeps the files of a checkpointed run in line with its last checkpoint,
+    so that `resume` does not replay edits that are already on disk. The
+    flushes a node's flush points call for are deferred until the next node
+    starts, once the checkpoint recording its edits is saved, and a failed
+    node's edits are dropped. Edits the flush policy still holds in memory
+    are saved with the checkpoint, as `unflushed`. A run in a worktree is
+    rolled back instead (see `worktree_step`).
+    """
+    if not _checkpointed(config):
+        yield
+        return
+    buffers = get_buffer_cache(state["project_context"])
+    buffers.release()
+    buffers.hold()
+    try:
+        yield
+    except BaseException:
+        buffers.discard()
+        raise
+    state["unflushed"] = buffers.dirty_texts()
+
+
+@contextlib.contextmanager
+def checkpointed_edge(state: RefactoringAgentState, config: RunnableConfig):
+    """Drops the edits of the node before a failed edge, as `checkpointed_node`."""
+    try:
+        yield
+    except BaseException:
+        if _checkpointed(config):
+            get_buffer_cache(state["project_context"]).discard()
+        raise
+
+
+def as_node(node, name: str, step: bool = False):
+    """
+    Wraps a graph node so that `ainvoke` awaits its `acall` instead of a
+    thread, and each call is traced as a span named `name`. A `step` node
+    edits the project: see `worktree_step` and `checkpointed_node`.
+    """
+    steps = worktree_step if step else lambda state, config: contextlib.nullcontext()
+
+    def call(state, config: RunnableConfig):
+        with tracing.span(name, "node"), checkpointed_node(state, config):
+            with steps(state, config):
+                return node(state)
+
+    async def acall(state, config: RunnableConfig):
+        with tracing.span(name, "node"), checkpointed_node(state, config):
+            with steps(state, config):
+                return await node.acall(state)
+
+    return RunnableLambda(call, afunc=acall, name=type(node).__name__)
+
+
+def as_edge(edge, name: str):
+    """
+    `as_node` for a conditional edge, which runs as part of the node before
+    it (so before that node's checkpoint is saved).
+    """
+
+    def call(state, config: RunnableConfig):
+        with tracing.span(name, "node"), checkpointed_edge(state, config):
+            return edge(state)
+
+    async def acall(state, config: RunnableConfig):
+        with tracing.span(name, "node"), checkpointed_edge(state, config):
+            return await edge.acall(state)
+
+    return RunnableLambda(call, afunc=acall, name=type(edge).__name__)
+
+
+# think -> execute -> should_continue, or one fused step (see FusedStep)
+LOOP = "loop"
+FUSED = "fused"
+MODES = (LOOP, FUSED)
 
 
 class RefactoringAgent:
-    def __init__(self):
+    def __init__(
+        self,
+        llm=None,
+        evaluate=False,
+        checkpointer: Optional[CheckpointStore] = None,
+        mode: str = LOOP,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}; expected one of {MODES}")
+        # Shared by every node; defaults to each controller's own ChatOpenAI
+        self.llm = llm
+        # The shape of each step of the graph
+        self.mode = mode
+        # Score the thoughts with trulens feedback functions
+        self.evaluate = evaluate
+        # Saves the state after every step, so runs can be resumed
+        self.checkpointer = checkpointer
         # Load Actions
         self._setup_agent_graph()
 
@@ -37,38 +170,193 @@ class RefactoringAgent:
         action_list = self._create_refactoring_actions()
         self.graph = StateGraph(RefactoringAgentState)
 
-        self.graph.add_node("think", Thinker(action_list))  # Planner(action_list))
-        self.graph.add_node("execute", LLMExecutor(action_list))
+        if self.mode == FUSED:
+            self.graph.add_node(
+                "step",
+                as_node(
+                    FusedStep(action_list, llm=self.llm, evaluate=self.evaluate),
+                    "step",
+                    step=True,
+                ),
+            )
+            self.graph.add_conditional_edges("step", as_edge(NextNode(), "next_node"))
+            self.graph.set_entry_point("step")
+        else:
+            # Planner(action_list)
+            self.graph.add_node(
+                "think",
+                as_node(
+                    Thinker(action_list, llm=self.llm, evaluate=self.evaluate), "think"
+                ),
+            )
+            self.graph.add_node(
+                "execute",
+                as_node(LLMExecutor(action_list, llm=self.llm), "execute", step=True),
+            )
+            self.graph.add_edge("think", "execute")
+            self.graph.add_conditional_edges(
+                "execute", as_edge(ShouldContinue(llm=self.llm), "should_continue")
+            )
+            self.graph.set_entry_point("think")
         self.graph.add_node(
             "finish",
-            LLMController(
-                [create_logging_action()],
-                "Log any results you wish to show the user by calling print_message.",
+            as_node(
+                LLMController(
+                    [create_logging_action()],
+                    "Log any results you wish to show the user by calling print_message.",
+                    llm=self.llm,
+                ),
+                "finish",
             ),
         )
-        self.graph.add_edge("think", "execute")
-        self.graph.add_conditional_edges("execute", ShouldContinue())
         self.graph.add_edge("finish", END)
-        self.graph.set_entry_point("think")
         # self.graph.add_node('')
-        self.app = self.graph.compile()
+        self.app = self.graph.compile(checkpointer=self.checkpointer)
 
         # print the graph
         # TODO
 
-    def run(self, inp: str, context: ProjectContext) -> RefactoringAgentState:
-        tru = Tru()
-        state: RefactoringAgentState = {
-            "goal": inp,
-            "project_context": context,
-            "history": [],
-            "plan": [],
-            "feedback": [],
-            "console": [],
-            "code_blocks": [],
-            "thoughts": [],
-        }
-        config = RunnableConfig(recursion_limit=30)
+    def _config(self, callbacks, worktree, run_id=None) -> RunnableConfig:
+        configurable = {"worktree": worktree}
+        if self.checkpointer is not None:
+            configurable["thread_id"] = run_id or uuid.uuid4().hex[:12]
+        return RunnableConfig(
+            recursion_limit=30,
+            callbacks=callbacks,
+            configurable=configurable,
+        )
+
+    def _resumable(self, run_id: str):
+        if self.checkpointer is None:
+            raise ValueError("Resuming a run needs an agent with a checkpointer")
+        if self.checkpointer.latest(run_id) is None:
+            raise KeyError(f"No checkpoint of run {run_id}")
+
+    def _restore(self, run_id: str):
+        """
+        Loads the edits the last checkpoint of `run_id` held in memory, in
+        place of any the run made after it.
+        """
+        self._resumable(run_id)
+        state = self.checkpointer.latest(run_id)["channel_values"]
+        buffers = get_buffer_cache(state["project_context"])
+        buffers.discard()
+        buffers.restore(state.get("unflushed", {}))
+
+    def _finish_run(self, inp: str, context: ProjectContext, worktree):
+        buffers = get_buffer_cache(context)
+        buffers.release()
+        buffers.flush_point(FlushPolicy.RUN, context.flush_policy)
+        if worktree is not None:
+            worktree.commit(inp)
+
+    def run(
+        self,
+        inp: str,
+        context: ProjectContext,
+        callbacks=None,
+        worktree: Optional[Worktree] = None,
+        run_id: Optional[str] = None,
+    ) -> RefactoringAgentState:
+        """
+        Runs the graph on `context`. With a `worktree` (checked out at
+        `context.folder_path`), each step is snapshotted, a failed step is
+        rolled back and a successful run is committed. With a checkpointer,
+        each step is saved under `run_id` (see `resume`).
+        """
+        state = initial_state(inp, context)
+        config = self._config(callbacks, worktree, run_id)
         result = RefactoringAgentState(**self.app.invoke(state, config=config))
-        # tru.stop_dashboard()
+        self._finish_run(inp, context, worktree)
+        return result
+
+    def resume(
+        self,
+        run_id: str,
+        callbacks=None,
+        worktree: Optional[Worktree] = None,
+    ) -> RefactoringAgentState:
+        """
+        Continues the run `run_id` after its last saved step, with the edits
+        it held in memory; raises KeyError if it has no checkpoint.
+        """
+        self._restore(run_id)
+        config = self._config(callbacks, worktree, run_id)
+        result = RefactoringAgentState(**self.app.invoke(None, config=config))
+        self._finish_run(result["goal"], result["project_context"], worktree)
+        return result
+
+    def _stream_input(self, inp, context, run_id):
+        if inp is None:
+            self._restore(run_id)
+            return None
+        return initial_state(inp, context)
+
+    def stream(
+        self,
+        inp: Optional[str],
+        context: Optional[ProjectContext],
+        callbacks=None,
+        worktree: Optional[Worktree] = None,
+        run_id: Optional[str] = None,
+    ) -> Iterator[Tuple[str, RefactoringAgentState]]:
+        """
+        `run`, yielding each node's name and the state once the node has run.
+        With no `inp` (and `context`), resumes the run `run_id`.
+        """
+        config = self._config(callbacks, worktree, run_id)
+        graph_input = self._stream_input(inp, context, run_id)
+        state = None
+        for update in self.app.stream(graph_input, config, stream_mode="updates"):
+            for node, state in update.items():
+                yield node, state
+        if state is not None:
+            self._finish_run(state["goal"], state["project_context"], worktree)
+
+    async def astream(
+        self,
+        inp: Optional[str],
+        context: Optional[ProjectContext],
+        callbacks=None,
+        worktree: Optional[Worktree] = None,
+        run_id: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, RefactoringAgentState]]:
+        """`stream` on the event loop."""
+        config = self._config(callbacks, worktree, run_id)
+        graph_input = self._stream_input(inp, context, run_id)
+        state = None
+        async for update in self.app.astream(
+            graph_input, config, stream_mode="updates"
+        ):
+            for node, state in update.items():
+                yield node, state
+        if state is not None:
+            self._finish_run(state["goal"], state["project_context"], worktree)
+
+    async def arun(
+        self,
+        inp: str,
+        context: ProjectContext,
+        callbacks=None,
+        worktree: Optional[Worktree] = None,
+        run_id: Optional[str] = None,
+    ) -> RefactoringAgentState:
+        """Runs the graph on the event loop, awaiting each node's LLM calls."""
+        state = initial_state(inp, context)
+        config = self._config(callbacks, worktree, run_id)
+        result = RefactoringAgentState(**(await self.app.ainvoke(state, config=config)))
+        self._finish_run(inp, context, worktree)
+        return result
+
+    async def aresume(
+        self,
+        run_id: str,
+        callbacks=None,
+        worktree: Optional[Worktree] = None,
+    ) -> RefactoringAgentState:
+        """`resume` on the event loop."""
+        self._restore(run_id)
+        config = self._config(callbacks, worktree, run_id)
+        result = RefactoringAgentState(**(await self.app.ainvoke(None, config=config)))
+        self._finish_run(result["goal"], result["project_context"], worktree)
         return result
@@ -1,6 +1,8 @@
+import sys
+from dataclasses import dataclass, fields
 from enum import Enum
 from langchain_core.pydantic_v1 import BaseModel, Field
-from typing import Optional, TypedDict
+from typing import List, Optional, TypedDict
 
 
 def pydantic_to_str(request: BaseModel, name: str) -> str:
@@ -9,37 +11,109 @@ def pydantic_to_str(request: BaseModel, name: str) -> str:
 
 
 class ProjectContext(BaseModel):
-    """A project context."""
+    """
+    A project context.
+
+    Symbol searches over the whole project may miss edits made to its files
+    outside the agent for up to 30 s (`RESCAN_INTERVAL`); a search narrowed
+    to a file always sees it as it is on disk.
+    """
 
     folder_path: str = Field(description="The folder path of the project")
     eval_project_id: str = Field(description="The project id")
+    flush_policy: str = Field(
+        description="When edits are written to disk: 'action', 'step' or 'run'",
+        default="action",
+    )
+    context_token_budget: Optional[int] = Field(
+        description="Tokens the rendered state may take in a prompt; None for no limit",
+        default=8000,
+    )
 
 
 ###########################################
 # Action Defs
-class Symbol(BaseModel):
+# Built in hot loops (per search result, per span, per edit), so these are
+# plain slotted records; file paths are interned, as many records share one.
+# The LLM's tool arguments are validated by the pydantic `*Input` models.
+class _Record:
+    __slots__ = ()
+
+    def __str__(self):
+        # As the pydantic models these replace rendered, e.g. in the history
+        return " ".join(f"{f.name}={getattr(self, f.name)!r}" for f in fields(self))
+
+
+@dataclass(slots=True)
+class Symbol(_Record):
+    name: str
+    file_path: str
+    line: int
+    column: int
+
+    def __post_init__(self):
+        self.file_path = sys.intern(self.file_path)
+
+
+@dataclass(slots=True)
+class CodeSpan(_Record):
+    file_path: str
+    start_line: int
+    end_line: int
+
+    def __post_init__(self):
+        self.file_path = sys.intern(self.file_path)
+
+
+@dataclass(slots=True)
+class Definition(_Record):
+    symbol: Symbol
+    span: CodeSpan
+
+
+@dataclass(slots=True)
+class CodeChange(_Record):
+    file: str
+    start_line: int
+    # Exclusive
+    end_line: int
+    replacement_code: str
+
+    def __post_init__(self):
+        self.file = sys.intern(self.file)
+
+    def replacement_lines(self) -> List[str]:
+        """The lines that replace `start_line` to `end_line`; none for ""."""
+        if self.replacement_code == "":
+            return []
+        return [f"{line}\n" for line in self.replacement_code.split("\n")]
+
+
+class SymbolInput(BaseModel):
     name: str = Field(description="The name of the symbol")
     file_path: str = Field(description="The file path of the symbol")
     line: int = Field(description="The line number of the symbol")
     column: int = Field(description="The column number of the symbol")
 
+    class Config:
+        # The schema the LLM sees is unchanged
+        title = "Symbol"
+
+    def to_symbol(self) -> Symbol:
+        return Symbol(self.name, self.file_path, self.line, self.column)
+
 
-class CodeSpan(BaseModel):
+class CodeSpanInput(BaseModel):
     file_path: str = Field(description="The file location of the span")
     start_line: int = Field(description="The starting line number of the span")
     end_line: int = Field(description="The ending line number of the span")
 
+    class Config:
+        # The schema the LLM sees is unchanged
+        title = "CodeSpan"
 
-class Definition(BaseModel):
-    symbol: Symbol = Field(description="The symbol of the definition")
-    span: CodeSpan = Field(description="The span of the definition")
-
-
-class CodeChange(BaseModel):
-    file: str = Field(description="The file to apply the change to.")
-    start_line: int = Field(description="The start line of the change.")
-    end_line: int = Field(description="The end line of the change exclusive.")
-    replacement_code: str = Field(description="The replacement code to apply.")
+    def to_span(self) -> CodeSpan:
+        return CodeSpan(self.file_path, self.start_line, self.end_line)
 
 
 ##########################################
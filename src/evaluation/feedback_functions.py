@@ -1,19 +1,57 @@
+import functools
+import json
 from math import e
-from typing import Optional
+from typing import List, Optional
 from trulens_eval import Feedback, Select
-from trulens_eval import Tru
-from trulens_eval import TruChain
 from trulens_eval.feedback import OpenAI as fOpenAI
 import numpy as np
+from langchain_core.outputs import Generation
 
-from src.planning.state import RefactoringAgentState, record_to_str
+from src.llm.cache import current_llm_cache
 
-tru = Tru()
+from src.planning.state import RefactoringAgentState, record_to_str
 
 # These are to be used by the LLMController where the second query is the one that is used
 
 sentinel = -1.0
 
+FEEDBACK_MODEL = "gpt-4-1106-preview"
+
+
+@functools.lru_cache(maxsize=None)
+def get_feedback_provider() -> fOpenAI:
+    """The trulens OpenAI provider shared by every feedback call."""
+    return fOpenAI()
+
+
+def ask_feedback_model(messages: List[dict]) -> str:
+    """
+    Asks the feedback model, answering a question asked before from the
+    installed LLM cache.
+
+    The call goes through the provider's endpoint, as trulens' own
+    feedbacks do, so it is paced and its cost tracked. It is made on the
+    client that the endpoint's wrapper holds: the wrapper itself resolves
+    `chat` to the bare descriptor while costs are being tracked.
+    """
+    cache = current_llm_cache()
+    prompt = json.dumps(messages, sort_keys=True)
+    llm_string = f"feedback:{FEEDBACK_MODEL}"
+    if cache is not None:
+        cached = cache.lookup(prompt, llm_string)
+        if cached:
+            return cached[0].text
+    endpoint = get_feedback_provider().endpoint
+    completion = endpoint.run_in_pace(
+        func=endpoint.client.client.chat.completions.create,
+        model=FEEDBACK_MODEL,
+        messages=messages,
+    )
+    content = completion.choices[0].message.content
+    if cache is not None:
+        cache.update(prompt, llm_string, [Generation(text=content)])
+    return content
+
 
 def create_sentinel_aggregator(agg):
     def aggregator(values):
@@ -26,7 +64,6 @@ def create_sentinel_aggregator(agg):
 
 def create_tool_relevance_feedback(state):
     def tool_relevance(output) -> float:
-        provider = fOpenAI()
         # return sentinel if the output is not a dict
         if (
             not isinstance(output, dict)
@@ -37,9 +74,8 @@ def create_tool_relevance_feedback(state):
         tool_id = output["tool"]
         tool_input = output["tool_input"]
         res = float(
-            provider.endpoint.client.chat.completions.create(
-                model="gpt-4-1106-preview",
-                messages=[
+            ask_feedback_model(
+                [
                     {
                         "role": "system",
                         "content": "How relevant was the selection of TOOL with TOOL_INPUT in addressing the current task in STATE? Reply with a number between 0 and 10.",
@@ -48,10 +84,8 @@ def create_tool_relevance_feedback(state):
                         "role": "user",
                         "content": f"TOOL: {tool_id}; TOOL_INPUT: {tool_input}; STATE: {state}",
                     },
-                ],
+                ]
             )
-            .choices[0]
-            .message.content
         )
         return res
 
@@ -72,7 +106,6 @@ def create_short_thought_feedback():
 
 def create_evolving_thought_feedback(state: RefactoringAgentState):
     def evolving_thought(thought: str):
-        provider = fOpenAI()
         past_thoughts_actions = []
         if len(state["history"]) == 0:
             return 1.0
@@ -81,9 +114,8 @@ def create_evolving_thought_feedback(state: RefactoringAgentState):
                 f"#T{i}: {state['thoughts'][i]}\n#A{i}: {record_to_str(state['history'][i])}"
             )
         res = float(
-            provider.endpoint.client.chat.completions.create(
-                model="gpt-4-1106-preview",
-                messages=[
+            ask_feedback_model(
+                [
                     {
                         "role": "system",
                         "content": "Given PAST_THOUGHTS_AND_ACTIONS, how much has the NEXT_THOUGHT added to solving the ULTIMATE_GOAL? Give a number between 0 to 1 where 1 means it has contributed to achieving the goal in its fullest. Reply only with a number, for example: '0.75'",
@@ -92,10 +124,8 @@ def create_evolving_thought_feedback(state: RefactoringAgentState):
                         "role": "user",
                         "content": f"### PAST_THOUGHTS_AND_ACTIONS ###\n {past_thoughts_actions}\n\n\n ### NEXT_THOUGHT ###\n {thought}\n\n\n ### ULTIMATE_GOAL ###\n {state['goal']}",
                     },
-                ],
+                ]
             )
-            .choices[0]
-            .message.content
         )
         return res
 
@@ -104,16 +134,14 @@ def create_evolving_thought_feedback(state: RefactoringAgentState):
 
 def create_repeating_work_feedback(state: RefactoringAgentState):
     def no_repeated_work(thought: str):
-        provider = fOpenAI()
         past_thoughts_actions = []
         if len(state["history"]) == 0:
             return 1.0
         for i in range(len(state["history"]) - 1):
             past_thoughts_actions.append(f"#A{i}: {record_to_str(state['history'][i])}")
         res = float(
-            provider.endpoint.client.chat.completions.create(
-                model="gpt-4-1106-preview",
-                messages=[
+            ask_feedback_model(
+                [
                     {
                         "role": "system",
                         "content": "Given PAST_ACTIONS, how much is the NEXT_THOUGHT suggesting we repeat work already completed? Give a number between 0 to 1 where 1 means it is suggesting a full repeat of work already completed. Reply only with a number, for example: '0.5'",
@@ -122,10 +150,8 @@ def create_repeating_work_feedback(state: RefactoringAgentState):
                         "role": "user",
                         "content": f"### PAST_ACTIONS ###\n {past_thoughts_actions}\n\n\n ### NEXT_THOUGHT ###\n {thought}",
                     },
-                ],
+                ]
             )
-            .choices[0]
-            .message.content
         )
         return 1 - res
 
@@ -1,8 +1,14 @@
+import asyncio
+import contextlib
+import contextvars
+import copy
 import json
-from typing import Dict, List
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from langchain_openai import ChatOpenAI
 from langchain_core.utils.function_calling import convert_to_openai_function
-from trulens_eval import FeedbackMode, TruChain
 
 from langchain.prompts import (
     PromptTemplate,
@@ -14,9 +20,8 @@ from langchain.prompts import (
 from langchain.output_parsers.openai_tools import JsonOutputToolsParser
 from langchain_core.output_parsers import JsonOutputParser
 from langchain.agents import initialize_agent, AgentType
-from langchain import hub
 from langchain.agents import AgentExecutor, create_openai_tools_agent
-from src.actions.action import Action
+from src.actions.action import EXCLUSIVE, Action, Effects
 from src.common.definitions import (
     ActionSuccess,
     FailureReason,
@@ -27,11 +32,12 @@ from src.planning.state import (
     ActionRequest,
     FeedbackMessage,
     RefactoringAgentState,
-    state_to_str,
+    render_context,
 )
+from src.llm.cache import current_llm_cache
+from src.llm.prompts import load_agent_prompt
+from src.utilities import tracing
 from src.utilities.formatting import format_list
-from .evaluation.feedback_functions import *
-from trulens_eval.app import App
 
 
 class ActionDispatcher:
@@ -60,6 +66,13 @@ class ActionDispatcher:
         """
         return list(self.actions.values())
 
+    def effects_of(self, request: ActionRequest) -> Effects:
+        action = self.actions.get(request["id"])
+        if action is None:
+            # Fails when dispatched, in plan order
+            return EXCLUSIVE
+        return action.effects_of(request["args"])
+
     def dispatch(
         self, state: RefactoringAgentState, request: ActionRequest
     ) -> ActionRecord:
@@ -76,24 +89,25 @@ class ActionDispatcher:
         """
         id = request["id"]
         args = request["args"]
-        action = self.actions.get(id)
-        if action:
-            try:
-                observation = action.execute(state, args)
-                return ActionRecord(
-                    request=request,
-                    result=observation,
-                )
-            except Exception as e:
+        with tracing.span(id, "dispatch"):
+            action = self.actions.get(id)
+            if action:
+                try:
+                    observation = action.execute(state, args)
+                    return ActionRecord(
+                        request=request,
+                        result=observation,
+                    )
+                except Exception as e:
+                    raise FeedbackMessage(
+                        FailureReason.ACTION_FAILED, str(e), request=request
+                    )
+            else:
                 raise FeedbackMessage(
-                    FailureReason.ACTION_FAILED, str(e), request=request
+                    FailureReason.ACTION_NOT_FOUND,
+                    f"Action {id} not found",
+                    request=request,
                 )
-        else:
-            raise FeedbackMessage(
-                FailureReason.ACTION_NOT_FOUND,
-                f"Action {id} not found",
-                request=request,
-            )
 
 
 class ExecuteTopOfPlan:
@@ -120,18 +134,175 @@ class ExecuteTopOfPlan:
         return state
 
 
+DEFAULT_PLAN_WORKERS = 4
+
+
+class _DeferredChanges:
+    """
+    A field of the state as a concurrently run plan entry sees it: its
+    changes are kept to be applied in plan order, and reads go to a copy
+    of the field made (under `lock`, which applying takes too) on the
+    first read, so they never see changes half-applied.
+    """
+
+    CHANGES = frozenset({"append", "extend", "apply_change"})
+
+    def __init__(self, field, lock: threading.Lock):
+        self._field = field
+        self._lock = lock
+        self._snapshot = None
+        self._calls: List[Tuple[str, tuple, dict]] = []
+
+    def _read(self):
+        if self._snapshot is None:
+            with self._lock:
+                self._snapshot = copy.deepcopy(self._field)
+        return self._snapshot
+
+    def __getattr__(self, name):
+        if name in self.CHANGES:
+            return lambda *args, **kwargs: self._calls.append((name, args, kwargs))
+        return getattr(self._read(), name)
+
+    def __iter__(self):
+        return iter(self._read())
+
+    def __len__(self):
+        return len(self._read())
+
+    def __getitem__(self, index):
+        return self._read()[index]
+
+    def apply(self):
+        with self._lock:
+            for name, args, kwargs in self._calls:
+                getattr(self._field, name)(*args, **kwargs)
+
+
+def _deferred_view(
+    state: RefactoringAgentState, effects: Effects, lock: threading.Lock
+) -> RefactoringAgentState:
+    view = dict(state)
+    for key in effects.changes:
+        view[key] = _DeferredChanges(state[key], lock)
+    return view
+
+
+def _apply_view(view: RefactoringAgentState):
+    for value in view.values():
+        if isinstance(value, _DeferredChanges):
+            value.apply()
+
+
+class PlanScheduler:
+    """
+    Runs a batch of plan entries, concurrently where their effects allow.
+
+    An entry waits for every earlier entry it conflicts with (see
+    `Effects.conflicts_with`), so edits to a file run one at a time in plan
+    order, reads of a file wait for earlier edits to it, and an action that
+    does not declare its effects runs alone. Everything else, such as a run
+    of searches, runs at once on a thread pool. Entries run concurrently
+    change the state fields their effects name (`Effects.changes`, e.g. the
+    code blocks) through a view of it, and their changes are applied in
+    plan order once every earlier entry is done, as are records and
+    feedback: the state ends up as a sequential run leaves it, whichever
+    entry finishes first.
+    """
+
+    def __init__(
+        self, dispatcher: ActionDispatcher, max_workers: int = DEFAULT_PLAN_WORKERS
+    ):
+        self.dispatcher = dispatcher
+        self.max_workers = max_workers
+
+    def _dispatch(
+        self, state: RefactoringAgentState, request: ActionRequest
+    ) -> Union[ActionRecord, FeedbackMessage]:
+        try:
+            return self.dispatcher.dispatch(state, request)
+        except FeedbackMessage as f:
+            return f
+
+    def run(self, state: RefactoringAgentState, requests: List[ActionRequest]):
+        effects = [self.dispatcher.effects_of(request) for request in requests]
+        waits_for = [
+            {j for j in range(i) if effects[i].conflicts_with(effects[j])}
+            for i in range(len(requests))
+        ]
+        outcomes: List[Union[ActionRecord, FeedbackMessage, None]]
+        outcomes = [None] * len(requests)
+        if len(requests) == 1 or self.max_workers == 1:
+            for i, request in enumerate(requests):
+                outcomes[i] = self._dispatch(state, request)
+        else:
+            with ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="plan"
+            ) as pool:
+                self._run_concurrently(
+                    pool, state, requests, effects, waits_for, outcomes
+                )
+
+        for outcome in outcomes:
+            if isinstance(outcome, FeedbackMessage):
+                state["feedback"].append(outcome)
+            else:
+                state["history"].append(outcome)
+
+    def _run_concurrently(self, pool, state, requests, effects, waits_for, outcomes):
+        waiting = list(range(len(requests)))
+        running: Dict[Future, int] = {}
+        views: Dict[int, RefactoringAgentState] = {}
+        # Views read their fields while earlier views are applied
+        lock = threading.Lock()
+        done = set()
+        # Entries before this one are done and their changes applied
+        applied = 0
+        while waiting or running:
+            for i in [i for i in waiting if waits_for[i] <= done]:
+                waiting.remove(i)
+                # An exclusive entry runs alone, once every earlier change is applied
+                target = state
+                if not effects[i].exclusive:
+                    target = views[i] = _deferred_view(state, effects[i], lock)
+                # Each entry gets its own copy, so its spans nest in the caller's
+                context = contextvars.copy_context()
+                future = pool.submit(context.run, self._dispatch, target, requests[i])
+                running[future] = i
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                outcomes[i] = future.result()
+                done.add(i)
+            while applied in done:
+                if applied in views:
+                    _apply_view(views.pop(applied))
+                applied += 1
+
+
 class ExecutePlan:
-    def __init__(self, action_list: List[Action]) -> None:
+    def __init__(
+        self, action_list: List[Action], max_workers: int = DEFAULT_PLAN_WORKERS
+    ) -> None:
         self.executor = ExecuteTopOfPlan(action_list)
+        self.scheduler = PlanScheduler(self.executor.dispatcher, max_workers)
 
     def __call__(self, state: RefactoringAgentState):
+        # Actions may add to the plan while it runs
         while len(state["plan"]) > 0:
-            state = self.executor(state)
+            requests, state["plan"] = state["plan"], []
+            self.scheduler.run(state, requests)
         return state
 
 
 # Given a prompt, the LLMControler will dispatch a suitable action
 
+DEFAULT_MODEL = "gpt-4-1106-preview"
+
+# Creating a recorder registers its app in the trulens database; concurrent
+# sessions registering the same app at once would both insert it
+_recorder_lock = threading.Lock()
+
 default_instructions = """
 Now invoke suitable functions to complete the Current Task. 
 Arguments for the functions should be constructed from the context provided, including from the output of past actions.
@@ -139,31 +310,56 @@ Do not send other messages other than invoking functions.
 """
 
 
+def _function_arguments(message, schema: dict) -> Optional[dict]:
+    name = schema["function"]["name"]
+    for call in message.additional_kwargs.get("tool_calls", []):
+        if call["function"]["name"] == name:
+            try:
+                return json.loads(call["function"]["arguments"])
+            except ValueError:
+                return None
+    return None
+
+
 class LLMController:
     def __init__(
         self,
         actions: List[Action],
         current_task: str,
-        verbose=True,
+        verbose=False,
         additional_instructions=default_instructions,
         eval_factory=None,
         record_history=True,
+        llm=None,
+        feedback_mode=None,
     ):
         self.actions = actions
-        self.llm = ChatOpenAI(model="gpt-4-1106-preview")
+        self.llm = llm if llm is not None else ChatOpenAI(model=DEFAULT_MODEL)
         self.current_task = current_task
         self.verbose = verbose
         self.additional_instructions = additional_instructions
         self.record_history = record_history
         self.eval_factory = eval_factory
+        # Feedbacks are scored on trulens' worker threads by default
+        # (FeedbackMode.WITH_APP_THREAD), so the step returns as soon as the
+        # LLM has answered
+        self.feedback_mode = feedback_mode
+        # The tools and executor are built once; the state of the step being
+        # run is bound through this context variable instead
+        self._current_state: ContextVar[RefactoringAgentState] = ContextVar(
+            f"llm_controller_state_{id(self)}"
+        )
+        self._tools = None
+        self._agent_executor: Optional[AgentExecutor] = None
+        self._executor_streams = False
+        self._uncached_llm = None
 
         self.create_prompt()
         # self.chain = self.prompt_template | self.llm | self.parser
 
     def create_prompt(self):
-        # For execution
-        prompt = hub.pull("hwchase17/openai-tools-agent")
-        self.agent_prompt = prompt
+        # For execution (vendored/cached locally and shared by every controller)
+        self.agent_prompt = load_agent_prompt()
         # For Context
         # TODO: Evaluate this part
         message = f"""### Instructions ###
@@ -177,19 +373,25 @@ class LLMController:
         self.context_prompt = PromptTemplate.from_template(message)
 
     def format_context_prompt(self, state: RefactoringAgentState) -> str:
-        message_sent = self.context_prompt.format(state=state_to_str(state))
-        if self.verbose:
-            print(message_sent)
-            pass
+        context, report = render_context(state)
+        message_sent = self.context_prompt.format(state=context)
+        tracing.count_prompt(message_sent)
+        tracing.count("context_dropped", report.dropped)
+        if self.verbose and (report.dropped or report.summarised_history):
+            print(report)
         return message_sent
 
     def get_openai_tools(self, state):
+        return self._create_tools(lambda: state)
+
+    def _create_tools(self, get_state: Callable[[], RefactoringAgentState]):
         actions = self.actions
         if self.record_history:
 
             def wrap_with_history(action: Action):
                 def wrapped_action(state: RefactoringAgentState, args):
-                    result = action.execute(state, args)
+                    # The wrapping action's span covers this call
+                    result = action.f(state, args)
                     request = ActionRequest(id=action.id, args=args)
                     state["history"].append(
                         ActionRecord(request=request, result=result)
@@ -201,40 +403,147 @@ class LLMController:
                     description=action.description,
                     model_cls=action.cls,
                     f=wrapped_action,
+                    effects=action.effects,
                 )
 
             actions = map(wrap_with_history, actions)
-        tools = map(lambda x: x.to_tool(state), actions)
+        tools = map(lambda x: x.to_bound_tool(get_state), actions)
         # open_ai_tools = map(convert_to_openai_function, tools)
         return list(tools)
 
-    def run(self, state: RefactoringAgentState):
+    def run(self, state: RefactoringAgentState, use_cache=True):
         if len(self.actions) == 0:
-            return self.run_without_tools(state)
+            return self.run_without_tools(state, use_cache)
         else:
             return self.run_with_tools(state)
 
-    def run_without_tools(self, state):
-        self.llm = ChatOpenAI(model="gpt-4-1106-preview")
-        if self.eval_factory is not None:
-
-            tru_llm = TruChain(
+    async def arun(self, state: RefactoringAgentState, use_cache=True):
+        if len(self.actions) == 0:
+            return await self.arun_without_tools(state, use_cache)
+        else:
+            return await self.arun_with_tools(state)
+
+    def _get_llm(self, use_cache: bool):
+        """The llm, or a copy of it that neither reads nor fills the LLM cache."""
+        if use_cache or current_llm_cache() is None:
+            return self.llm
+        if self._uncached_llm is None:
+            self._uncached_llm = copy.copy(self.llm)
+            self._uncached_llm.cache = False
+        return self._uncached_llm
+
+    def _recorder(self, state: RefactoringAgentState):
+        """Records the LLM call (and schedules its feedbacks) if evaluated."""
+        if self.eval_factory is None:
+            return contextlib.nullcontext()
+        # trulens is only imported (and its database opened) once evaluated
+        from trulens_eval import FeedbackMode, TruChain
+
+        with _recorder_lock:
+            return TruChain(
                 self.llm,
                 app_id=state["project_context"].eval_project_id,
                 feedbacks=self.eval_factory(state),
+                feedback_mode=self.feedback_mode or FeedbackMode.WITH_APP_THREAD,
             )
-            with tru_llm:
-                output = self.llm.invoke(self.format_context_prompt(state))
+
+    def _streams(self) -> bool:
+        # As in the tools agent: streamed calls bypass the LLM cache, and
+        # trulens only records `invoke`
+        return self.eval_factory is None and current_llm_cache() is None
+
+    def run_without_tools(self, state, use_cache=True):
+        llm = self._get_llm(use_cache)
+        message = self.format_context_prompt(state)
+        if self._streams():
+            # Callbacks see each token as it is generated
+            chunks = list(llm.stream(message))
+            return state, "".join(chunk.content for chunk in chunks)
+        with self._recorder(state):
+            output = llm.invoke(message)
+        return state, output.content
+
+    async def arun_without_tools(self, state, use_cache=True):
+        llm = self._get_llm(use_cache)
+        message = self.format_context_prompt(state)
+        if self._streams():
+            chunks = [chunk async for chunk in llm.astream(message)]
+            return state, "".join(chunk.content for chunk in chunks)
+        if self.eval_factory is None:
+            output = await llm.ainvoke(message)
         else:
-            output = self.llm.invoke(self.format_context_prompt(state))
+            # trulens only records the synchronous `invoke`; run it on a
+            # thread (which inherits the recording context) instead
+            with self._recorder(state):
+                output = await asyncio.to_thread(llm.invoke, message)
         return state, output.content
 
-    def run_with_tools(self, state):
-        tools = self.get_openai_tools(state)
+    def _bind_schema(self, schema: dict, use_cache: bool):
+        name = schema["function"]["name"]
+        return self._get_llm(use_cache).bind(
+            tools=[schema], tool_choice={"type": "function", "function": {"name": name}}
+        )
 
-        # Construct the OpenAI Tools agent
-        agent = create_openai_tools_agent(self.llm, tools, self.agent_prompt)
-        agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=False)
+    def run_with_schema(
+        self, state, schema: dict, use_cache=True
+    ) -> Tuple[RefactoringAgentState, Optional[dict]]:
+        """
+        Makes the LLM call the function `schema` (an OpenAI tool) once; its
+        arguments, or None if it was not called with valid JSON.
+        """
+        llm = self._bind_schema(schema, use_cache)
+        with self._recorder(state):
+            output = llm.invoke(self.format_context_prompt(state))
+        return state, _function_arguments(output, schema)
+
+    async def arun_with_schema(
+        self, state, schema: dict, use_cache=True
+    ) -> Tuple[RefactoringAgentState, Optional[dict]]:
+        llm = self._bind_schema(schema, use_cache)
+        message = self.format_context_prompt(state)
+        if self.eval_factory is None:
+            output = await llm.ainvoke(message)
+        else:
+            with self._recorder(state):
+                output = await asyncio.to_thread(llm.invoke, message)
+        return state, _function_arguments(output, schema)
+
+    def get_tools(self):
+        """The actions as tools, built once; they act on the state `bind_state` binds."""
+        if self._tools is None:
+            self._tools = self._create_tools(self._current_state.get)
+        return self._tools
+
+    @contextlib.contextmanager
+    def bind_state(self, state: RefactoringAgentState):
+        """Binds `state` as the state of the step being run, for the tools."""
+        token = self._current_state.set(state)
+        try:
+            yield
+        finally:
+            self._current_state.reset(token)
+
+    def get_agent_executor(self) -> AgentExecutor:
+        # Streamed calls bypass the LLM cache, so the executor streams only
+        # while none is installed, and is rebuilt if that changes
+        stream = current_llm_cache() is None
+        if self._agent_executor is None or self._executor_streams != stream:
+            tools = self.get_tools()
+
+            # Construct the OpenAI Tools agent
+            agent = create_openai_tools_agent(self.llm, tools, self.agent_prompt)
+            self._agent_executor = AgentExecutor(
+                agent=agent,
+                tools=tools,
+                verbose=False,
+                stream_runnable=stream,
+            )
+            self._executor_streams = stream
+        return self._agent_executor
+
+    def run_with_tools(self, state):
+        agent_executor = self.get_agent_executor()
+        token = self._current_state.set(state)
 
         #  tru_agent = TruChain(
         #      agent,
@@ -258,8 +567,32 @@ class LLMController:
         except FeedbackMessage as f:
             state["feedback"].append(f)
         finally:
+            self._current_state.reset(token)
             return state, output
 
+    async def arun_with_tools(self, state):
+        agent_executor = self.get_agent_executor()
+        # Each task has its own context, so concurrent runs see their own state
+        token = self._current_state.set(state)
+        output = ""
+        try:
+            try:
+                result = await agent_executor.ainvoke(
+                    {"input": self.format_context_prompt(state)}
+                )
+                output = result["output"]
+            except Exception as e:
+                raise FeedbackMessage(FailureReason.ACTION_FAILED, str(e))
+        except FeedbackMessage as f:
+            state["feedback"].append(f)
+        finally:
+            self._current_state.reset(token)
+        return state, output
+
     def __call__(self, state: RefactoringAgentState):
         state, output = self.run(state)
         return state
+
+    async def acall(self, state: RefactoringAgentState):
+        state, output = await self.arun(state)
+        return state
@@ -0,0 +1,421 @@
+import ast
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Collection, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from src.common.definitions import CodeSpan, Definition, Symbol
+from src.indexing.trigram_index import TrigramIndex, rank
+from src.utilities import tracing
+from src.utilities.file_buffers import get_buffer_cache
+from src.utilities.paths import file_stamp, get_cache_dir, standardize_code_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    hash TEXT
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    name TEXT NOT NULL,
+    lower_name TEXT NOT NULL,
+    qualified_name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    column INTEGER NOT NULL,
+    end_line INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_lower_name ON symbols (lower_name);
+CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path);
+"""
+
+IGNORED_DIRS = {"__pycache__", "node_modules", "venv", ".venv", "env", "build"}
+# Below this many files a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+
+class IndexedSymbol(NamedTuple):
+    name: str
+    qualified_name: str
+    kind: str
+    path: str
+    line: int
+    column: int
+    end_line: int
+
+    def to_definition(self) -> Definition:
+        symbol = Symbol(
+            name=self.name, file_path=self.path, line=self.line, column=self.column
+        )
+        span = CodeSpan(
+            file_path=self.path, start_line=self.line, end_line=self.end_line
+        )
+        return Definition(symbol=symbol, span=span)
+
+
+def _assigned_names(node: ast.AST) -> Iterator[ast.Name]:
+    targets = []
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
+        targets = [node.target]
+    for target in targets:
+        for sub in ast.walk(target):
+            if isinstance(sub, ast.Name):
+                yield sub
+
+
+def extract_symbols(code: str, path: str) -> List[IndexedSymbol]:
+    """Every class, function, method and module/class level assignment of a module."""
+    tree = ast.parse(code)
+    symbols: List[IndexedSymbol] = []
+
+    def visit(body, scope: List[str], in_class: bool):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if isinstance(node, ast.ClassDef):
+                    kind, keyword = "class", "class "
+                else:
+                    kind = "method" if in_class else "function"
+                    keyword = (
+                        "async def "
+                        if isinstance(node, ast.AsyncFunctionDef)
+                        else "def "
+                    )
+                qualified = ".".join([*scope, node.name])
+                symbols.append(
+                    IndexedSymbol(
+                        node.name,
+                        qualified,
+                        kind,
+                        path,
+                        node.lineno,
+                        node.col_offset + len(keyword),
+                        node.end_lineno or node.lineno,
+                    )
+                )
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, [*scope, node.name], True)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+                for name in _assigned_names(node):
+                    symbols.append(
+                        IndexedSymbol(
+                            name.id,
+                            ".".join([*scope, name.id]),
+                            "variable",
+                            path,
+                            node.lineno,
+                            name.col_offset,
+                            node.end_lineno or node.lineno,
+                        )
+                    )
+            elif isinstance(node, (ast.If, ast.Try, ast.With)):
+                # Definitions guarded by `if TYPE_CHECKING:`, `try: import` etc.
+                for child in ("body", "orelse", "finalbody"):
+                    visit(getattr(node, child, []), scope, in_class)
+                for handler in getattr(node, "handlers", []):
+                    visit(handler.body, scope, in_class)
+
+    visit(tree.body, [], False)
+    return symbols
+
+
+def _hash(code: str) -> str:
+    return hashlib.sha1(code.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def parse_file(
+    args: Tuple[str, str, Optional[str]],
+) -> Tuple[str, str, Optional[List[IndexedSymbol]]]:
+    """
+    Reads and indexes one file; runs in the worker processes on a cold start.
+
+    Returns no symbols if the content hash still matches `known_hash`.
+    """
+    abs_path, path, known_hash = args
+    with open(abs_path, "r", encoding="utf-8", errors="replace") as file:
+        code = file.read()
+    digest = _hash(code)
+    if digest == known_hash:
+        return path, digest, None
+    try:
+        symbols = extract_symbols(code, path)
+    except (SyntaxError, ValueError):
+        symbols = []
+    return path, digest, symbols
+
+
+class SymbolIndex:
+    """
+    A persistent index of the definitions in a project.
+
+    `update` walks the project and re-parses only the files whose mtime/size
+    and then content hash changed, using a process pool when many files need
+    parsing. Files edited through the agent are marked with `mark_dirty` and
+    re-parsed from their in-memory contents on the next lookup.
+    """
+
+    def __init__(self, folder_path: str, db_path: Optional[str] = None):
+        self.folder_path = os.path.abspath(folder_path)
+        if db_path is None:
+            key = hashlib.sha1(self.folder_path.encode()).hexdigest()[:16]
+            db_path = os.path.join(get_cache_dir("index"), f"{key}.sqlite")
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.last_update: Optional[float] = None
+        self._dirty: Dict[str, Optional[str]] = {}
+        # Built on the first fuzzy search, then patched per changed file
+        self._trigrams: Optional[TrigramIndex] = None
+        self._changed: Set[str] = set()
+
+    def _relative(self, abs_path: str) -> str:
+        return "/" + os.path.relpath(abs_path, self.folder_path).replace(os.sep, "/")
+
+    def _walk(self) -> Iterator[str]:
+        for root, dirs, files in os.walk(self.folder_path):
+            dirs[:] = [
+                d for d in dirs if not d.startswith(".") and d not in IGNORED_DIRS
+            ]
+            for name in files:
+                if name.endswith(".py"):
+                    yield os.path.join(root, name)
+
+    def update(
+        self, workers: Optional[int] = None, unflushed: Collection[str] = ()
+    ) -> int:
+        """
+        Syncs the index with the files on disk; returns how many were re-parsed.
+
+        The files at the absolute paths `unflushed` are edited in memory and
+        stale on disk: they keep the symbols `mark_dirty` gave them, and are
+        re-checked once written out.
+        """
+        with self.lock:
+            known, hashes = {}, {}
+            for path, mtime, size, digest in self.db.execute(
+                "SELECT path, mtime_ns, size, hash FROM files"
+            ):
+                known[path] = (mtime, size)
+                hashes[path] = digest
+            stamps = {}
+            changed: List[Tuple[str, str, Optional[str]]] = []
+            for abs_path in self._walk():
+                path = self._relative(abs_path)
+                stamps[path] = file_stamp(abs_path)
+                if abs_path in unflushed:
+                    continue
+                if known.get(path) != stamps[path]:
+                    changed.append((abs_path, path, hashes.get(path)))
+
+            removed = set(known) - set(stamps)
+            for path in removed:
+                self._delete(path)
+
+            if len(changed) >= PARALLEL_THRESHOLD and workers != 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    parsed = list(pool.map(parse_file, changed, chunksize=16))
+            else:
+                parsed = [parse_file(item) for item in changed]
+
+            reparsed = self._record(parsed, stamps)
+            self.last_update = time.monotonic()
+            return reparsed
+
+    def update_file(self, file_path: str, unflushed: Collection[str] = ()) -> int:
+        """`update` for the one project-relative `file_path`."""
+        abs_path = os.path.join(self.folder_path, standardize_code_path(file_path))
+        path = self._relative(abs_path)
+        with self.lock:
+            if abs_path in unflushed:
+                return 0
+            row = self.db.execute(
+                "SELECT mtime_ns, size, hash FROM files WHERE path = ?", (path,)
+            ).fetchone()
+            if not os.path.isfile(abs_path):
+                if row is not None:
+                    self._delete(path)
+                    self.db.commit()
+                return 0
+            stamp = file_stamp(abs_path)
+            if row is None and not path.endswith(".py"):
+                return 0
+            if row is not None and (row[0], row[1]) == stamp:
+                return 0
+            known_hash = row[2] if row is not None else None
+            parsed = [parse_file((abs_path, path, known_hash))]
+            return self._record(parsed, {path: stamp})
+
+    def _record(self, parsed, stamps) -> int:
+        reparsed = 0
+        for path, digest, symbols in parsed:
+            if symbols is not None:
+                self._store(path, symbols)
+                reparsed += 1
+            mtime, size = stamps[path]
+            # Read here or by a worker process
+            tracing.count("bytes_read", size)
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path, mtime, size, digest),
+            )
+        self.db.commit()
+        return reparsed
+
+    def _delete(self, path: str):
+        self._changed.add(path)
+        self.db.execute("DELETE FROM symbols WHERE path = ?", (path,))
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _store(self, path: str, symbols: List[IndexedSymbol]):
+        self._changed.add(path)
+        self.db.execute("DELETE FROM symbols WHERE path = ?", (path,))
+        self.db.executemany(
+            "INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (s.name, s.name.lower(), s.qualified_name, s.kind, *s[3:])
+                for s in symbols
+            ],
+        )
+
+    def mark_dirty(self, file_path: str, code: Optional[str] = None):
+        """Re-parse `file_path` (from `code`, or from disk) before the next lookup."""
+        with self.lock:
+            self._dirty["/" + standardize_code_path(file_path)] = code
+
+    def _refresh_dirty(self):
+        for path, code in self._dirty.items():
+            abs_path = os.path.join(self.folder_path, standardize_code_path(path))
+            if code is None:
+                if not os.path.exists(abs_path):
+                    self._delete(path)
+                    continue
+                with open(abs_path, "r", encoding="utf-8", errors="replace") as file:
+                    code = file.read()
+                tracing.count("bytes_read", len(code))
+            try:
+                self._store(path, extract_symbols(code, path))
+            except (SyntaxError, ValueError):
+                # Keep the last good symbols of a file that is mid-edit
+                continue
+            # Force the next scan to re-check the file on disk
+            self.db.execute(
+                "UPDATE files SET mtime_ns = -1, hash = ? WHERE path = ?",
+                (_hash(code), path),
+            )
+        self._dirty.clear()
+        self.db.commit()
+
+    def _select(self, where: str, params: list) -> List[IndexedSymbol]:
+        sql = (
+            "SELECT name, qualified_name, kind, path, line, column, end_line"
+            " FROM symbols"
+        )
+        if where:
+            sql += " WHERE " + where
+        return [IndexedSymbol(*row) for row in self.db.execute(sql, params)]
+
+    def _sync_trigrams(self) -> TrigramIndex:
+        if self._trigrams is None:
+            self._trigrams = TrigramIndex()
+            for symbol in self._select("", []):
+                self._trigrams.add(symbol)
+        else:
+            for path in self._changed:
+                self._trigrams.replace_path(path, self._select("path = ?", [path]))
+        self._changed.clear()
+        return self._trigrams
+
+    def search(
+        self,
+        query: str,
+        fuzzy: bool = False,
+        file_path: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[IndexedSymbol]:
+        """
+        The `limit` best matches for `query`, ranked by match quality.
+
+        An exact search is a prefix lookup narrowed to `file_path`. A fuzzy
+        search scores every symbol sharing a trigram with the query, and uses
+        `file_path` only to rank nearby symbols higher.
+        """
+        if not fuzzy:
+            return rank(
+                query, self.lookup(query, file_path=file_path), file_path, limit
+            )
+        with self.lock:
+            if self._dirty:
+                self._refresh_dirty()
+            return self._sync_trigrams().search(query, file_path, limit)
+
+    def lookup(
+        self,
+        query: str,
+        prefix: bool = True,
+        file_path: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[IndexedSymbol]:
+        """Case-insensitive name (or name prefix) lookup, optionally within one file."""
+        with self.lock:
+            if self._dirty:
+                self._refresh_dirty()
+            lower = query.lower()
+            if prefix:
+                # A range scan on the name index rather than LIKE
+                where = "lower_name >= ? AND lower_name < ?"
+                params: list = [lower, lower + "\U0010ffff"]
+            else:
+                where = "lower_name = ?"
+                params = [lower]
+            if file_path is not None:
+                where += " AND path = ?"
+                params.append("/" + standardize_code_path(file_path))
+            where += " ORDER BY path, line"
+            if limit is not None:
+                where += " LIMIT ?"
+                params.append(limit)
+            return self._select(where, params)
+
+    def paths(self) -> Set[str]:
+        with self.lock:
+            return {path for (path,) in self.db.execute("SELECT path FROM files")}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_indices: Dict[str, SymbolIndex] = {}
+_indices_lock = threading.Lock()
+# How long a full rescan of the project is trusted for: a project-wide query
+# may miss edits made outside the agent for this long
+RESCAN_INTERVAL = 30.0
+
+
+def get_symbol_index(context, file_path: Optional[str] = None) -> SymbolIndex:
+    """
+    Returns the symbol index of the project, updating it if it is stale but
+    for the files with unflushed edits. The `file_path` a query is narrowed
+    to is re-checked on disk every time.
+    """
+    key = os.path.abspath(context.folder_path)
+    with _indices_lock:
+        index = _indices.get(key)
+        if index is None:
+            index = _indices[key] = SymbolIndex(key)
+    unflushed = get_buffer_cache(context).dirty_paths()
+    if (
+        index.last_update is None
+        or time.monotonic() - index.last_update > RESCAN_INTERVAL
+    ):
+        index.update(unflushed=unflushed)
+    elif file_path is not None:
+        index.update_file(file_path, unflushed)
+    return index
@@ -0,0 +1,139 @@
+import heapq
+import posixpath
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+from src.utilities.paths import standardize_code_path
+
+if TYPE_CHECKING:
+    from src.indexing.symbol_index import IndexedSymbol
+
+# Fuzzy matches scoring below this are noise
+MIN_SCORE = 0.3
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text.lower()} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def proximity(path: str, near: Optional[str]) -> float:
+    """How close `path` is to the file the search was narrowed to, from 0 to 1."""
+    if near is None:
+        return 0.0
+    path = standardize_code_path(path)
+    near = standardize_code_path(near)
+    if path == near:
+        return 1.0
+    a = posixpath.dirname(path).split("/")
+    b = posixpath.dirname(near).split("/")
+    shared = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        shared += 1
+    return 0.5 * shared / max(len(a), len(b))
+
+
+def match_quality(query: str, symbol: "IndexedSymbol", similarity: float) -> float:
+    name = symbol.name.lower()
+    query = query.lower()
+    if name == query:
+        return 2.0
+    if name.startswith(query):
+        return 1.5 + 0.5 * len(query) / len(name)
+    if query in name or query in symbol.qualified_name.lower():
+        return 1.0 + similarity
+    return similarity
+
+
+def rank(
+    query: str,
+    symbols: Iterable["IndexedSymbol"],
+    near: Optional[str] = None,
+    limit: int = 10,
+    similarities: Optional[Dict["IndexedSymbol", float]] = None,
+) -> List["IndexedSymbol"]:
+    """The `limit` best symbols by match quality, then proximity to `near`."""
+
+    def score(symbol: "IndexedSymbol") -> Tuple[float, float, int]:
+        similarity = similarities.get(symbol, 0.0) if similarities else 0.0
+        quality = match_quality(query, symbol, similarity)
+        # Shorter definitions break ties; they cost fewer prompt tokens
+        return (
+            quality + 0.5 * proximity(symbol.path, near),
+            quality,
+            -(symbol.end_line - symbol.line),
+        )
+
+    return heapq.nlargest(limit, symbols, key=score)
+
+
+class TrigramIndex:
+    """
+    An inverted index from trigrams of symbol names and qualified names to symbols.
+
+    Candidates are scored by the Dice coefficient of the query's trigrams with
+    those of the name or the qualified name, whichever is higher. Files are
+    replaced wholesale as the symbol index changes.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._symbols: Dict[int, Tuple["IndexedSymbol", Set[str], Set[str]]] = {}
+        self._by_path: Dict[str, List[int]] = defaultdict(list)
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def add(self, symbol: "IndexedSymbol"):
+        name_grams = trigrams(symbol.name)
+        qualified_grams = trigrams(symbol.qualified_name)
+        symbol_id = self._next_id
+        self._next_id += 1
+        self._symbols[symbol_id] = (symbol, name_grams, qualified_grams)
+        self._by_path[symbol.path].append(symbol_id)
+        for gram in name_grams | qualified_grams:
+            self._postings[gram].add(symbol_id)
+
+    def remove_path(self, path: str):
+        for symbol_id in self._by_path.pop(path, []):
+            _, name_grams, qualified_grams = self._symbols.pop(symbol_id)
+            for gram in name_grams | qualified_grams:
+                postings = self._postings[gram]
+                postings.discard(symbol_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def replace_path(self, path: str, symbols: Iterable["IndexedSymbol"]):
+        self.remove_path(path)
+        for symbol in symbols:
+            self.add(symbol)
+
+    def similar(self, query: str) -> Dict["IndexedSymbol", float]:
+        """Every symbol sharing a trigram with `query`, with its similarity."""
+        query_grams = trigrams(query)
+        candidates: Set[int] = set()
+        for gram in query_grams:
+            candidates.update(self._postings.get(gram, ()))
+
+        def dice(grams: Set[str]) -> float:
+            return 2 * len(query_grams & grams) / (len(query_grams) + len(grams))
+
+        similarities = {}
+        for symbol_id in candidates:
+            symbol, name_grams, qualified_grams = self._symbols[symbol_id]
+            similarities[symbol] = max(dice(name_grams), dice(qualified_grams))
+        return similarities
+
+    def search(
+        self, query: str, near: Optional[str] = None, limit: int = 10
+    ) -> List["IndexedSymbol"]:
+        similarities = self.similar(query)
+        candidates = [
+            symbol
+            for symbol, similarity in similarities.items()
+            if match_quality(query, symbol, similarity) >= MIN_SCORE
+        ]
+        return rank(query, candidates, near, limit, similarities)
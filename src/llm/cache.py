@@ -0,0 +1,182 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.globals import get_llm_cache, set_llm_cache
+from langchain_core.load import dumps, loads
+
+from src.utilities.paths import get_cache_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    value TEXT NOT NULL
+);
+"""
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """
+    `llm_string` identifies the model and its parameters, including the
+    schemas of any bound tools; `prompt` is the serialised messages.
+    """
+    digest = hashlib.sha256(llm_string.encode())
+    digest.update(b"\0")
+    digest.update(prompt.encode())
+    return digest.hexdigest()
+
+
+class ResponseCache(BaseCache, ABC):
+    """
+    Base of the LLM response caches, with expiry and hit/miss counters.
+
+    Installed with `use_llm_cache`, it answers every chat model that does not
+    opt out with `cache=False`, and the LLM scored feedback functions.
+    Subclasses store values by `cache_key` in `_get`/`_set`/`_delete` and
+    implement `clear`; one that does not cannot be created.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Tuple[float, RETURN_VAL_TYPE]]:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, created: float, value: RETURN_VAL_TYPE):
+        ...
+
+    @abstractmethod
+    def _delete(self, key: str):
+        ...
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = cache_key(prompt, llm_string)
+        with self.lock:
+            entry = self._get(key)
+            if entry is not None and self.ttl is not None:
+                if time.time() - entry[0] > self.ttl:
+                    self._delete(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE):
+        with self.lock:
+            self._set(cache_key(prompt, llm_string), time.time(), return_val)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class LRUResponseCache(ResponseCache):
+    """Keeps the `maxsize` most recently used responses in memory."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[float, RETURN_VAL_TYPE]]" = OrderedDict()
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _set(self, key, created, value):
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self, **kwargs: Any):
+        with self.lock:
+            self._entries.clear()
+
+
+class SQLiteResponseCache(ResponseCache):
+    """Persists responses across runs, under the cache directory by default."""
+
+    def __init__(self, db_path: Optional[str] = None, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        if db_path is None:
+            db_path = os.path.join(get_cache_dir("llm"), "responses.sqlite")
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def _get(self, key):
+        row = self.db.execute(
+            "SELECT created, value FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return row[0], loads(row[1])
+        except Exception:
+            # Written by an incompatible version of langchain
+            return None
+
+    def _set(self, key, created, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+            (key, created, dumps(value)),
+        )
+        self.db.commit()
+
+    def _delete(self, key):
+        self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self.db.commit()
+
+    def clear(self, **kwargs: Any):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def create_llm_cache(
+    backend: str, ttl: Optional[float] = None, path: Optional[str] = None
+) -> Optional[ResponseCache]:
+    """Creates a cache by name: "none", "memory" or "sqlite"."""
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return LRUResponseCache(ttl=ttl)
+    if backend == "sqlite":
+        return SQLiteResponseCache(path, ttl=ttl)
+    raise ValueError(f"Unknown LLM cache backend {backend!r}")
+
+
+def use_llm_cache(cache: Optional[BaseCache]):
+    """Installs `cache` (or removes the current one) for every LLM call."""
+    set_llm_cache(cache)
+
+
+def current_llm_cache() -> Optional[BaseCache]:
+    return get_llm_cache()
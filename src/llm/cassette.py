@@ -0,0 +1,230 @@
+import hashlib
+import json
+import threading
+import time
+import warnings
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.load import dumps, loads
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+
+from src.llm.cache import cache_key
+
+CASSETTE_VERSION = 1
+
+
+class CassetteMiss(KeyError):
+    """A request that was not recorded in the cassette being replayed."""
+
+
+def message_to_dict(message: BaseMessage) -> dict:
+    """The parts of a message the model sees; run ids differ between runs."""
+    data: Dict[str, Any] = {"type": message.type, "content": message.content}
+    if message.additional_kwargs:
+        data["additional_kwargs"] = message.additional_kwargs
+    tool_call_id = getattr(message, "tool_call_id", None)
+    if tool_call_id is not None:
+        data["tool_call_id"] = tool_call_id
+    return data
+
+
+def chat_request(messages: List[BaseMessage], tools: Optional[list]) -> dict:
+    return {"messages": [message_to_dict(m) for m in messages], "tools": tools}
+
+
+def request_key(request: dict) -> str:
+    text = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Cassette(BaseCache):
+    """
+    The LLM requests and responses of one run, saved to a JSON file.
+
+    Chat model calls are recorded by `RecordingChatModel` and answered by
+    `CassetteChatModel`, keyed on the messages and tool schemas. Installed
+    with `use_llm_cache`, the cassette also records and answers the feedback
+    functions' questions. A request asked several times gets its responses
+    in recorded order (the last one repeating). Feedback questions embed the
+    stringified message, run id included, so one that was not recorded gets
+    the next recorded answer from the same model instead.
+    """
+
+    def __init__(self, path: str, mode: str = "replay"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.interactions: List[dict] = []
+        self._responses: Dict[str, List[dict]] = defaultdict(list)
+        self._played: Dict[str, int] = defaultdict(int)
+        # Cache interactions by llm string, for unmatched feedback questions
+        self._by_llm: Dict[str, List[dict]] = defaultdict(list)
+        self.lock = threading.Lock()
+        # Cache lookups not yet followed by an update, while recording
+        self._pending = 0
+        self._last_activity = time.monotonic()
+        if mode == "replay":
+            with open(path) as file:
+                data = json.load(file)
+            if data.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version in {path}")
+            for interaction in data["interactions"]:
+                self._add(interaction)
+
+    def _add(self, interaction: dict):
+        self.interactions.append(interaction)
+        self._last_activity = time.monotonic()
+        self._responses[interaction["key"]].append(interaction["response"])
+        llm_string = interaction["request"].get("llm")
+        if llm_string is not None:
+            self._by_llm[llm_string].append(interaction["response"])
+
+    def record(self, key: str, request: Any, response: RETURN_VAL_TYPE):
+        with self.lock:
+            self._add(
+                {
+                    "key": key,
+                    "request": request,
+                    "response": json.loads(dumps(response)),
+                }
+            )
+
+    def play(self, key: str, fallback: Optional[str] = None) -> RETURN_VAL_TYPE:
+        with self.lock:
+            responses = self._responses.get(key)
+            if not responses and fallback is not None:
+                key, responses = fallback, self._by_llm.get(fallback)
+            if not responses:
+                raise CassetteMiss(key)
+            played = self._played[key]
+            self._played[key] = played + 1
+            response = responses[min(played, len(responses) - 1)]
+        with warnings.catch_warnings():
+            # `loads` is flagged as beta on every call
+            warnings.simplefilter("ignore")
+            return loads(json.dumps(response))
+
+    def save(self):
+        with open(self.path, "w") as file:
+            json.dump(
+                {"version": CASSETTE_VERSION, "interactions": self.interactions},
+                file,
+                indent=1,
+            )
+
+    def rewind(self):
+        self._played.clear()
+
+    def settle(self, quiet: float = 0.5, timeout: float = 60.0) -> bool:
+        """
+        Waits for background callers (the feedback functions) to finish
+        recording: until nothing is pending and nothing was recorded for
+        `quiet` seconds. Returns False on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                idle = time.monotonic() - self._last_activity
+                if self._pending == 0 and idle >= quiet:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    # As an LLM cache, for the feedback functions
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.mode == "record":
+            with self.lock:
+                self._pending += 1
+                self._last_activity = time.monotonic()
+            return None
+        return self.play(cache_key(prompt, llm_string), fallback=llm_string)
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE):
+        if self.mode == "record":
+            request = {"llm": llm_string, "prompt": prompt}
+            self.record(cache_key(prompt, llm_string), request, return_val)
+            with self.lock:
+                self._pending = max(0, self._pending - 1)
+
+    def clear(self, **kwargs: Any):
+        with self.lock:
+            self.interactions.clear()
+            self._responses.clear()
+            self._by_llm.clear()
+            self._played.clear()
+
+
+class RecordingChatModel(BaseChatModel):
+    """Calls `inner` and records every request and response to `cassette`."""
+
+    inner: BaseChatModel
+    cassette: Cassette
+    # Recorded as asked; the inner model's responses are never served from a cache
+    cache: Any = False
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def _record(self, messages, kwargs, result: ChatResult) -> ChatResult:
+        request = chat_request(messages, kwargs.get("tools"))
+        self.cassette.record(request_key(request), request, result.generations)
+        return result
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        result = self.inner._generate(messages, stop=stop, **kwargs)
+        return self._record(messages, kwargs, result)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        result = await self.inner._agenerate(messages, stop=stop, **kwargs)
+        return self._record(messages, kwargs, result)
+
+
+class CassetteChatModel(BaseChatModel):
+    """A fake chat model answering from a recorded cassette, without a network."""
+
+    cassette: Cassette
+    model_name: str = "cassette"
+    cache: Any = False
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = request_key(chat_request(messages, kwargs.get("tools")))
+        return ChatResult(generations=self.cassette.play(key))
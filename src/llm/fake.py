@@ -0,0 +1,88 @@
+import json
+import re
+import uuid
+from typing import Any, Callable, Iterator, List, Optional, Union
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# A scripted response: plain text, or a dict with `content` and/or `tool_calls`
+# ([{"name": ..., "args": {...}}])
+Response = Union[str, dict, BaseMessage]
+
+
+def to_ai_message(response: Response) -> BaseMessage:
+    if isinstance(response, BaseMessage):
+        return response
+    if isinstance(response, str):
+        return AIMessage(content=response)
+    tool_calls = [
+        {
+            "id": call.get("id", f"call_{uuid.uuid4().hex[:12]}"),
+            "type": "function",
+            "function": {"name": call["name"], "arguments": json.dumps(call["args"])},
+        }
+        for call in response.get("tool_calls", [])
+    ]
+    additional_kwargs = {"tool_calls": tool_calls} if tool_calls else {}
+    return AIMessage(
+        content=response.get("content", ""), additional_kwargs=additional_kwargs
+    )
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    A chat model that answers from a script instead of calling an API.
+
+    Responses are taken in order (cycling once exhausted), or computed by
+    `responder` from the messages sent. Streamed a word at a time. Used by
+    tests and benchmarks.
+    """
+
+    responses: List[Any] = []
+    responder: Optional[Callable[[List[BaseMessage]], Response]] = None
+    model_name: str = "scripted"
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _next_response(self, messages: List[BaseMessage]) -> BaseMessage:
+        if self.responder is not None:
+            response = self.responder(messages)
+        else:
+            response = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        return to_ai_message(response)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._next_response(messages)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        message = self._next_response(messages)
+        # Tool calls come whole, with the first word
+        words = re.findall(r"\s*\S+", message.content) or [""]
+        for i, word in enumerate(words):
+            extra = message.additional_kwargs if i == 0 else {}
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=word, additional_kwargs=extra)
+            )
+            if run_manager is not None:
+                run_manager.on_llm_new_token(word, chunk=chunk)
+            yield chunk
@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+from src.llm.fake import Response, to_ai_message
+
+
+def to_openai_message(response: Response) -> dict:
+    message = to_ai_message(response)
+    result = {"role": "assistant", "content": message.content}
+    if message.additional_kwargs.get("tool_calls"):
+        result["tool_calls"] = message.additional_kwargs["tool_calls"]
+    return result
+
+
+def _envelope(body: dict, kind: str) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": kind,
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+    }
+
+
+def _finish_reason(message: dict) -> str:
+    return "tool_calls" if "tool_calls" in message else "stop"
+
+
+class FakeOpenAIServer:
+    """
+    A local, OpenAI compatible `/chat/completions` endpoint.
+
+    Every request waits `latency` seconds before being answered by
+    `responder` (given the request body), so tests can check what runs
+    concurrently without a network or an API key. Requests are served on
+    their own threads; `max_in_flight` is the most that were ever waiting at
+    once and `answered` how many have been responded to.
+
+        with FakeOpenAIServer(lambda body: "Done", latency=0.2) as server:
+            llm = ChatOpenAI(base_url=server.base_url, api_key="fake")
+    """
+
+    def __init__(
+        self,
+        responder: Callable[[dict], Response] = lambda body: "Done",
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.responder = responder
+        self.latency = latency
+        self.requests: List[dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.answered = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                with server._lock:
+                    server.requests.append(body)
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.latency)
+                    message = to_openai_message(server.responder(body))
+                    if body.get("stream"):
+                        self._stream(body, message)
+                    else:
+                        self._send(body, message)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+                        server.answered += 1
+
+            def _send(self, body, message):
+                payload = json.dumps(
+                    {
+                        **_envelope(body, "chat.completion"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": message,
+                                "finish_reason": _finish_reason(message),
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": 0,
+                            "completion_tokens": 0,
+                            "total_tokens": 0,
+                        },
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body, message):
+                envelope = _envelope(body, "chat.completion.chunk")
+                delta = dict(message)
+                if "tool_calls" in delta:
+                    delta["tool_calls"] = [
+                        {"index": i, **call}
+                        for i, call in enumerate(message["tool_calls"])
+                    ]
+                chunks = [
+                    {"index": 0, "delta": delta, "finish_reason": None},
+                    {"index": 0, "delta": {}, "finish_reason": _finish_reason(message)},
+                ]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for chunk in chunks:
+                    data = json.dumps({**envelope, "choices": [chunk]})
+                    self.wfile.write(f"data: {data}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
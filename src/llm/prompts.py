@@ -0,0 +1,112 @@
+import functools
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+from langchain_core.prompts import (
+    AIMessagePromptTemplate,
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+
+from src.utilities.paths import get_cache_dir
+
+AGENT_PROMPT_REF = "hwchase17/openai-tools-agent"
+
+# A copy of the hub prompt, so building an agent never needs the network
+VENDORED_AGENT_PROMPT = [
+    {"role": "system", "template": "You are a helpful assistant"},
+    {"placeholder": "chat_history", "optional": True},
+    {"role": "human", "template": "{input}"},
+    {"placeholder": "agent_scratchpad", "optional": False},
+]
+
+_ROLES = {
+    SystemMessagePromptTemplate: "system",
+    HumanMessagePromptTemplate: "human",
+    AIMessagePromptTemplate: "ai",
+}
+
+
+def prompt_to_spec(prompt: ChatPromptTemplate) -> List[dict]:
+    spec = []
+    for message in prompt.messages:
+        if isinstance(message, MessagesPlaceholder):
+            spec.append(
+                {"placeholder": message.variable_name, "optional": message.optional}
+            )
+        elif type(message) in _ROLES:
+            spec.append(
+                {"role": _ROLES[type(message)], "template": message.prompt.template}
+            )
+        else:
+            raise ValueError(f"Cannot store prompt message {message!r}")
+    return spec
+
+
+def spec_to_prompt(spec: List[dict]) -> ChatPromptTemplate:
+    messages: list = []
+    for message in spec:
+        if "placeholder" in message:
+            messages.append(
+                MessagesPlaceholder(
+                    message["placeholder"], optional=message.get("optional", False)
+                )
+            )
+        else:
+            messages.append((message["role"], message["template"]))
+    return ChatPromptTemplate.from_messages(messages)
+
+
+def _ref_path(ref: str) -> str:
+    return os.path.join(get_cache_dir("prompts", "refs"), ref.replace("/", "__"))
+
+
+def store_prompt(ref: str, spec: List[dict]) -> str:
+    """Stores a prompt under the hash of its content and points `ref` at it."""
+    text = json.dumps(spec, sort_keys=True)
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    with open(os.path.join(get_cache_dir("prompts"), f"{digest}.json"), "w") as file:
+        file.write(text)
+    with open(_ref_path(ref), "w") as file:
+        file.write(digest)
+    return digest
+
+
+def load_stored_prompt(ref: str) -> Optional[List[dict]]:
+    try:
+        with open(_ref_path(ref)) as file:
+            digest = file.read().strip()
+        with open(os.path.join(get_cache_dir("prompts"), f"{digest}.json")) as file:
+            text = file.read()
+    except FileNotFoundError:
+        return None
+    if hashlib.sha256(text.encode()).hexdigest() != digest:
+        # Corrupted; fall back to the vendored copy
+        return None
+    return json.loads(text)
+
+
+def pull_agent_prompt() -> str:
+    """Fetches the agent prompt from the LangChain hub into the local cache."""
+    from langchain import hub
+
+    prompt = hub.pull(AGENT_PROMPT_REF)
+    digest = store_prompt(AGENT_PROMPT_REF, prompt_to_spec(prompt))
+    load_agent_prompt.cache_clear()
+    return digest
+
+
+@functools.lru_cache(maxsize=None)
+def load_agent_prompt() -> ChatPromptTemplate:
+    """
+    The prompt of the OpenAI tools agent, shared by every controller.
+
+    A copy pulled into the local cache with `pull_agent_prompt` takes
+    precedence over the vendored one. Neither touches the network.
+    """
+    spec = load_stored_prompt(AGENT_PROMPT_REF) or VENDORED_AGENT_PROMPT
+    return spec_to_prompt(spec)
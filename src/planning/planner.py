@@ -1,25 +1,22 @@
 from enum import Enum
-from typing import List
+from typing import List, Optional
 from src.actions.action import Action, FeedbackMessage
 from src.actions.basic_actions import create_logging_action
 from src.common.definitions import FailureReason
-from src.evaluation.feedback_functions import (
-    create_evolving_thought_feedback,
-    create_repeating_work_feedback,
-    create_short_thought_feedback,
-)
 from src.execution import ActionDispatcher, LLMController
 from src.planning.plan_actions import (
     create_action_adder_for_plan,
     create_clear_plan_action,
 )
 from src.planning.state import RefactoringAgentState
+from src.utilities.file_buffers import FlushPolicy, get_buffer_cache
 from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langgraph.graph import END
 
 
 class Planner:
-    def __init__(self, action_list: List[Action]):
+    def __init__(self, action_list: List[Action], llm=None):
         self.plan_dispatcher = ActionDispatcher()
         self.plan_dispatcher.register_action(create_clear_plan_action())
         for action in action_list:
@@ -36,68 +33,88 @@ class Planner:
             self.plan_dispatcher.get_action_list(),
             task,
             additional_instructions=additional_instructions,
+            llm=llm,
         )
 
     def __call__(self, state: RefactoringAgentState):
         # TODO save plan history
         return self.controller(state)
 
+    async def acall(self, state: RefactoringAgentState):
+        return await self.controller.acall(state)
+
 
 class NewThought(BaseModel):
     thought: str = Field(description="The thought to add to the thoughts list")
 
 
-class Thinker:
-    def __init__(self, action_list):
+def create_thought_action():
+    def thought(state: RefactoringAgentState, args: NewThought):
+        state["thoughts"].append(args.thought)
+        return 'Say "Done"'
+
+    return Action(
+        id="add_thought",
+        description="Add a thought to the thoughts list.",
+        model_cls=NewThought,
+        f=thought,
+    )
+
 
-        def create_thought():
+def eval_think_factory(state: RefactoringAgentState):
+    from src.evaluation.feedback_functions import (
+        create_evolving_thought_feedback,
+        create_repeating_work_feedback,
+        create_short_thought_feedback,
+    )
 
-            def thought(state: RefactoringAgentState, args: NewThought):
-                state["thoughts"].append(args.thought)
-                return 'Say "Done"'
+    return [
+        create_evolving_thought_feedback(state),
+        create_short_thought_feedback(),
+        create_repeating_work_feedback(state),
+    ]
 
-            action = Action(
-                id="add_thought",
-                description="Add a thought to the thoughts list.",
-                model_cls=NewThought,
-                f=thought,
-            )
-            return action
 
+THOUGHT_INSTRUCTIONS = """Use this as a way to plan your next steps, reflect on what went well and how you can improve. Be incredibly brief (try to use fewer than 150 characters), mentioning only the most relevant and salient points, paraphrasing in a semi-colon seperated list. For example: 'do X; avoid Y; consider Z.'"""
+
+
+class Thinker:
+    def __init__(self, action_list, llm=None, evaluate=False):
         action_ids = ["- " + action.id for action in action_list]
         action_str = "\n".join(action_ids)
 
         task = """Reflect on the current state and write a brief thought to help your future self."""
         # old_instruction additional_instructions = """Use this as a way to plan your next steps, reflect on what went well and how you can improve. Be incredibly brief (1-2 sentences). This message will be saved in the thoughts section. Do not prefix your answer."""
-        additional_instructions = f"""Use this as a way to plan your next steps, reflect on what went well and how you can improve. Be incredibly brief (try to use fewer than 150 characters), mentioning only the most relevant and salient points, paraphrasing in a semi-colon seperated list. For example: 'do X; avoid Y; consider Z.'
+        additional_instructions = f"""{THOUGHT_INSTRUCTIONS}
 For reference, the available actions are:
 {action_str}
 Reason in terms of these symbols.
         """
 
-        def eval_think_factory(state: RefactoringAgentState):
-            return [
-                create_evolving_thought_feedback(state),
-                create_short_thought_feedback(),
-                create_repeating_work_feedback(state),
-            ]
-
-        self.add_thought = create_thought()
+        self.add_thought = create_thought_action()
         self.controller = LLMController(
             [],
             task,
             additional_instructions=additional_instructions,
             record_history=False,
-            eval_factory=eval_think_factory,
+            # Thoughts are scored by LLM feedback functions only if asked
+            eval_factory=eval_think_factory if evaluate else None,
+            llm=llm,
         )
 
-    def __call__(self, state: RefactoringAgentState):
-        state, result = self.controller.run(state)
+    def _save_thought(self, state: RefactoringAgentState, result):
         args = NewThought(thought=str(result))
         self.add_thought.execute(state, args)
-        print("Thought added to the thoughts list")
         return state
 
+    def __call__(self, state: RefactoringAgentState):
+        state, result = self.controller.run(state)
+        return self._save_thought(state, result)
+
+    async def acall(self, state: RefactoringAgentState):
+        state, result = await self.controller.arun(state)
+        return self._save_thought(state, result)
+
 
 class NextStep(Enum):
     PLAN = "plan"
@@ -117,7 +134,7 @@ class NextStepInput(BaseModel):
 class ShouldContinue:
     next_node: str
 
-    def __init__(self) -> None:
+    def __init__(self, llm=None) -> None:
         self.should_continue_action = self._create_should_continue_action()
         task = """Decide whether to think & execute again or finish. """
         additional_instructions = (
@@ -128,6 +145,7 @@ class ShouldContinue:
             task,
             additional_instructions=additional_instructions,
             record_history=False,
+            llm=llm,
         )
 
     def _create_should_continue_action(self):
@@ -148,20 +166,36 @@ class ShouldContinue:
         )
         return action
 
+    @staticmethod
+    def _parse_decision(decision: str):
+        if decision == "true":
+            return "think"
+        elif decision == "false":
+            return "finish"
+        return None
+
     def __call__(self, state: RefactoringAgentState):
         for retry in range(3):
-            state, decision = self.controller.run(state)
-            # Parse the decision
-            if decision == "true":
-                return "think"
-            elif decision == "false":
-                return "finish"
+            # A cached answer that failed to parse would fail again
+            state, decision = self.controller.run(state, use_cache=retry == 0)
+            next_node = self._parse_decision(decision)
+            if next_node is not None:
+                return next_node
+
+        raise Exception("Failed to parse the decision")
+
+    async def acall(self, state: RefactoringAgentState):
+        for retry in range(3):
+            state, decision = await self.controller.arun(state, use_cache=retry == 0)
+            next_node = self._parse_decision(decision)
+            if next_node is not None:
+                return next_node
 
         raise Exception("Failed to parse the decision")
 
 
 class LLMExecutor:
-    def __init__(self, action_list: List[Action]):
+    def __init__(self, action_list: List[Action], llm=None):
         task = """Select the next actions to execute."""
         additional_instructions = """You will be allowed to execute actions in the future, so do not worry about executing all the actions at once. **Execute only one function**.. Say 'Done' after you are done invoking the function."""
         self.executor = LLMController(
@@ -169,7 +203,131 @@ class LLMExecutor:
             task,
             additional_instructions=additional_instructions,
             record_history=True,
+            llm=llm,
         )
 
     def __call__(self, state: RefactoringAgentState):
-        return self.executor(state)
+        state = self.executor(state)
+        context = state["project_context"]
+        get_buffer_cache(context).flush_point(FlushPolicy.STEP, context.flush_policy)
+        return state
+
+    async def acall(self, state: RefactoringAgentState):
+        state = await self.executor.acall(state)
+        context = state["project_context"]
+        get_buffer_cache(context).flush_point(FlushPolicy.STEP, context.flush_policy)
+        return state
+
+
+class StepInput(BaseModel):
+    thought: str = Field(description="A brief thought to help your future self")
+    action: Optional[str] = Field(
+        description="The name of the one action to execute now, or null for none",
+        default=None,
+    )
+    args: dict = Field(description="The arguments of the action", default_factory=dict)
+    should_continue: bool = Field(
+        description="Whether to take another step after this action (true) or finish (false)."
+    )
+
+    class Config:
+        title = "step"
+
+
+class FusedStep:
+    """
+    Thinks, executes and decides in one LLM call, in place of `Thinker`,
+    `LLMExecutor` and `ShouldContinue`: the model calls `step` with a
+    thought, an action with its arguments and whether to go on. The action
+    runs as the executor's tools do, recorded in the history. The decision
+    is left in `next_node` for `NextNode`.
+    """
+
+    def __init__(self, action_list: List[Action], llm=None, evaluate=False):
+        actions_str = "\n".join(str(action) for action in action_list)
+        # The instructions are a prompt template
+        actions_str = actions_str.replace("{", "{{").replace("}", "}}")
+        task = """Reflect on the current state, select the next action to execute and decide whether to take another step."""
+        additional_instructions = f"""Call `step` once, with:
+- thought: {THOUGHT_INSTRUCTIONS}
+- action and args: the one action to execute now and its arguments (its parameters).
+- should_continue: false if the goal is met once this action has run, true to take another step.
+The available actions are:
+{actions_str}"""
+        self.schema = convert_to_openai_tool(StepInput)
+        self.add_thought = create_thought_action()
+        self.controller = LLMController(
+            action_list,
+            task,
+            additional_instructions=additional_instructions,
+            record_history=True,
+            eval_factory=eval_think_factory if evaluate else None,
+            llm=llm,
+        )
+        # Built once, acting on the state bound for each step
+        self.tools = {tool.name: tool for tool in self.controller.get_tools()}
+
+    def _parse(self, arguments: Optional[dict]) -> Optional[StepInput]:
+        if arguments is None:
+            return None
+        try:
+            return StepInput(**arguments)
+        except ValueError:
+            return None
+
+    def _apply(self, state: RefactoringAgentState, step: StepInput):
+        self.add_thought.execute(state, NewThought(thought=step.thought))
+        if step.action is not None:
+            tool = self.tools.get(step.action)
+            try:
+                if tool is None:
+                    raise FeedbackMessage(
+                        FailureReason.ACTION_NOT_FOUND,
+                        f"Action {step.action} not found",
+                    )
+                with self.controller.bind_state(state):
+                    tool.invoke(step.args)
+            except FeedbackMessage as f:
+                state["feedback"].append(f)
+            except Exception as e:
+                # Arguments that do not match the action's parameters
+                state["feedback"].append(
+                    FeedbackMessage(FailureReason.INVALID_ACTION_ARGS, str(e))
+                )
+        state["next_node"] = "step" if step.should_continue else "finish"
+        context = state["project_context"]
+        get_buffer_cache(context).flush_point(FlushPolicy.STEP, context.flush_policy)
+        return state
+
+    def __call__(self, state: RefactoringAgentState):
+        for retry in range(3):
+            # A cached answer that failed to parse would fail again
+            state, arguments = self.controller.run_with_schema(
+                state, self.schema, use_cache=retry == 0
+            )
+            step = self._parse(arguments)
+            if step is not None:
+                return self._apply(state, step)
+
+        raise Exception("Failed to parse the step")
+
+    async def acall(self, state: RefactoringAgentState):
+        for retry in range(3):
+            state, arguments = await self.controller.arun_with_schema(
+                state, self.schema, use_cache=retry == 0
+            )
+            step = self._parse(arguments)
+            if step is not None:
+                return self._apply(state, step)
+
+        raise Exception("Failed to parse the step")
+
+
+class NextNode:
+    """The node a `FusedStep` decided on."""
+
+    def __call__(self, state: RefactoringAgentState) -> str:
+        return state["next_node"]
+
+    async def acall(self, state: RefactoringAgentState) -> str:
+        return self(state)
@@ -1,7 +1,18 @@
-from ast import Tuple
+import threading
+from collections import Counter, OrderedDict
 from langchain_core.pydantic_v1 import BaseModel, Field
 
-from typing import Generic, List, Optional, TypeVar, TypedDict
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    TypedDict,
+)
 
 from src.common.definitions import (
     CodeSnippet,
@@ -10,12 +21,22 @@ from src.common.definitions import (
     ProjectContext,
     snippet_to_str,
 )
-from src.utilities.formatting import format_list
+from src.utilities.formatting import format_list, format_numbered
 from src.utilities.jedi_utils import span_to_snippet
+from src.utilities.span_index import CodeBlockStore, SpanIndex
+from src.utilities.file_buffers import get_buffer_cache
+from src.utilities.tokens import count_tokens
 
 ActionArgs = TypeVar("ActionArgs", bound=BaseModel)
 ActionReturnType = TypeVar("ActionReturnType")
 
+# Under a token budget: results of older records are cut to this length, and
+# the newest records and thoughts are never dropped
+SUMMARY_CHARS = 80
+KEEP_RECENT = 2
+# The "#H1 " numbering of each entry
+ENTRY_TOKENS = 3
+
 RED = "\033[91m"
 RESET = "\033[0m"
 GREEN = "\033[92m"
@@ -38,6 +59,10 @@ class FeedbackMessage(Exception, Generic[ActionArgs]):
         self.request = request
         super().__init__(message)
 
+    def __reduce__(self):
+        # Exceptions unpickle as cls(*args), and args is only (message,)
+        return type(self), (self.reason, self.message, self.request)
+
 
 class ActionRecord(TypedDict, Generic[ActionArgs, ActionReturnType]):
     request: ActionRequest[ActionArgs]
@@ -62,6 +87,14 @@ def record_to_str(record: ActionRecord) -> str:
     return f"{{\"request\":{request_to_str(record['request'])},\"result\":{GREEN}\"{result_str}\"{RESET}}}"
 
 
+def record_summary_to_str(record: ActionRecord) -> str:
+    """A record with its result cut short, for older history under a token budget."""
+    result_str = str(record["result"])
+    if len(result_str) > SUMMARY_CHARS:
+        result_str = result_str[:SUMMARY_CHARS] + "…"
+    return f"{{\"request\":{request_to_str(record['request'])},\"result\":{GREEN}\"{result_str}\"{RESET}}}"
+
+
 def feedback_to_str(feedback: FeedbackMessage) -> str:
     return f'{{"failure-reason":{feedback.reason.value},"message":{feedback.message},"request":{request_to_str(feedback.request) if feedback.request else "none"}}}'
 
@@ -74,27 +107,61 @@ class RefactoringAgentState(TypedDict):
     # TODO: Feedback of failed actions
     feedback: List[FeedbackMessage]
     console: List[str]
-    code_blocks: List[CodeSpan]
+    code_blocks: CodeBlockStore
     thoughts: List[str]
+    # Where a fused step (think, execute and decide at once) goes next
+    next_node: Optional[str]
+    # Edits the flush policy still holds in memory, saved with checkpoints
+    # (by absolute path; see `checkpointed_node`)
+    unflushed: Dict[str, str]
 
 
-def state_to_str(state: RefactoringAgentState) -> str:
-    history = map(record_to_str, state["history"])
-    plan = map(request_to_str, state["plan"])
-    feedback = map(feedback_to_str, state["feedback"])
-    snippets = map(
-        lambda s: snippet_to_str(span_to_snippet(s, state["project_context"])),
-        state["code_blocks"],
-    )
-
-    # plan_str = format_list(plan, "P", "Plan")
-    # console_str = format_list(state["console"], "C", "Console")
-    history_str = format_list(history, "H", "History")
-    feedback_str = format_list(feedback, "F", "Feedback")
-    thoughts_str = format_list(state["thoughts"], "T", "Thoughts")
-    code_str = format_list(snippets, "CODE-BLOCK-", "Code Snippets")
+def initial_state(goal: str, context: ProjectContext) -> RefactoringAgentState:
+    return {
+        "goal": goal,
+        "project_context": context,
+        "history": [],
+        "plan": [],
+        "feedback": [],
+        "console": [],
+        "code_blocks": CodeBlockStore(),
+        "thoughts": [],
+        "next_node": None,
+        "unflushed": {},
+    }
+
+
+class ContextReport(NamedTuple):
+    """What a budgeted render left out. `tokens` is an estimate."""
+
+    budget: Optional[int]
+    tokens: Optional[int] = None
+    summarised_history: int = 0
+    dropped_history: int = 0
+    dropped_thoughts: int = 0
+    dropped_feedback: int = 0
+    dropped_snippets: int = 0
+
+    @property
+    def dropped(self) -> int:
+        return (
+            self.dropped_history
+            + self.dropped_thoughts
+            + self.dropped_feedback
+            + self.dropped_snippets
+        )
+
+    def __str__(self):
+        parts = [f"{self.tokens}/{self.budget} tokens"]
+        for field in self._fields[2:]:
+            if getattr(self, field):
+                parts.append(f"{field.replace('_', ' ')}: {getattr(self, field)}")
+        return "Context " + "; ".join(parts)
+
+
+def _layout(goal, history_str, thoughts_str, feedback_str, code_str) -> str:
     return f"""### Main Goal ###
-'{state["goal"]}'
+'{goal}'
 ---
 ### Execution History and Observations (Oldest to Newest) ###
 {history_str}
@@ -108,3 +175,209 @@ def state_to_str(state: RefactoringAgentState) -> str:
 ### Code Snippets ###
 {code_str}
 """
+
+
+def _labelled_blocks(code_blocks) -> List[Tuple[int, CodeSpan, int]]:
+    """(label, span, last used) of the code blocks, also for a plain list of spans."""
+    if isinstance(code_blocks, SpanIndex):
+        return code_blocks.blocks()
+    return [(i, span, i) for i, span in enumerate(code_blocks, 1)]
+
+
+def _omitted(prefix: str, count: int) -> Optional[str]:
+    if count == 0:
+        return None
+    first = f"#{prefix}1" if count == 1 else f"#{prefix}1-#{prefix}{count}"
+    return f"({first} omitted to fit the context budget)"
+
+
+class StateRenderer:
+    """
+    Renders a state to a prompt string, memoizing every rendered entry.
+
+    History records and feedback messages are only ever appended, so they are
+    cached by identity (holding a reference so the id cannot be reused). Code
+    snippets are cached by span and the version of the file's buffer, so only
+    spans that moved or files that were edited (by the agent or on disk) are
+    re-rendered.
+
+    Given a token budget, entries are summarised or left out until the
+    estimated size of the prompt fits: first the results of older history
+    records are cut short, then the least recently referenced code snippets
+    are evicted, then the oldest history records, thoughts and feedback are
+    dropped. The newest of each are always kept.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, Tuple[object, str]] = OrderedDict()
+        self._summaries: OrderedDict[int, Tuple[object, str]] = OrderedDict()
+        self._snippets: OrderedDict[tuple, str] = OrderedDict()
+        self._tokens: OrderedDict[str, int] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def _remember(self, cache: OrderedDict, key, value):
+        cache[key] = value
+        if len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def _render_entry(
+        self,
+        entry,
+        render: Callable[[object], str],
+        cache: Optional[OrderedDict] = None,
+    ) -> str:
+        cache = self._entries if cache is None else cache
+        cached = cache.get(id(entry))
+        if cached is not None and cached[0] is entry:
+            cache.move_to_end(id(entry))
+            return cached[1]
+        rendered = render(entry)
+        self._remember(cache, id(entry), (entry, rendered))
+        return rendered
+
+    def _count(self, text: str) -> int:
+        tokens = self._tokens.get(text)
+        if tokens is None:
+            tokens = count_tokens(text)
+            self._remember(self._tokens, text, tokens)
+        return tokens
+
+    def _render_snippets(self, spans, context: ProjectContext) -> List[str]:
+        buffers = get_buffer_cache(context)
+        versions: Dict[str, int] = {}
+        rendered = []
+        for span in spans:
+            if span.file_path not in versions:
+                versions[span.file_path] = buffers.version(span.file_path)
+            key = (
+                span.file_path,
+                span.start_line,
+                span.end_line,
+                versions[span.file_path],
+            )
+            snippet = self._snippets.get(key)
+            if snippet is None:
+                snippet = snippet_to_str(span_to_snippet(span, context))
+                self._remember(self._snippets, key, snippet)
+            else:
+                self._snippets.move_to_end(key)
+            rendered.append(snippet)
+        return rendered
+
+    def _fit(self, state, history, thoughts, feedback, snippets, recency, budget):
+        """
+        Summarises and drops entries of the (number, text) lists in place until
+        the estimated tokens fit `budget`. `recency` is when each snippet was
+        last used.
+        """
+        counts: Counter = Counter()
+        sections = [history, thoughts, feedback, snippets]
+        total = self._count(_layout(state["goal"], "", "", "", ""))
+        total += sum(
+            self._count(text) + ENTRY_TOKENS
+            for section in sections
+            for _, text in section
+        )
+
+        for position in range(len(history) - KEEP_RECENT):
+            if total <= budget:
+                break
+            number, text = history[position]
+            record = state["history"][number - 1]
+            summary = self._render_entry(record, record_summary_to_str, self._summaries)
+            saved = self._count(text) - self._count(summary)
+            if saved > 0:
+                history[position] = (number, summary)
+                total -= saved
+                counts["summarised_history"] += 1
+
+        # Least recently referenced first; the newest is kept
+        order = sorted(range(len(snippets)), key=lambda i: recency[i])[:-1]
+        evicted = set()
+        for i in order:
+            if total <= budget:
+                break
+            total -= self._count(snippets[i][1]) + ENTRY_TOKENS
+            evicted.add(i)
+        snippets[:] = [s for i, s in enumerate(snippets) if i not in evicted]
+        counts["dropped_snippets"] = len(evicted)
+
+        for section, name, keep in (
+            (history, "dropped_history", KEEP_RECENT),
+            (thoughts, "dropped_thoughts", KEEP_RECENT),
+            (feedback, "dropped_feedback", 1),
+        ):
+            while total > budget and len(section) > keep:
+                _, text = section.pop(0)
+                total -= self._count(text) + ENTRY_TOKENS
+                counts[name] += 1
+        return ContextReport(budget, total, **counts)
+
+    def render(self, state: RefactoringAgentState) -> str:
+        return self.render_with_report(state)[0]
+
+    def render_with_report(
+        self, state: RefactoringAgentState, token_budget: Optional[int] = None
+    ) -> Tuple[str, ContextReport]:
+        """Renders the state, within `token_budget` if one is given."""
+        with self.lock:
+            history = [self._render_entry(r, record_to_str) for r in state["history"]]
+            feedback = [
+                self._render_entry(f, feedback_to_str) for f in state["feedback"]
+            ]
+            blocks = _labelled_blocks(state["code_blocks"])
+            rendered = self._render_snippets(
+                [span for _, span, _ in blocks], state["project_context"]
+            )
+            snippets = [(label, s) for (label, _, _), s in zip(blocks, rendered)]
+            if token_budget is None:
+                report = ContextReport(None)
+                numbered = None
+            else:
+                numbered = [
+                    list(enumerate(entries, 1))
+                    for entries in (history, state["thoughts"], feedback)
+                ] + [list(snippets)]
+                recency = [used for _, _, used in blocks]
+                report = self._fit(state, *numbered, recency, token_budget)
+
+        if numbered is None:
+            # plan_str = format_list(plan, "P", "Plan")
+            # console_str = format_list(state["console"], "C", "Console")
+            history_str = format_list(history, "H", "History")
+            feedback_str = format_list(feedback, "F", "Feedback")
+            thoughts_str = format_list(state["thoughts"], "T", "Thoughts")
+            code_str = format_numbered(snippets, "CODE-BLOCK-", "Code Snippets")
+        else:
+            history, thoughts, feedback, snippets = numbered
+            history_str = format_numbered(
+                history, "H", "History", _omitted("H", report.dropped_history)
+            )
+            thoughts_str = format_numbered(
+                thoughts, "T", "Thoughts", _omitted("T", report.dropped_thoughts)
+            )
+            feedback_str = format_numbered(
+                feedback, "F", "Feedback", _omitted("F", report.dropped_feedback)
+            )
+            note = None
+            if report.dropped_snippets:
+                note = f"({report.dropped_snippets} least recently used snippets omitted; search again to reload them)"
+            code_str = format_numbered(snippets, "CODE-BLOCK-", "Code Snippets", note)
+        return (
+            _layout(state["goal"], history_str, thoughts_str, feedback_str, code_str),
+            report,
+        )
+
+
+default_renderer = StateRenderer()
+
+
+def state_to_str(state: RefactoringAgentState) -> str:
+    return default_renderer.render(state)
+
+
+def render_context(state: RefactoringAgentState) -> Tuple[str, ContextReport]:
+    """The state as the LLM sees it: within the project's context token budget."""
+    budget = state["project_context"].context_token_budget
+    return default_renderer.render_with_report(state, budget)
@@ -0,0 +1,437 @@
+"""
+A long-running agent service: a job queue in front of one `RefactoringAgent`.
+
+Every job reuses the agent's compiled graph and controllers, and the warm
+per-project state (buffer caches, symbol indices, Jedi sessions and
+workers) of the repositories it has seen. Up to `max_sessions` jobs run at
+once, each on its own thread.
+
+Each session edits a git repository in its own worktree, reset to the
+repository's HEAD before every job, so jobs against one repository run
+concurrently and a session's per-project state stays warm from job to job.
+A successful job that changed files is committed to the branch
+`less/<job id>`; a failed or cancelled one is rolled back. Jobs against a
+folder that is not a git repository share its files, so they run one at a
+time.
+
+`submit` raises `ServiceBusy` once `max_queue` jobs are waiting, rather than
+queueing without bound. A queued job is cancelled by removing it; a running
+one stops at the start of its next chain, tool or model call. Finished jobs
+are kept, with their results, for `job_ttl` seconds and at most
+`max_finished` of them; older ones are forgotten.
+
+`serve` exposes the service over HTTP, on a TCP port or a Unix socket:
+
+    POST   /jobs        {"goal": ..., "repo": ...}  -> 202 the job (429 if busy)
+    GET    /jobs                                    -> every job
+    GET    /jobs/<id>                               -> the job
+    DELETE /jobs/<id>                               -> cancels the job
+    GET    /health                                  -> queue and session counts
+"""
+
+import collections
+import json
+import os
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from src.agent import LOOP, RefactoringAgent
+from src.common.definitions import ProjectContext
+from src.utilities.file_buffers import FlushPolicy, get_buffer_cache
+from src.utilities.worktrees import Worktree, is_git_repo, open_worktree
+
+DEFAULT_MAX_SESSIONS = 4
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_JOB_TTL = 3600.0
+DEFAULT_MAX_FINISHED = 1000
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class ServiceBusy(Exception):
+    """The job queue is full; retry later."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+class Job:
+    def __init__(self, goal: str, context: ProjectContext, isolated: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.goal = goal
+        self.context = context
+        # Run in a session worktree rather than in the repository's files
+        self.isolated = isolated
+        self.status = QUEUED
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancel_requested = threading.Event()
+        self.done = threading.Event()
+
+    @property
+    def repo(self) -> str:
+        return os.path.abspath(self.context.folder_path)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "goal": self.goal,
+            "repo": self.context.folder_path,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class _CancelCheck(BaseCallbackHandler):
+    """Stops a cancelled job at its next chain, tool or model call."""
+
+    raise_error = True
+
+    def __init__(self, job: Job):
+        self.job = job
+
+    def _check(self):
+        if self.job.cancel_requested.is_set():
+            raise JobCancelled(self.job.id)
+
+    def on_chain_start(self, *args, **kwargs):
+        self._check()
+
+    def on_tool_start(self, *args, **kwargs):
+        self._check()
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self._check()
+
+    def on_llm_start(self, *args, **kwargs):
+        self._check()
+
+
+def summarize_result(state) -> dict:
+    return {
+        "console": list(state["console"]),
+        "thoughts": list(state["thoughts"]),
+        "actions": [record["request"]["id"] for record in state["history"]],
+        "feedback": [str(feedback) for feedback in state["feedback"]],
+    }
+
+
+class AgentService:
+    def __init__(
+        self,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        llm=None,
+        agent: Optional[RefactoringAgent] = None,
+        eval_project_id: str = "service",
+        flush_policy: str = "action",
+        context_token_budget: Optional[int] = 8000,
+        use_worktrees: bool = True,
+        evaluate: bool = False,
+        mode: str = LOOP,
+        job_ttl: Optional[float] = DEFAULT_JOB_TTL,
+        max_finished: int = DEFAULT_MAX_FINISHED,
+    ):
+        self.max_sessions = max_sessions
+        self.max_queue = max_queue
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        if agent is None:
+            agent = RefactoringAgent(llm=llm, evaluate=evaluate, mode=mode)
+        self.agent = agent
+        self.eval_project_id = eval_project_id
+        self.flush_policy = flush_policy
+        self.context_token_budget = context_token_budget
+        self.use_worktrees = use_worktrees
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Deque[Job] = collections.deque()
+        # Finished jobs, oldest first, until they are evicted from `jobs`
+        self._finished: Deque[Job] = collections.deque()
+        self._busy_repos = set()
+        self._running = 0
+        self._closed = False
+        self._changed = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "AgentService":
+        for i in range(self.max_sessions):
+            thread = threading.Thread(
+                target=self._work, args=(i,), name=f"agent-session-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, cancel_running: bool = True, timeout: Optional[float] = None):
+        """Cancels queued jobs (and running ones) and waits for the sessions."""
+        with self._changed:
+            self._closed = True
+            while self._queue:
+                self._finish(self._queue.popleft(), CANCELLED)
+            if cancel_running:
+                for job in self.jobs.values():
+                    job.cancel_requested.set()
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def __enter__(self) -> "AgentService":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def submit(self, goal: str, repo: str) -> Job:
+        context = ProjectContext(
+            folder_path=repo,
+            eval_project_id=self.eval_project_id,
+            flush_policy=self.flush_policy,
+            context_token_budget=self.context_token_budget,
+        )
+        job = Job(goal, context, self.use_worktrees and is_git_repo(repo))
+        with self._changed:
+            self._evict()
+            if self._closed:
+                raise ServiceBusy("The service is shutting down")
+            if len(self._queue) >= self.max_queue:
+                raise ServiceBusy(f"{len(self._queue)} jobs are already queued")
+            self.jobs[job.id] = job
+            self._queue.append(job)
+            self._changed.notify_all()
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        with self._changed:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        with self._changed:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Job:
+        """Cancels a job; raises KeyError for an unknown id."""
+        with self._changed:
+            job = self.jobs[job_id]
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                self._finish(job, CANCELLED)
+            elif job.status == RUNNING:
+                job.cancel_requested.set()
+        return job
+
+    def health(self) -> dict:
+        with self._changed:
+            return {
+                "queued": len(self._queue),
+                "running": self._running,
+                "max_sessions": self.max_sessions,
+                "max_queue": self.max_queue,
+            }
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        job.done.set()
+        self._finished.append(job)
+        self._evict()
+
+    def _evict(self):
+        """Forgets the finished jobs past `max_finished` or older than `job_ttl`."""
+        now = time.time()
+        while self._finished and (
+            len(self._finished) > self.max_finished
+            or (
+                self.job_ttl is not None
+                and now - self._finished[0].finished > self.job_ttl
+            )
+        ):
+            self.jobs.pop(self._finished.popleft().id, None)
+
+    def _next_job(self) -> Optional[Job]:
+        """The oldest queued job whose repository is free; None once stopped."""
+        with self._changed:
+            while True:
+                if self._closed:
+                    return None
+                for job in self._queue:
+                    if job.isolated or job.repo not in self._busy_repos:
+                        self._queue.remove(job)
+                        if not job.isolated:
+                            self._busy_repos.add(job.repo)
+                        self._running += 1
+                        job.status = RUNNING
+                        job.started = time.time()
+                        return job
+                self._changed.wait()
+
+    def _run(self, job: Job, worktree: Optional[Worktree]) -> dict:
+        context = job.context
+        if worktree is not None:
+            worktree.reset()
+            folder_path = worktree.path_of(job.repo)
+            context = context.copy(update={"folder_path": folder_path})
+        buffers = get_buffer_cache(context)
+        try:
+            state = self.agent.run(
+                job.goal, context, callbacks=[_CancelCheck(job)], worktree=worktree
+            )
+        except BaseException:
+            if worktree is not None:
+                buffers.discard()
+                worktree.rollback(worktree.snapshots[0])
+            else:
+                # A stopped run leaves its edits on disk, as the run would
+                buffers.flush_point(FlushPolicy.RUN)
+            raise
+        result = summarize_result(state)
+        if worktree is not None and worktree.head != worktree.base:
+            result["branch"] = worktree.branch(job.id)
+            result["commit"] = str(worktree.head)
+        return result
+
+    def _work(self, session: int):
+        # This session's worktree of each repository it has run a job on
+        worktrees: Dict[str, Worktree] = {}
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            status = FAILED
+            try:
+                worktree = None
+                if job.isolated:
+                    worktree = worktrees.get(job.repo)
+                    if worktree is None:
+                        worktree = open_worktree(job.repo, f"session-{session}")
+                        worktrees[job.repo] = worktree
+                job.result = self._run(job, worktree)
+                status = DONE
+            except BaseException as e:
+                if job.cancel_requested.is_set():
+                    status = CANCELLED
+                else:
+                    job.error = f"{type(e).__name__}: {e}"
+                # Anything else (SystemExit, ...) ends the session, but not
+                # before the job and its repository are released
+                if not isinstance(e, Exception):
+                    raise
+            finally:
+                with self._changed:
+                    self._busy_repos.discard(job.repo)
+                    self._running -= 1
+                    self._finish(job, status)
+                    self._changed.notify_all()
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) address
+        return request, ("local", 0)
+
+
+def make_handler(service: AgentService):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload, headers=()):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in headers:
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _job_id(self) -> Optional[str]:
+            parts = self.path.strip("/").split("/")
+            if len(parts) == 2 and parts[0] == "jobs":
+                return parts[1]
+            return None
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/health":
+                self._send(200, service.health())
+            elif path == "/jobs":
+                self._send(200, [job.to_dict() for job in service.list_jobs()])
+            else:
+                job = service.get_job(self._job_id() or "")
+                if job is None:
+                    self._send(404, {"error": f"Not found: {self.path}"})
+                else:
+                    self._send(200, job.to_dict())
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                self._send(404, {"error": f"Not found: {self.path}"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+                goal, repo = body["goal"], body["repo"]
+            except (ValueError, KeyError, TypeError):
+                self._send(400, {"error": "Expected a JSON body with goal and repo"})
+                return
+            if not os.path.isdir(repo):
+                self._send(400, {"error": f"No such repository: {repo}"})
+                return
+            try:
+                job = service.submit(goal, repo)
+            except ServiceBusy as e:
+                self._send(429, {"error": str(e)}, [("Retry-After", "1")])
+                return
+            self._send(202, job.to_dict(), [("Location", f"/jobs/{job.id}")])
+
+        def do_DELETE(self):
+            try:
+                job = service.cancel(self._job_id() or "")
+            except KeyError:
+                self._send(404, {"error": f"Not found: {self.path}"})
+                return
+            self._send(200, job.to_dict())
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(
+    service: AgentService,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix_socket: Optional[str] = None,
+) -> socketserver.BaseServer:
+    """An HTTP server for `service`; call `serve_forever` on it (or on a thread)."""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        return UnixHTTPServer(unix_socket, make_handler(service))
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    return server
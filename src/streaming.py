@@ -0,0 +1,327 @@
+"""
+A run's progress as a live stream of structured events.
+
+`RunEvents` runs the agent on a worker thread and is iterated for its
+events as they happen, each a dict with the `event` kind and `t` (seconds
+since the run started):
+
+    run_start   run_id, goal
+    node_start  node
+    token       node, text              a model's output as it is generated
+    action      node, action, args      a tool call, as it is dispatched
+    edit        node, file, start_line, end_line, summary
+    thought     node, thought           once the node has run
+    feedback    node, reason, message
+    console     node, message
+    node_end    node
+    decision    next                    "think" (or "step") again, or "finish"
+    run_end     dropped_tokens
+    error       error                   (then iterating raises it)
+
+Node, token, action, edit and decision events come from the run's
+callbacks; the rest from the graph's stream of state updates. Events are
+handed over through a queue of `max_buffer` events: when the reader falls
+behind, token events are dropped (and counted) rather than slowing the run
+down, and the run waits for room for any other event.
+
+`JSONLEventWriter` and `ConsoleEventWriter` write events to a file.
+"""
+
+import asyncio
+import contextvars
+import json
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from typing import IO, Iterator, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from src.agent import RefactoringAgent
+from src.common.definitions import ProjectContext
+from src.planning.planner import NextNode, ShouldContinue
+from src.planning.state import RefactoringAgentState
+from src.utilities.worktrees import Worktree
+
+DEFAULT_MAX_BUFFER = 1024
+
+RUN_START = "run_start"
+NODE_START = "node_start"
+TOKEN = "token"
+ACTION = "action"
+THOUGHT = "thought"
+EDIT = "edit"
+FEEDBACK = "feedback"
+CONSOLE = "console"
+NODE_END = "node_end"
+DECISION = "decision"
+RUN_END = "run_end"
+ERROR = "error"
+
+# The conditional edges that pick the node after `execute` (or `step`)
+_DECISION_CHAINS = (ShouldContinue.__name__, NextNode.__name__)
+_EDIT_ACTION = "edit_code"
+_DONE = object()
+
+
+class EventCollector(BaseCallbackHandler):
+    """Emits the events of a run's callbacks (see the module's docstring)."""
+
+    run_inline = True
+
+    def __init__(self, emit, nodes):
+        self.emit = emit
+        self.nodes = set(nodes)
+        self.node: Optional[str] = None
+        self._graph = None
+        self._names = {}
+        self._edits = {}
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs
+    ):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        self._names[run_id] = name
+        if parent_run_id is None:
+            self._graph = run_id
+        elif parent_run_id == self._graph and name in self.nodes:
+            self.node = name
+            self.emit(NODE_START, node=name)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if self._names.pop(run_id, None) in _DECISION_CHAINS:
+            if isinstance(outputs, dict):
+                outputs = outputs.get("output")
+            self.emit(DECISION, next=outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._names.pop(run_id, None)
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.emit(TOKEN, node=self.node, text=token)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, inputs=None, **kwargs):
+        args = inputs if inputs is not None else input_str
+        action = serialized.get("name")
+        if action == _EDIT_ACTION and isinstance(args, dict):
+            self._edits[run_id] = args
+        self.emit(ACTION, node=self.node, action=action, args=args)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        args = self._edits.pop(run_id, None)
+        if args is not None:
+            self.emit(
+                EDIT,
+                node=self.node,
+                file=args.get("file"),
+                start_line=args.get("start_line"),
+                end_line=args.get("end_line"),
+                summary=args.get("change_summary"),
+            )
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._edits.pop(run_id, None)
+
+
+class StateDiff:
+    """The thoughts, feedback and console messages new since the last state."""
+
+    def __init__(self):
+        self.seen = Counter()
+
+    def _new(self, state: RefactoringAgentState, key: str) -> list:
+        entries = state[key][self.seen[key] :]
+        self.seen[key] = len(state[key])
+        return entries
+
+    def events(self, node: str, state: RefactoringAgentState) -> Iterator[dict]:
+        for thought in self._new(state, "thoughts"):
+            yield dict(event=THOUGHT, node=node, thought=thought)
+        for feedback in self._new(state, "feedback"):
+            yield dict(
+                event=FEEDBACK,
+                node=node,
+                reason=feedback.reason.value,
+                message=feedback.message,
+            )
+        for message in self._new(state, "console"):
+            yield dict(event=CONSOLE, node=node, message=message)
+
+
+class RunEvents:
+    """
+    Iterate to run `agent` on `inp` (or, with no `inp`, to resume `run_id`)
+    and receive its events; `result` is the final state.
+    """
+
+    def __init__(
+        self,
+        agent: RefactoringAgent,
+        inp: Optional[str],
+        context: Optional[ProjectContext],
+        callbacks: Optional[list] = None,
+        worktree: Optional[Worktree] = None,
+        run_id: Optional[str] = None,
+        use_async: bool = False,
+        max_buffer: int = DEFAULT_MAX_BUFFER,
+    ):
+        self.agent = agent
+        self.inp = inp
+        self.context = context
+        self.callbacks = list(callbacks or [])
+        self.worktree = worktree
+        self.run_id = run_id
+        self.use_async = use_async
+        self.result: Optional[RefactoringAgentState] = None
+        self.dropped_tokens = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_buffer)
+        self._closed = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._start = time.perf_counter()
+
+    def emit(self, kind: str, **fields):
+        event = {"event": kind, "t": round(time.perf_counter() - self._start, 3)}
+        event.update(fields)
+        self._put(event)
+
+    def _put(self, event):
+        if event is not _DONE and event["event"] == TOKEN:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self.dropped_tokens += 1
+            return
+        # Wait for the reader, unless it has stopped reading
+        while not self._closed.is_set():
+            try:
+                self._queue.put(event, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _updates(self, diff: StateDiff, node: str, state):
+        self.result = state
+        for event in diff.events(node, state):
+            self.emit(event.pop("event"), **event)
+        self.emit(NODE_END, node=node)
+
+    def _run(self):
+        collector = EventCollector(self.emit, self.agent.graph.nodes)
+        callbacks = self.callbacks + [collector]
+        args = (self.inp, self.context, callbacks, self.worktree, self.run_id)
+        diff = StateDiff()
+        try:
+            self.emit(RUN_START, run_id=self.run_id, goal=self.inp)
+            if self.use_async:
+
+                async def consume():
+                    async for node, state in self.agent.astream(*args):
+                        self._updates(diff, node, state)
+
+                asyncio.run(consume())
+            else:
+                for node, state in self.agent.stream(*args):
+                    self._updates(diff, node, state)
+            self.emit(RUN_END, dropped_tokens=self.dropped_tokens)
+        except BaseException as e:
+            self._error = e
+            self.emit(ERROR, error=f"{type(e).__name__}: {e}")
+        finally:
+            self._put(_DONE)
+
+    def __iter__(self) -> Iterator[dict]:
+        # The run sees the caller's context variables (tracing, for one)
+        context = contextvars.copy_context()
+        thread = threading.Thread(
+            target=context.run, args=(self._run,), name="agent-run", daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                event = self._queue.get()
+                if event is _DONE:
+                    break
+                yield event
+        finally:
+            self._closed.set()
+        thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class JSONLEventWriter:
+    """One JSON object per line, flushed at every event but tokens."""
+
+    def __init__(self, file: IO[str]):
+        self.file = file
+
+    def write(self, event: dict):
+        self.file.write(json.dumps(event, default=str) + "\n")
+        if event["event"] != TOKEN:
+            self.file.flush()
+
+
+def format_event(event: dict) -> Optional[str]:
+    kind = event["event"]
+    node = f"[{event.get('node')}] " if event.get("node") else ""
+    if kind == RUN_START:
+        return f"Run {event['run_id']}: {event['goal']}"
+    if kind == NODE_START:
+        return f"{node}started"
+    if kind == ACTION:
+        return f"{node}{event['action']} {json.dumps(event['args'], default=str)}"
+    if kind == THOUGHT:
+        return f"{node}thought: {event['thought']}"
+    if kind == EDIT:
+        return (
+            f"{node}edited {event['file']}:{event['start_line']}-{event['end_line']}"
+            f" ({event['summary']})"
+        )
+    if kind == FEEDBACK:
+        return f"{node}feedback {event['reason']}: {event['message']}"
+    if kind == CONSOLE:
+        return f"{node}> {event['message']}"
+    if kind == DECISION:
+        return "decision: " + ("finish" if event["next"] == "finish" else "continue")
+    if kind == RUN_END:
+        dropped = event["dropped_tokens"]
+        return f"Done in {event['t']:.1f}s" + (
+            f" ({dropped} tokens not shown)" if dropped else ""
+        )
+    if kind == ERROR:
+        return f"Failed: {event['error']}"
+    return None
+
+
+class ConsoleEventWriter:
+    """Prints tokens as they arrive, and one line for every other event."""
+
+    def __init__(self, file: IO[str] = sys.stdout):
+        self.file = file
+        self._in_tokens = False
+
+    def write(self, event: dict):
+        if event["event"] == TOKEN:
+            self.file.write(event["text"])
+            self.file.flush()
+            self._in_tokens = True
+            return
+        line = format_event(event)
+        if line is None:
+            return
+        if self._in_tokens:
+            self.file.write("\n")
+            self._in_tokens = False
+        self.file.write(line + "\n")
+        self.file.flush()
+
+
+def write_events(events: RunEvents, writers: List) -> Optional[RefactoringAgentState]:
+    """Writes each event of `events` to every writer; returns the final state."""
+    for event in events:
+        for writer in writers:
+            writer.write(event)
+    return events.result
@@ -0,0 +1,93 @@
+"""
+Durable checkpoints of agent runs, so a run that dies can be resumed.
+
+The compiled graph saves its state to a `CheckpointStore` after every step,
+keyed by the run's id (langgraph's `thread_id`). Resuming a run invokes the
+graph on that id with no input, which continues from the last step that
+completed instead of repeating its LLM calls and edits.
+
+States are pickled (protocol 5): the history's pydantic args, the code block
+store, feedback messages and slotted records round-trip as they are, and a
+state of a few hundred records pickles in a couple of milliseconds.
+The store is a SQLite database in WAL mode, so each step's write is an
+append to the log rather than a rewrite of the database.
+"""
+
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import Checkpoint, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from src.utilities.paths import get_cache_dir
+
+
+def default_checkpoint_path() -> str:
+    return os.path.join(get_cache_dir("runs"), "checkpoints.sqlite")
+
+
+def run_config(run_id: str) -> RunnableConfig:
+    return {"configurable": {"thread_id": run_id}}
+
+
+class StateSerializer:
+    """Pickles checkpoints with the newest protocol."""
+
+    def dumps(self, obj: Any) -> bytes:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+class CheckpointStore(SqliteSaver):
+    """
+    A `SqliteSaver` at `path` (see `default_checkpoint_path`) that may be
+    shared by the threads of concurrent runs, and by `ainvoke`.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_checkpoint_path()
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        super().__init__(conn, serde=StateSerializer())
+        self.lock = threading.Lock()
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self.lock:
+            return super().get_tuple(config)
+
+    def list(self, config: RunnableConfig) -> Iterator[CheckpointTuple]:
+        with self.lock:
+            return iter(list(super().list(config)))
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint) -> RunnableConfig:
+        with self.lock:
+            return super().put(config, checkpoint)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: RunnableConfig) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint in await asyncio.to_thread(self.list, config):
+            yield checkpoint
+
+    async def aput(
+        self, config: RunnableConfig, checkpoint: Checkpoint
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint)
+
+    def latest(self, run_id: str) -> Optional[Checkpoint]:
+        """The last checkpoint of the run `run_id`, or None."""
+        saved = self.get_tuple(run_config(run_id))
+        return None if saved is None else saved.checkpoint
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
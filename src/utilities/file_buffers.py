@@ -0,0 +1,205 @@
+import itertools
+import os
+import threading
+from enum import Enum
+from typing import Dict, List, Optional, Set
+
+from src.common.definitions import CodeChange
+from src.utilities import tracing
+from src.utilities.paths import add_path_to_prefix, file_stamp
+from src.utilities.text_document import LineDocument
+
+
+class FlushPolicy(Enum):
+    """When dirty buffers are written back to disk."""
+
+    ACTION = "action"
+    STEP = "step"
+    RUN = "run"
+
+    def __str__(self):
+        return self.value
+
+
+# A flush point flushes every policy at or below it
+_FLUSH_ORDER = [FlushPolicy.ACTION, FlushPolicy.STEP, FlushPolicy.RUN]
+
+# Versions are unique across buffers so they can key caches of rendered spans
+_versions = itertools.count(1)
+
+
+class FileBuffer:
+    __slots__ = ("path", "document", "stamp", "dirty", "version")
+
+    def __init__(self, path: str, lines: List[str], stamp):
+        self.path = path
+        self.document = LineDocument(lines)
+        self.stamp = stamp
+        self.dirty = False
+        self.version = next(_versions)
+
+    def text(self) -> str:
+        return self.document.text()
+
+
+class BufferCache:
+    """
+    Holds the files of a project in memory as line-indexed documents.
+
+    Spans are served from memory and `CodeChange`s are applied in memory, then
+    written back according to the flush policy. Clean buffers are revalidated
+    against the file's mtime/size so edits made outside the agent are picked
+    up; a dirty buffer is the source of truth until it is flushed.
+    """
+
+    def __init__(self, folder_path: str, flush_policy=FlushPolicy.ACTION):
+        self.folder_path = folder_path
+        self.flush_policy = FlushPolicy(flush_policy)
+        self.lock = threading.RLock()
+        self._buffers: Dict[str, FileBuffer] = {}
+        self.bytes_read = 0
+        # While held (see `hold`), flush points are deferred rather than made
+        self._held = False
+        self._deferred = False
+
+    def _load(self, path: str) -> FileBuffer:
+        stamp = file_stamp(path)
+        with open(path, "r") as file:
+            lines = file.readlines()
+        self.bytes_read += stamp[1]
+        tracing.count("bytes_read", stamp[1])
+        return FileBuffer(path, lines, stamp)
+
+    def get(self, file_path: str) -> FileBuffer:
+        """Returns the buffer of a project-relative `file_path`."""
+        path = os.path.abspath(add_path_to_prefix(self.folder_path, file_path))
+        with self.lock:
+            buffer = self._buffers.get(path)
+            if buffer is None:
+                buffer = self._load(path)
+                self._buffers[path] = buffer
+            elif not buffer.dirty and buffer.stamp != file_stamp(path):
+                # Changed outside the agent
+                buffer = self._buffers[path] = self._load(path)
+            return buffer
+
+    def version(self, file_path: str) -> int:
+        return self.get(file_path).version
+
+    def read_span(self, file_path: str, start_line: int, end_line: int) -> str:
+        """Returns lines `start_line` to `end_line` (1-indexed, inclusive)."""
+        with self.lock:
+            document = self.get(file_path).document
+            return "".join(document.slice_lines(start_line - 1, end_line))
+
+    def dirty_text(self, file_path: str) -> Optional[str]:
+        """Returns the in-memory contents of a file that differs from disk."""
+        with self.lock:
+            path = os.path.abspath(add_path_to_prefix(self.folder_path, file_path))
+            buffer = self._buffers.get(path)
+            if buffer is None or not buffer.dirty:
+                return None
+            return buffer.text()
+
+    def dirty_paths(self) -> Set[str]:
+        """The absolute paths of the files that differ from disk."""
+        with self.lock:
+            return {path for path, buffer in self._buffers.items() if buffer.dirty}
+
+    def dirty_texts(self) -> Dict[str, str]:
+        """The in-memory contents of the files that differ from disk, by absolute path."""
+        with self.lock:
+            return {
+                path: buffer.text()
+                for path, buffer in self._buffers.items()
+                if buffer.dirty
+            }
+
+    def restore(self, texts: Dict[str, str]):
+        """Loads contents saved by `dirty_texts` back as unflushed buffers."""
+        with self.lock:
+            for path, text in texts.items():
+                buffer = FileBuffer(path, text.splitlines(keepends=True), None)
+                buffer.dirty = True
+                self._buffers[path] = buffer
+
+    def apply_change(self, change: CodeChange):
+        with self.lock:
+            buffer = self.get(change.file)
+            start = change.start_line - 1
+            end = change.end_line - 1  # File index to 0  index
+            buffer.document.replace_lines(start, end, change.replacement_lines())
+            buffer.dirty = True
+            buffer.version = next(_versions)
+
+    def flush(self):
+        """Writes every dirty buffer back to disk."""
+        with self.lock:
+            for buffer in self._buffers.values():
+                if not buffer.dirty:
+                    continue
+                with open(buffer.path, "w") as file:
+                    file.write(buffer.text())
+                buffer.stamp = file_stamp(buffer.path)
+                buffer.dirty = False
+
+    def flush_point(self, point: FlushPolicy, policy=None):
+        """
+        Marks the end of an action, step or run; flushes if the policy says
+        so. `policy` is the caller's own (its project context's), so runs
+        sharing the cache do not follow each other's; it defaults to the
+        cache's.
+        """
+        policy = self.flush_policy if policy is None else FlushPolicy(policy)
+        if _FLUSH_ORDER.index(policy) > _FLUSH_ORDER.index(point):
+            return
+        with self.lock:
+            if self._held:
+                self._deferred = True
+            else:
+                self.flush()
+
+    def hold(self):
+        """Defers flush points until `release`."""
+        with self.lock:
+            self._held = True
+
+    def release(self):
+        """Ends a `hold`, making the flush it deferred, if any."""
+        with self.lock:
+            self._held = False
+            if self._deferred:
+                self._deferred = False
+                self.flush()
+
+    def clear(self):
+        with self.lock:
+            self.flush()
+            self._buffers.clear()
+
+    def discard(self):
+        """
+        Drops every buffer, unflushed edits and deferred flushes included
+        (e.g. after a rollback).
+        """
+        with self.lock:
+            self._buffers.clear()
+            self._held = self._deferred = False
+
+
+_caches: Dict[str, BufferCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_buffer_cache(context) -> BufferCache:
+    """
+    Returns the buffer cache of the project described by `context`, created
+    with its flush policy. Callers pass their own policy to `flush_point`.
+    """
+    key = os.path.abspath(context.folder_path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = BufferCache(key, context.flush_policy)
+            _caches[key] = cache
+        return cache
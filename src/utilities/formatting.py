@@ -4,3 +4,12 @@ def format_list(events, prefix, field_name):
         return f"**Empty {field_name}**"
     else:
         return "\n".join([f"#{prefix}{i+1} {event}" for i, event in enumerate(events)])
+
+
+def format_numbered(entries, prefix, field_name, note=None):
+    """Like `format_list`, for (number, event) pairs left after omitting some."""
+    lines = [] if note is None else [note]
+    lines.extend(f"#{prefix}{number} {event}" for number, event in entries)
+    if len(lines) == 0:
+        return f"**Empty {field_name}**"
+    return "\n".join(lines)
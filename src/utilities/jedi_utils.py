@@ -1,3 +1,5 @@
+from typing import Dict, List
+
 import jedi
 from src.common.definitions import (
     CodeSnippet,
@@ -6,15 +8,26 @@ from src.common.definitions import (
     ProjectContext,
     Symbol,
 )
+from src.utilities.file_buffers import get_buffer_cache
+from src.utilities.jedi_workers import get_jedi_workers
 from src.utilities.paths import add_path_to_prefix, remove_path_prefix
 
 
-def goto_symbol(context: ProjectContext, symbol: Symbol):
+def goto_symbol_future(
+    context: ProjectContext, symbol: Symbol, follow_imports: bool = False
+):
+    """Starts a `goto` on a Jedi worker; the future resolves to `JediName`s."""
     path = add_path_to_prefix(context.folder_path, symbol.file_path)
     line = symbol.line
     column = symbol.column
-    jedi_script = jedi.Script(path=path)
-    definition = jedi_script.goto(line, column)
+    code = get_buffer_cache(context).dirty_text(symbol.file_path)
+    return get_jedi_workers().goto(
+        context.folder_path, path, line, column, code, follow_imports
+    )
+
+
+def goto_symbol(context: ProjectContext, symbol: Symbol):
+    definition = goto_symbol_future(context, symbol).result()
     return definition[0]
 
 
@@ -34,6 +47,42 @@ def symbol_to_definition(symbol: Symbol, context: ProjectContext) -> Definition:
     return Definition(symbol=symbol, span=span)
 
 
+def completions_to_definitions(
+    completions, context: ProjectContext
+) -> List[Definition]:
+    """
+    Resolves the definitions of many completions at once.
+
+    `complete_search` already returns names positioned on their definitions, so
+    rather than doing a `goto` round trip per name, the names are grouped by
+    module and each module's spans are read straight off the names. Names
+    without a definition position (e.g. bare modules) are skipped.
+    """
+    by_module: Dict[str, list] = {}
+    for name in completions:
+        if name.module_path is None:
+            continue
+        by_module.setdefault(str(name.module_path), []).append(name)
+
+    definitions = []
+    for module_path, names in by_module.items():
+        path = str(remove_path_prefix(module_path, context.folder_path))
+        for name in sorted(names, key=lambda n: (n.line or 0, n.column or 0)):
+            start = name.get_definition_start_position()
+            end = name.get_definition_end_position()
+            if start is None or end is None:
+                continue
+            symbol = Symbol(
+                name=str(name.name),
+                file_path=path,
+                line=int(name.line),
+                column=int(name.column),
+            )
+            span = CodeSpan(file_path=path, start_line=start[0], end_line=end[0])
+            definitions.append(Definition(symbol=symbol, span=span))
+    return definitions
+
+
 def jedi_name_to_symbol(name, context: ProjectContext) -> Symbol:
     (line, column) = name.line, name.column
     path = remove_path_prefix(name.module_path, context.folder_path)
@@ -47,13 +96,8 @@ def jedi_name_to_symbol(name, context: ProjectContext) -> Symbol:
 
 
 def load_code(span: CodeSpan, context: ProjectContext):
-    path = add_path_to_prefix(context.folder_path, span.file_path)
-    start = span.start_line - 1
-    end = span.end_line - 1
-    with open(path, "r") as file:
-        code = file.readlines()
-        #    Get the code
-        return "".join(code[start : end + 1])
+    buffers = get_buffer_cache(context)
+    return buffers.read_span(span.file_path, span.start_line, span.end_line)
 
 
 def add_line_numbers(code: str, starting_line: int) -> str:
@@ -0,0 +1,177 @@
+"""
+Jedi inference in worker processes.
+
+Jedi is pure Python, so searches run on threads (concurrent plan entries,
+concurrent sessions) serialise on the GIL. `JediWorkers` hosts warm
+`JediSession`s in separate processes instead and returns futures. Requests
+are routed by file path, so each file is parsed and inferred in one worker
+whose caches stay warm; project-wide searches are routed by project.
+
+Jedi's names cannot be pickled, so workers answer with `JediName`s: the
+parts of a name the agent reads, resolved in the worker.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from src.utilities import tracing
+from src.utilities.jedi_session import get_jedi_session
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class JediName(NamedTuple):
+    """A picklable stand-in for the jedi Names the agent uses."""
+
+    name: str
+    module_path: Optional[str]
+    line: Optional[int]
+    column: Optional[int]
+    definition_start: Optional[Tuple[int, int]]
+    definition_end: Optional[Tuple[int, int]]
+
+    def get_definition_start_position(self) -> Optional[Tuple[int, int]]:
+        return self.definition_start
+
+    def get_definition_end_position(self) -> Optional[Tuple[int, int]]:
+        return self.definition_end
+
+
+def to_jedi_name(name) -> JediName:
+    module_path = name.module_path
+    return JediName(
+        name=str(name.name),
+        module_path=None if module_path is None else str(module_path),
+        line=name.line,
+        column=name.column,
+        definition_start=name.get_definition_start_position(),
+        definition_end=name.get_definition_end_position(),
+    )
+
+
+# Run in the workers (or in-process), against that process' sessions
+
+
+def _complete_search(
+    folder_path: str, query: str, path: Optional[str], code: Optional[str]
+) -> List[JediName]:
+    session = get_jedi_session(folder_path)
+    return [to_jedi_name(n) for n in session.complete_search(query, path, code)]
+
+
+def _goto(
+    folder_path: str,
+    path: str,
+    line: int,
+    column: int,
+    code: Optional[str],
+    follow_imports: bool,
+) -> List[JediName]:
+    session = get_jedi_session(folder_path)
+    names = session.goto(path, line, column, code, follow_imports=follow_imports)
+    return [to_jedi_name(n) for n in names]
+
+
+class JediWorkers:
+    """
+    A futures API over Jedi, backed by `max_workers` single-process pools.
+
+    With `max_workers=0` requests run in the calling thread (and the futures
+    are already done), against the in-process sessions.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._pools: List[Optional[ProcessPoolExecutor]] = [None] * max_workers
+        self.lock = threading.Lock()
+
+    def _pool(self, route: str) -> ProcessPoolExecutor:
+        index = zlib.crc32(route.encode()) % self.max_workers
+        with self.lock:
+            pool = self._pools[index]
+            if pool is None:
+                # Spawned: forking the agent's threads (trulens, the plan
+                # scheduler) could copy a held lock into the worker
+                pool = ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._pools[index] = pool
+            return pool
+
+    def _submit(self, route: str, fn: Callable, *args) -> Future:
+        if self.max_workers == 0:
+            # The in-process session counts its own calls
+            future: Future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        tracing.count("jedi_calls")
+        return self._pool(route).submit(fn, *args)
+
+    def complete_search(
+        self,
+        folder_path: str,
+        query: str,
+        path: Optional[str] = None,
+        code: Optional[str] = None,
+    ) -> "Future[List[JediName]]":
+        """Searches one file (its current `code`, if given) or the whole project."""
+        folder_path = os.path.abspath(folder_path)
+        route = folder_path if path is None else os.path.abspath(path)
+        return self._submit(route, _complete_search, folder_path, query, path, code)
+
+    def goto(
+        self,
+        folder_path: str,
+        path: str,
+        line: int,
+        column: int,
+        code: Optional[str] = None,
+        follow_imports: bool = False,
+    ) -> "Future[List[JediName]]":
+        folder_path = os.path.abspath(folder_path)
+        path = os.path.abspath(path)
+        args = (folder_path, path, line, column, code, follow_imports)
+        return self._submit(path, _goto, *args)
+
+    def shutdown(self):
+        with self.lock:
+            for pool in self._pools:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+            self._pools = [None] * self.max_workers
+
+
+_workers: Optional[JediWorkers] = None
+_workers_lock = threading.Lock()
+
+
+def get_jedi_workers() -> JediWorkers:
+    """
+    The process-wide worker pool, one worker per core (up to four).
+    LESS_JEDI_WORKERS sets its size; 0 runs Jedi in-process.
+    """
+    global _workers
+    with _workers_lock:
+        if _workers is None:
+            cpus = os.cpu_count() or 1
+            # With a single core, processes only add pickling round trips
+            default = 0 if cpus == 1 else min(DEFAULT_MAX_WORKERS, cpus)
+            _workers = JediWorkers(int(os.getenv("LESS_JEDI_WORKERS", default)))
+        return _workers
+
+
+@atexit.register
+def shutdown_jedi_workers():
+    global _workers
+    with _workers_lock:
+        if _workers is not None:
+            _workers.shutdown()
+            _workers = None
@@ -1,4 +1,5 @@
 import os
+from typing import Tuple
 
 # TODO
 # class RelativeFilePath:
@@ -23,3 +24,19 @@ def remove_path_prefix(path: str, prefix: str) -> str:
 
 def add_path_to_prefix(prefix: str, path: str):
     return os.path.join(prefix, standardize_code_path(path))
+
+
+def file_stamp(path: str) -> Tuple[int, int]:
+    # A cheap change detector: modification time and size, without reading the file
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_cache_dir(*parts: str) -> str:
+    # Local caches (indices, prompts, responses); override with LESS_CACHE_DIR
+    root = os.getenv("LESS_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "less"
+    )
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,421 @@
+import bisect
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src.common.definitions import CodeChange, CodeSpan
+from src.utilities.paths import standardize_code_path
+
+DEAD = float("-inf")
+
+
+class _SpanTree:
+    """
+    A segment tree over one file's spans, ordered by start line.
+
+    Every node keeps the largest start and end line below it and a pending
+    shift, so shifting all spans after an edit is a single lazy range update,
+    and the spans overlapping an edit are found by descending only into nodes
+    whose largest end line reaches the edit.
+    """
+
+    def __init__(self, bounds: List[Tuple[int, int]]):
+        self.n = len(bounds)
+        self.max_start = [DEAD] * (4 * max(self.n, 1))
+        self.max_end = [DEAD] * (4 * max(self.n, 1))
+        self.lazy = [0] * (4 * max(self.n, 1))
+        if self.n:
+            self._build(1, 0, self.n, bounds)
+
+    def _build(self, node, lo, hi, bounds):
+        if hi - lo == 1:
+            self.max_start[node], self.max_end[node] = bounds[lo]
+            return
+        mid = (lo + hi) // 2
+        self._build(2 * node, lo, mid, bounds)
+        self._build(2 * node + 1, mid, hi, bounds)
+        self._pull(node)
+
+    def _pull(self, node):
+        self.max_start[node] = max(
+            self.max_start[2 * node], self.max_start[2 * node + 1]
+        )
+        self.max_end[node] = max(self.max_end[2 * node], self.max_end[2 * node + 1])
+
+    def _shift(self, node, delta):
+        self.max_start[node] += delta
+        self.max_end[node] += delta
+        self.lazy[node] += delta
+
+    def _push(self, node):
+        if self.lazy[node]:
+            self._shift(2 * node, self.lazy[node])
+            self._shift(2 * node + 1, self.lazy[node])
+            self.lazy[node] = 0
+
+    def first_start_at_least(self, line) -> int:
+        """Index of the first live span starting at or after `line`."""
+        if self.n == 0 or self.max_start[1] < line:
+            return self.n
+        node, lo, hi = 1, 0, self.n
+        while hi - lo > 1:
+            self._push(node)
+            mid = (lo + hi) // 2
+            if self.max_start[2 * node] >= line:
+                node, hi = 2 * node, mid
+            else:
+                node, lo = 2 * node + 1, mid
+        return lo
+
+    def shift(self, lo: int, hi: int, delta: int, node=1, n_lo=0, n_hi=None):
+        if n_hi is None:
+            n_hi = self.n
+        if hi <= n_lo or n_hi <= lo or delta == 0:
+            return
+        if lo <= n_lo and n_hi <= hi:
+            self._shift(node, delta)
+            return
+        self._push(node)
+        mid = (n_lo + n_hi) // 2
+        self.shift(lo, hi, delta, 2 * node, n_lo, mid)
+        self.shift(lo, hi, delta, 2 * node + 1, mid, n_hi)
+        self._pull(node)
+
+    def ends_at_least(self, hi: int, line, node=1, n_lo=0, n_hi=None) -> List[int]:
+        """Indices below `hi` of live spans ending at or after `line`."""
+        if n_hi is None:
+            n_hi = self.n
+        if hi <= n_lo or self.n == 0 or self.max_end[node] < line:
+            return []
+        if n_hi - n_lo == 1:
+            return [n_lo]
+        self._push(node)
+        mid = (n_lo + n_hi) // 2
+        return self.ends_at_least(hi, line, 2 * node, n_lo, mid) + self.ends_at_least(
+            hi, line, 2 * node + 1, mid, n_hi
+        )
+
+    def get(self, index: int) -> Tuple[int, int]:
+        node, lo, hi = 1, 0, self.n
+        while hi - lo > 1:
+            self._push(node)
+            mid = (lo + hi) // 2
+            if index < mid:
+                node, hi = 2 * node, mid
+            else:
+                node, lo = 2 * node + 1, mid
+        return self.max_start[node], self.max_end[node]
+
+    def set(self, index: int, start, end, node=1, lo=0, hi=None):
+        if hi is None:
+            hi = self.n
+        if hi - lo == 1:
+            self.max_start[node], self.max_end[node] = start, end
+            return
+        self._push(node)
+        mid = (lo + hi) // 2
+        if index < mid:
+            self.set(index, start, end, 2 * node, lo, mid)
+        else:
+            self.set(index, start, end, 2 * node + 1, mid, hi)
+        self._pull(node)
+
+    def bounds(self, node=1, lo=0, hi=None) -> List[Tuple[int, int]]:
+        """Every span's (start, end), pushing all pending shifts down."""
+        if hi is None:
+            hi = self.n
+            if self.n == 0:
+                return []
+        if hi - lo == 1:
+            return [(self.max_start[node], self.max_end[node])]
+        self._push(node)
+        mid = (lo + hi) // 2
+        return self.bounds(2 * node, lo, mid) + self.bounds(2 * node + 1, mid, hi)
+
+
+class _TrackedSpan:
+    __slots__ = ("id", "span", "alive", "used")
+
+    def __init__(self, id: int, span: CodeSpan, used: int):
+        self.id = id
+        self.span = span
+        self.alive = True
+        # When the span was last added or edited
+        self.used = used
+
+
+class _FileSpans:
+    def __init__(self):
+        self.entries: List[_TrackedSpan] = []
+        self.pending: List[_TrackedSpan] = []
+        self.tree = _SpanTree([])
+        # Whether the span objects lag behind the tree
+        self.stale = False
+
+    def sync(self):
+        """Writes the tree's positions back into the span objects."""
+        if self.stale:
+            for entry, (start, end) in zip(self.entries, self.tree.bounds()):
+                if entry.alive:
+                    entry.span.start_line = int(start)
+                    entry.span.end_line = int(end)
+            self.stale = False
+
+    def rebuild(self):
+        self.sync()
+        entries = [e for e in self.entries + self.pending if e.alive]
+        entries.sort(key=lambda e: e.span.start_line)
+        self.entries = entries
+        self.pending = []
+        self.tree = _SpanTree([(e.span.start_line, e.span.end_line) for e in entries])
+
+    def apply_change(
+        self, start: int, end: int, new_count: int, used: int
+    ) -> Tuple[int, int]:
+        """
+        Updates the spans for lines [start, end) being replaced by `new_count` lines.
+        Spans that survive the change are marked used at `used`.
+
+        Returns how many spans overlapped the change and how many were dropped.
+        """
+        if self.pending:
+            self.rebuild()
+        tree = self.tree
+        delta = new_count - (end - start)
+        last = end - 1
+
+        # Spans after the change move as a block
+        following = tree.first_start_at_least(end)
+        tree.shift(following, tree.n, delta)
+        self.stale = True
+
+        overlapping = tree.ends_at_least(following, start)
+        dropped = 0
+        for i in overlapping:
+            a, b = tree.get(i)
+            if a <= start and b >= last:
+                # Contains the change (or is exactly the replaced lines)
+                b += delta
+            elif a >= start and b <= last:
+                # Wholly replaced
+                b = a - 1
+            elif a < start:
+                # Its tail was replaced: keep covering the replacement
+                b = start + new_count - 1
+            else:
+                # Its head was replaced: start at the replacement
+                a, b = start, b + delta
+            if b < a:
+                self.entries[i].alive = False
+                tree.set(i, DEAD, DEAD)
+                dropped += 1
+            else:
+                tree.set(i, a, b)
+                self.entries[i].used = used
+        return len(overlapping), dropped
+
+
+class _FileBlocks(_FileSpans):
+    """
+    A file's spans in a `CodeBlockStore`, which never overlap or touch.
+
+    New blocks wait in `pending`, sorted by start line, until the next edit
+    rebuilds the tree. The blocks a new or edited block touches are found
+    through the tree and by bisecting `pending`, so merging visits only them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pending_starts: List[int] = []
+
+    def rebuild(self):
+        super().rebuild()
+        self.pending_starts = []
+
+    def _merge(self, in_tree: List[int], lo: int, hi: int, new=()) -> int:
+        """
+        Merges the tree's blocks `in_tree`, `pending[lo:hi]` and `new`, which
+        together cover a run of lines, into the oldest; returns how many were
+        dropped.
+        """
+        tree = self.tree
+        group = [self.entries[i] for i in in_tree] + self.pending[lo:hi] + list(new)
+        bounds = [tree.get(i) for i in in_tree] + [
+            (e.span.start_line, e.span.end_line) for e in group[len(in_tree) :]
+        ]
+        start = min(a for a, _ in bounds)
+        end = max(b for _, b in bounds)
+        keep = min(group, key=lambda e: e.id)
+        keep.used = max(e.used for e in group)
+        for i in in_tree:
+            if self.entries[i] is keep:
+                tree.set(i, start, end)
+                self.stale = True
+            else:
+                self.entries[i].alive = False
+                tree.set(i, DEAD, DEAD)
+        kept = [e for e in self.pending[lo:hi] if e is keep]
+        if kept:
+            keep.span.start_line, keep.span.end_line = start, end
+        self.pending[lo:hi] = kept
+        self.pending_starts[lo:hi] = [start] if kept else []
+        for entry in group:
+            if entry is not keep:
+                entry.alive = False
+        return len(group) - 1
+
+    def add(self, entry: _TrackedSpan) -> int:
+        """Adds `entry`, merged with the blocks it touches; returns how many were dropped."""
+        start, end = entry.span.start_line, entry.span.end_line
+        tree = self.tree
+        in_tree = tree.ends_at_least(tree.first_start_at_least(end + 2), start - 1)
+        hi = bisect.bisect_right(self.pending_starts, end + 1)
+        lo = hi
+        while lo > 0 and self.pending[lo - 1].span.end_line >= start - 1:
+            lo -= 1
+        if not in_tree and lo == hi:
+            self.pending.insert(hi, entry)
+            self.pending_starts.insert(hi, start)
+            return 0
+        return self._merge(in_tree, lo, hi, [entry])
+
+    def merge_edited(self, start: int, new_count: int) -> int:
+        """
+        Merges the blocks that an edit replacing lines from `start` with
+        `new_count` lines made touch: those reaching the replaced lines or a
+        line either side of them. Returns how many were dropped.
+        """
+        tree = self.tree
+        window = tree.ends_at_least(
+            tree.first_start_at_least(start + new_count + 1), start - 1
+        )
+        dropped = 0
+        group: List[int] = []
+        end = DEAD
+        for i in window:
+            a, b = tree.get(i)
+            if group and a > end + 1:
+                if len(group) > 1:
+                    dropped += self._merge(group, 0, 0)
+                group, end = [], DEAD
+            group.append(i)
+            end = max(end, b)
+        if len(group) > 1:
+            dropped += self._merge(group, 0, 0)
+        return dropped
+
+
+class SpanIndex:
+    """
+    The code spans tracked by the agent, kept up to date across edits.
+
+    Behaves like the list of `CodeSpan`s it replaces (append, iterate, len) in
+    insertion order. Each span keeps the id it was added with and when it was
+    last added or edited (see `blocks`). Internally each file has a `_SpanTree`, so an edit shifts
+    every following span lazily in O(log n) and only the k spans overlapping
+    the edit are visited. Spans whose lines were wholly replaced are dropped.
+    """
+
+    def __init__(self, spans: Optional[List[CodeSpan]] = None):
+        self.lock = threading.RLock()
+        self._files: Dict[str, _FileSpans] = {}
+        self._order: List[_TrackedSpan] = []
+        self.invalidated = 0
+        self._clock = 0
+        self._next_id = 0
+        for span in spans or []:
+            self.append(span)
+
+    def __getstate__(self):
+        # Checkpoints pickle the store; the lock is not state
+        with self.lock:
+            state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def append(self, span: CodeSpan):
+        with self.lock:
+            self._next_id += 1
+            entry = _TrackedSpan(self._next_id, span, self._tick())
+            path = standardize_code_path(span.file_path)
+            self._order.append(entry)
+            self._add(self._files.setdefault(path, self._new_file()), entry)
+
+    def _new_file(self) -> _FileSpans:
+        return _FileSpans()
+
+    def _add(self, spans: _FileSpans, entry: _TrackedSpan):
+        spans.pending.append(entry)
+
+    def extend(self, spans):
+        for span in spans:
+            self.append(span)
+
+    def apply_change(self, change: CodeChange) -> int:
+        """Moves, resizes or invalidates the spans affected by `change`."""
+        with self.lock:
+            spans = self._files.get(standardize_code_path(change.file))
+            if spans is None:
+                return 0
+            new_count = len(change.replacement_lines())
+            overlapping, dropped = spans.apply_change(
+                change.start_line, change.end_line, new_count, self._tick()
+            )
+            self.invalidated += dropped
+            return overlapping
+
+    def _live(self) -> List[_TrackedSpan]:
+        with self.lock:
+            for spans in self._files.values():
+                spans.sync()
+            if len(self._order) > 64 and self.invalidated * 2 > len(self._order):
+                self._order = [e for e in self._order if e.alive]
+                self.invalidated = 0
+            return [e for e in self._order if e.alive]
+
+    def blocks(self) -> List[Tuple[int, CodeSpan, int]]:
+        """(id, span, last used) of every span, in iteration order."""
+        return [(e.id, e.span, e.used) for e in self._live()]
+
+    def __iter__(self) -> Iterator[CodeSpan]:
+        return iter([e.span for e in self._live()])
+
+    def __len__(self) -> int:
+        return len(self._live())
+
+    def __getitem__(self, index: int) -> CodeSpan:
+        return self._live()[index].span
+
+
+class CodeBlockStore(SpanIndex):
+    """
+    The agent's code snippets: a `SpanIndex` whose spans never overlap.
+
+    A span within a stored block (a repeated search, a method of a class
+    already shown) only marks the block used; one that overlaps or touches
+    blocks is merged with them into the oldest, so no line of a file is read
+    or rendered twice. Blocks that an edit makes touch are merged as well.
+    Blocks keep the id they were first given, which labels them in prompts.
+    """
+
+    def _new_file(self) -> _FileBlocks:
+        return _FileBlocks()
+
+    def _add(self, spans: _FileBlocks, entry: _TrackedSpan):
+        self.invalidated += spans.add(entry)
+
+    def apply_change(self, change: CodeChange) -> int:
+        with self.lock:
+            overlapping = super().apply_change(change)
+            spans = self._files.get(standardize_code_path(change.file))
+            if spans is not None:
+                new_count = len(change.replacement_lines())
+                self.invalidated += spans.merge_edited(change.start_line, new_count)
+            return overlapping
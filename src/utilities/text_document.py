@@ -0,0 +1,195 @@
+import random
+from itertools import accumulate
+from typing import Iterable, List, Optional
+
+
+class _Piece:
+    """A run of consecutive lines of one buffer, and a node of the piece tree."""
+
+    __slots__ = (
+        "buffer",
+        "start",
+        "count",
+        "chars",
+        "priority",
+        "left",
+        "right",
+        "total_lines",
+        "total_chars",
+    )
+
+    def __init__(self, buffer: int, start: int, count: int, chars: int, priority):
+        self.buffer = buffer
+        self.start = start
+        self.count = count
+        self.chars = chars
+        self.priority = priority
+        self.left: Optional["_Piece"] = None
+        self.right: Optional["_Piece"] = None
+        self.total_lines = count
+        self.total_chars = chars
+
+
+def _lines(node: Optional[_Piece]) -> int:
+    return node.total_lines if node is not None else 0
+
+
+def _chars(node: Optional[_Piece]) -> int:
+    return node.total_chars if node is not None else 0
+
+
+def _update(node: _Piece):
+    node.total_lines = node.count + _lines(node.left) + _lines(node.right)
+    node.total_chars = node.chars + _chars(node.left) + _chars(node.right)
+
+
+class LineDocument:
+    """
+    A piece table over lines, kept in a randomised balanced tree (a treap).
+
+    The original lines and every inserted line live in two append-only buffers;
+    the document is the in-order sequence of pieces pointing into them. Each
+    tree node knows how many lines and characters its subtree covers, so
+    replacing, slicing and finding the character offset of a line are
+    O(log n) in the number of pieces rather than O(file size).
+
+    Lines are 0-indexed, ranges are half-open and lines keep their newline.
+    """
+
+    def __init__(self, lines: Iterable[str] = ()):
+        lines = list(lines)
+        self._buffers: List[List[str]] = [lines, []]
+        # Character prefix sums of each buffer, so pieces can be measured in O(1)
+        self._prefix: List[List[int]] = [
+            [0, *accumulate(map(len, lines))],
+            [0],
+        ]
+        self._random = random.Random(0x5EED)
+        self._root: Optional[_Piece] = None
+        if lines:
+            self._root = self._new_piece(0, 0, len(lines))
+
+    def _new_piece(self, buffer: int, start: int, count: int) -> _Piece:
+        prefix = self._prefix[buffer]
+        chars = prefix[start + count] - prefix[start]
+        return _Piece(buffer, start, count, chars, self._random.random())
+
+    def _split(self, node: Optional[_Piece], k: int):
+        """Splits a tree into its first `k` lines and the rest."""
+        if node is None:
+            return None, None
+        left_lines = _lines(node.left)
+        if k <= left_lines:
+            left, node.left = self._split(node.left, k)
+            _update(node)
+            return left, node
+        if k >= left_lines + node.count:
+            node.right, right = self._split(node.right, k - left_lines - node.count)
+            _update(node)
+            return node, right
+
+        # The split falls inside this piece. The tail takes the node's priority
+        # so it can sit above the node's old right subtree.
+        offset = k - left_lines
+        tail = self._new_piece(node.buffer, node.start + offset, node.count - offset)
+        tail.priority = node.priority
+        tail.right = node.right
+        node.right = None
+        node.count = offset
+        node.chars -= tail.chars
+        _update(tail)
+        _update(node)
+        return node, tail
+
+    def _merge(self, left: Optional[_Piece], right: Optional[_Piece]):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            _update(left)
+            return left
+        right.left = self._merge(left, right.left)
+        _update(right)
+        return right
+
+    def __len__(self) -> int:
+        return _lines(self._root)
+
+    @property
+    def char_count(self) -> int:
+        return _chars(self._root)
+
+    def replace_lines(self, start: int, end: int, new_lines: List[str]):
+        """Replaces lines [start, end) with `new_lines`."""
+        start = max(0, min(start, len(self)))
+        end = max(start, min(end, len(self)))
+        left, rest = self._split(self._root, start)
+        _, right = self._split(rest, end - start)
+
+        piece = None
+        if new_lines:
+            added = self._buffers[1]
+            prefix = self._prefix[1]
+            offset = len(added)
+            added.extend(new_lines)
+            total = prefix[-1]
+            for line in new_lines:
+                total += len(line)
+                prefix.append(total)
+            piece = self._new_piece(1, offset, len(new_lines))
+        self._root = self._merge(self._merge(left, piece), right)
+
+    def slice_lines(self, start: int, end: int) -> List[str]:
+        """Returns lines [start, end)."""
+        out: List[str] = []
+        self._collect(self._root, 0, max(0, start), min(end, len(self)), out)
+        return out
+
+    def _collect(self, node, offset: int, start: int, end: int, out: List[str]):
+        if node is None or start >= end:
+            return
+        if offset + node.total_lines <= start or offset >= end:
+            return
+        self._collect(node.left, offset, start, end, out)
+        piece_offset = offset + _lines(node.left)
+        lo = max(start, piece_offset) - piece_offset
+        hi = min(end, piece_offset + node.count) - piece_offset
+        if lo < hi:
+            buffer = self._buffers[node.buffer]
+            out.extend(buffer[node.start + lo : node.start + hi])
+        self._collect(node.right, piece_offset + node.count, start, end, out)
+
+    def line(self, index: int) -> str:
+        lines = self.slice_lines(index, index + 1)
+        if not lines:
+            raise IndexError(index)
+        return lines[0]
+
+    def line_offset(self, index: int) -> int:
+        """Returns the character offset at which line `index` starts."""
+        if index >= len(self):
+            return self.char_count
+        offset = 0
+        node = self._root
+        while node is not None:
+            left_lines = _lines(node.left)
+            if index < left_lines:
+                node = node.left
+            elif index < left_lines + node.count:
+                prefix = self._prefix[node.buffer]
+                within = index - left_lines
+                offset += _chars(node.left)
+                return offset + prefix[node.start + within] - prefix[node.start]
+            else:
+                offset += _chars(node.left) + node.chars
+                index -= left_lines + node.count
+                node = node.right
+        return offset
+
+    def lines(self) -> List[str]:
+        return self.slice_lines(0, len(self))
+
+    def text(self) -> str:
+        return "".join(self.lines())
@@ -0,0 +1,33 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import tiktoken
+
+# The encoding of the models the controllers talk to
+DEFAULT_ENCODING = "cl100k_base"
+# OpenAI's rule of thumb for English text and code
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str) -> Optional["tiktoken.Encoding"]:
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Unknown (or fake) model names
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:
+        # The encoding is downloaded on first use; offline, estimate instead
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """The number of tokens `model` reads for `text`, or an estimate offline."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
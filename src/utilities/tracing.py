@@ -0,0 +1,282 @@
+"""
+Spans around the agent's graph nodes, actions and dispatches.
+
+Nothing is measured unless a tracer is installed with `tracing(*sinks)`:
+
+    summary = SummarySink()
+    with tracing(summary, ChromeTraceSink("trace.json")):
+        agent.run(goal, context)
+    print(summary.format())
+
+Each span records its wall and CPU time plus counters (prompt characters and
+tokens, file bytes read, Jedi calls) added with `count` while it is open.
+A counter is added to every enclosing span, so a node's totals include
+those of the actions it ran. Open spans are tracked in a context variable,
+so concurrent runs on threads or asyncio tasks keep their spans apart.
+CPU time is that of the thread that closed the span; for an async node it
+includes whatever other tasks ran on the event loop meanwhile.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from src.utilities.tokens import count_tokens
+
+
+class Span:
+    __slots__ = ("name", "kind", "depth", "thread", "start", "wall", "cpu", "counters")
+
+    def __init__(self, name: str, kind: str, depth: int, start: float):
+        self.name = name
+        self.kind = kind
+        self.depth = depth
+        self.thread = threading.get_ident()
+        self.start = start
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.counters: Counter = Counter()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "depth": self.depth,
+            "thread": self.thread,
+            "start_s": self.start,
+            "wall_s": self.wall,
+            "cpu_s": self.cpu,
+            **self.counters,
+        }
+
+
+_open_spans: ContextVar[Tuple[Span, ...]] = ContextVar("open_spans", default=())
+_counters_lock = threading.Lock()
+
+
+class Tracer:
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: str):
+        open_spans = _open_spans.get()
+        start = time.perf_counter()
+        span = Span(name, kind, len(open_spans), start - self.origin)
+        token = _open_spans.set(open_spans + (span,))
+        cpu_start = time.thread_time()
+        try:
+            yield span
+        finally:
+            span.cpu = time.thread_time() - cpu_start
+            span.wall = time.perf_counter() - start
+            _open_spans.reset(token)
+            with self.lock:
+                for sink in self.sinks:
+                    sink.add(span)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+_tracer: Optional[Tracer] = None
+
+
+@contextlib.contextmanager
+def tracing(*sinks):
+    """Installs a tracer writing to `sinks` for the duration of the block."""
+    global _tracer
+    previous, tracer = _tracer, Tracer(sinks)
+    _tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+        tracer.close()
+
+
+def span(name: str, kind: str):
+    """A span of the installed tracer, or a no-op if tracing is off."""
+    tracer = _tracer
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, kind)
+
+
+def count(key: str, amount: int = 1):
+    """Adds `amount` to the `key` counter of every open span."""
+    open_spans = _open_spans.get()
+    if not open_spans:
+        return
+    with _counters_lock:
+        for open_span in open_spans:
+            open_span.counters[key] += amount
+
+
+def count_prompt(prompt: str):
+    """Counts the characters and tokens of a prompt sent to the LLM."""
+    if not _open_spans.get():
+        return
+    count("prompt_chars", len(prompt))
+    count("prompt_tokens", count_tokens(prompt))
+
+
+SUMMARY_COLUMNS = [
+    "calls",
+    "wall_s",
+    "cpu_s",
+    "prompt_tokens",
+    "bytes_read",
+    "jedi_calls",
+]
+
+
+class SummarySink:
+    """Totals per span name, kept in memory."""
+
+    def __init__(self):
+        self.totals: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+
+    def add(self, span: Span):
+        totals = self.totals[(span.kind, span.name)]
+        totals["calls"] += 1
+        totals["wall_s"] += span.wall
+        totals["cpu_s"] += span.cpu
+        totals.update(span.counters)
+
+    def summary(self) -> Dict[str, Dict[str, dict]]:
+        """{kind: {name: totals}}"""
+        result: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        for (kind, name), totals in self.totals.items():
+            result[kind][name] = dict(totals)
+        return dict(result)
+
+    def format(self) -> str:
+        columns = SUMMARY_COLUMNS
+        lines = [f"{'span':<32}" + "".join(f"{column:>14}" for column in columns)]
+        ordered = sorted(self.totals.items(), key=lambda item: -item[1]["wall_s"])
+        for (kind, name), totals in ordered:
+            cells = []
+            for column in columns:
+                value = totals[column]
+                cells.append(
+                    f"{value:>14.3f}" if column.endswith("_s") else f"{value:>14}"
+                )
+            lines.append(f"{kind + ':' + name:<32}" + "".join(cells))
+        return "\n".join(lines)
+
+    def close(self):
+        pass
+
+
+class JSONLSink:
+    """Writes every span as a line of JSON, as it closes."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "w")
+
+    def add(self, span: Span):
+        self.file.write(json.dumps(span.to_dict()) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ChromeTraceSink:
+    """Writes the spans as a Chrome trace-event file (chrome://tracing, Perfetto)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.events: List[dict] = []
+
+    def add(self, span: Span):
+        self.events.append(
+            {
+                "name": span.name,
+                "cat": span.kind,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.wall * 1e6,
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": {"cpu_ms": span.cpu * 1e3, **span.counters},
+            }
+        )
+
+    def close(self):
+        with open(self.path, "w") as file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread from a background thread.
+
+    The samples are written in the folded-stack format read by flamegraph.pl
+    and speedscope. Sampling costs the profiled threads the time the sampler
+    holds the GIL, so keep `interval` at a few milliseconds.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(
+            target=self._sample, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def write_folded(self, path: str):
+        with open(path, "w") as file:
+            for stack, samples in self.samples.most_common():
+                file.write(f"{stack} {samples}\n")
+
+    def top(self, n: int = 20) -> List[Tuple[str, int]]:
+        """The `n` functions most often on top of a sampled stack."""
+        own: Counter = Counter()
+        for stack, samples in self.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += samples
+        return own.most_common(n)
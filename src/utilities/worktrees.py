@@ -0,0 +1,154 @@
+"""
+Git worktrees as isolated, cheaply reset session checkouts.
+
+A `Worktree` is a linked working tree of a repository: it shares the
+repository's object store, so creating one only checks out files, and
+resetting one to another commit only rewrites the files that differ. A
+session edits its own worktree; snapshots are trees written to the shared
+object store (no commit, no branch), so taking one and rolling back to it
+costs an index update and a checkout of the changed files.
+
+Worktrees are kept under the repository's git directory, out of its working
+tree (and of searches over it).
+"""
+
+import os
+import shutil
+import threading
+from typing import List, Optional
+
+import pygit2 as git
+
+WORKTREES_DIR = "less-worktrees"
+BRANCH_PREFIX = "less/"
+
+_CHECKOUT = (
+    git.enums.CheckoutStrategy.FORCE | git.enums.CheckoutStrategy.REMOVE_UNTRACKED
+)
+_SIGNATURE = ("less", "less@localhost")
+
+# add_worktree writes to the shared repository's administrative files
+_create_lock = threading.Lock()
+
+
+def is_git_repo(path: str) -> bool:
+    return git.discover_repository(path) is not None
+
+
+class Worktree:
+    """
+    A detached checkout of a repository, with step snapshots.
+
+    `snapshots` starts with the tree of the commit the worktree was reset to;
+    `snapshot` appends the current files and `rollback` restores one.
+    """
+
+    def __init__(self, repo: git.Repository, name: str):
+        self.shared = repo
+        self.name = name
+        self.path = os.path.join(repo.path, WORKTREES_DIR, name)
+        self.repo = git.Repository(self.path)
+        self.base = self.repo.head.target
+        self.snapshots: List[git.Oid] = [self._tree_of(self.base)]
+
+    @property
+    def head(self) -> git.Oid:
+        return self.repo.head.target
+
+    def path_of(self, folder: str) -> str:
+        """Where a folder of the repository's working tree is in this worktree."""
+        relative = os.path.relpath(os.path.abspath(folder), self.shared.workdir)
+        return os.path.normpath(os.path.join(self.path, relative))
+
+    def _tree_of(self, commit_id: git.Oid) -> git.Oid:
+        return self.repo[commit_id].peel(git.Tree).id
+
+    def _checkout(self, tree_id: git.Oid):
+        tree = self.repo[tree_id]
+        self.repo.checkout_tree(tree, strategy=_CHECKOUT)
+        self.repo.index.read_tree(tree)
+        self.repo.index.write()
+
+    def reset(self, commit_id: Optional[git.Oid] = None):
+        """Checks out `commit_id` (the repository's HEAD) and forgets the snapshots."""
+        if commit_id is None:
+            commit_id = self.shared.head.target
+        self.repo.set_head(commit_id)
+        self.base = commit_id
+        self.snapshots = [self._tree_of(commit_id)]
+        self._checkout(self.snapshots[0])
+
+    def snapshot(self) -> git.Oid:
+        """Stores the files as they are on disk (ignored files excepted)."""
+        index = self.repo.index
+        index.add_all()
+        # Files deleted from disk (pygit2 has no update_all to drop them)
+        deleted = [
+            entry.path
+            for entry in index
+            if not os.path.lexists(os.path.join(self.path, entry.path))
+        ]
+        if deleted:
+            index.remove_all(deleted)
+        index.write()
+        tree_id = index.write_tree()
+        self.snapshots.append(tree_id)
+        return tree_id
+
+    def rollback(self, snapshot: Optional[git.Oid] = None):
+        """Restores `snapshot` (the latest one), dropping any taken after it."""
+        if snapshot is None:
+            snapshot = self.snapshots[-1]
+        del self.snapshots[self.snapshots.index(snapshot) + 1 :]
+        self._checkout(snapshot)
+
+    def commit(self, message: str) -> Optional[git.Oid]:
+        """
+        Commits the files on top of the base commit, or returns None if
+        nothing changed. HEAD stays detached; see `branch`.
+        """
+        tree_id = self.snapshot()
+        if tree_id == self.snapshots[0]:
+            return None
+        try:
+            signature = self.repo.default_signature
+        except KeyError:
+            signature = git.Signature(*_SIGNATURE)
+        commit_id = self.repo.create_commit(
+            None, signature, signature, message, tree_id, [self.head]
+        )
+        self.repo.set_head(commit_id)
+        return commit_id
+
+    def branch(self, name: str) -> str:
+        """Points a new branch of the repository at HEAD; returns its name."""
+        name = BRANCH_PREFIX + name
+        self.shared.branches.local.create(name, self.shared[self.head])
+        return name
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.name in self.shared.list_worktrees():
+            self.shared.lookup_worktree(self.name).prune(True)
+
+
+def open_worktree(repo_path: str, name: str) -> Worktree:
+    """
+    Opens the worktree `name` of the repository at `repo_path`, creating it
+    at the repository's HEAD if needed; reset it before use.
+    """
+    repo = git.Repository(git.discover_repository(repo_path))
+    path = os.path.join(repo.path, WORKTREES_DIR, name)
+    with _create_lock:
+        if name in repo.list_worktrees():
+            if os.path.isdir(path):
+                return Worktree(repo, name)
+            # Its checkout was deleted
+            repo.lookup_worktree(name).prune(True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        repo.add_worktree(name, path)
+        worktree = Worktree(repo, name)
+        # Detach from the branch add_worktree creates, then delete it
+        worktree.repo.set_head(worktree.base)
+        repo.branches.local.delete(name)
+        return worktree
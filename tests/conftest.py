@@ -0,0 +1,36 @@
+import pytest
+
+from src.common.definitions import ProjectContext
+from src.planning.state import initial_state
+
+
+@pytest.fixture
+def make_state():
+    """Builds a run's initial state, as the agent does."""
+
+    def make(goal="goal", folder=".", plan=()):
+        context = ProjectContext(folder_path=str(folder), eval_project_id="test")
+        state = initial_state(goal, context)
+        state["plan"] = list(plan)
+        return state
+
+    return make
+
+
+@pytest.fixture
+def fresh_feedback_provider():
+    """
+    The feedback functions' provider, made anew before and after the test:
+    trulens keeps one OpenAI endpoint, holding a client of the first URL.
+    """
+    from trulens_eval.utils.python import SingletonPerName
+
+    from src.evaluation import feedback_functions
+
+    def reset():
+        SingletonPerName.delete_singleton_by_name("openai")
+        feedback_functions.get_feedback_provider.cache_clear()
+
+    reset()
+    yield
+    reset()
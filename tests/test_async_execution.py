@@ -0,0 +1,124 @@
+import asyncio
+import re
+import threading
+import time
+
+import pytest
+from langchain_openai import ChatOpenAI
+
+from src.actions.basic_actions import create_logging_action
+from src.agent import RefactoringAgent
+from src.common.definitions import ProjectContext
+from src.execution import LLMController
+from src.llm.fake_server import FakeOpenAIServer
+from src.planning.planner import Thinker
+from src.planning.state import ActionRecord, ActionRequest
+
+LATENCY = 0.3
+
+
+def last_message(body):
+    return body["messages"][-1]
+
+
+def respond(body, feedbacks: threading.Event):
+    if "tools" in body:
+        if last_message(body)["role"] == "tool":
+            return "Done"
+        goal = re.search(r"goal-\d+", last_message(body)["content"])
+        message = goal.group() if goal else "started"
+        return {"tool_calls": [{"name": "print_message", "args": {"message": message}}]}
+    content = last_message(body)["content"]
+    if "Decide whether to think & execute again" in content:
+        return "false"
+    if "NEXT_THOUGHT" in content:
+        feedbacks.wait(10)
+        return "0.5"
+    return "check usages; rename"
+
+
+@pytest.fixture
+def feedbacks():
+    """Set when the feedback functions' LLM calls may be answered."""
+    released = threading.Event()
+    released.set()
+    yield released
+    released.set()
+
+
+@pytest.fixture
+def trulens(tmp_path):
+    """trulens, with its database in `tmp_path` rather than the working directory."""
+    from trulens_eval import Tru
+
+    tru = Tru(database_file=str(tmp_path / "trulens.sqlite"))
+    yield tru
+    tru.delete_singleton()
+
+
+@pytest.fixture
+def server(monkeypatch, feedbacks, fresh_feedback_provider):
+    responder = lambda body: respond(body, feedbacks)
+    with FakeOpenAIServer(responder, latency=LATENCY) as server:
+        # The feedback functions talk to OpenAI through trulens' provider
+        monkeypatch.setenv("OPENAI_API_KEY", "fake")
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        yield server
+
+
+def make_llm(server):
+    return ChatOpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+
+
+def test_concurrent_runs_are_isolated(server, make_state):
+    controller = LLMController(
+        [create_logging_action()], "Log the goal", verbose=False, llm=make_llm(server)
+    )
+    states = [make_state(f"goal-{i}") for i in range(4)]
+
+    async def main():
+        return await asyncio.gather(*(controller.arun(s) for s in states))
+
+    results = asyncio.run(main())
+
+    # Two round trips each (tool call, then "Done"), overlapping across runs
+    assert len(server.requests) == 8
+    assert server.max_in_flight == 4
+    for i, (state, output) in enumerate(results):
+        assert output == "Done"
+        assert state["console"] == [f"goal-{i}"]
+        assert [r["request"]["id"] for r in state["history"]] == ["print_message"]
+
+
+def test_think_step_does_not_wait_for_feedbacks(
+    server, feedbacks, trulens, make_state
+):
+    thinker = Thinker([create_logging_action()], llm=make_llm(server), evaluate=True)
+    thinker.controller.verbose = False
+    state = make_state("rename things")
+    request = ActionRequest(id="print_message", args={"message": "hi"})
+    state["history"].append(ActionRecord(request=request, result="Logged 'hi'"))
+    state["thoughts"].append("look around")
+
+    feedbacks.clear()
+    asyncio.run(thinker.acall(state))
+
+    assert state["thoughts"][-1] == "check usages; rename"
+    # Only the thought was waited for; the two LLM scored feedbacks run after
+    assert server.answered == 1
+    feedbacks.set()
+    deadline = time.monotonic() + 10
+    while server.answered < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(server.requests) == 3
+    assert server.max_in_flight == 2
+
+
+def test_agent_runs_the_graph_asynchronously(server, tmp_path):
+    agent = RefactoringAgent(llm=make_llm(server))
+    context = ProjectContext(folder_path=str(tmp_path), eval_project_id="test")
+
+    result = asyncio.run(agent.arun("tidy up", context))
+
+    assert result["thoughts"] == ["check usages; rename"]
+    assert result["feedback"] == []
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+from langchain_core.outputs import Generation
+
+from benchmarks import agent_run_bench
+from benchmarks.fixtures import TARGET_FILE, make_fixture_repo
+from src.actions.basic_actions import create_logging_action
+from src.agent import MODES, RefactoringAgent
+from src.execution import LLMController
+from src.llm.cache import use_llm_cache
+from src.llm.cassette import (
+    Cassette,
+    CassetteChatModel,
+    CassetteMiss,
+    RecordingChatModel,
+)
+from src.llm.fake import ScriptedChatModel
+
+
+def test_recorded_calls_replay_without_the_model(tmp_path, make_state):
+    path = str(tmp_path / "cassette.json")
+    recorder = Cassette(path, mode="record")
+    inner = ScriptedChatModel(
+        responses=[
+            {"tool_calls": [{"name": "print_message", "args": {"message": "hi"}}]},
+            "Done",
+        ]
+    )
+    llm = RecordingChatModel(inner=inner, cassette=recorder)
+    LLMController([create_logging_action()], "Log", verbose=False, llm=llm).run(
+        make_state("goal")
+    )
+    recorder.save()
+
+    cassette = Cassette(path)
+    llm = CassetteChatModel(cassette=cassette)
+    controller = LLMController([create_logging_action()], "Log", verbose=False, llm=llm)
+    state, output = controller.run(make_state("goal"))
+    assert output == "Done"
+    assert state["console"] == ["hi"]
+    assert len(cassette.interactions) == 2
+
+    with pytest.raises(CassetteMiss):
+        llm.invoke("never recorded")
+
+
+def test_feedback_questions_fall_back_to_the_same_model(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    recorder = Cassette(path, mode="record")
+    assert recorder.lookup("question one", "feedback") is None
+    recorder.update("question one", "feedback", [Generation(text="0.25")])
+    recorder.save()
+
+    cassette = Cassette(path)
+    assert cassette.lookup("question one", "feedback")[0].text == "0.25"
+    assert cassette.lookup("question two", "feedback")[0].text == "0.25"
+    with pytest.raises(CassetteMiss):
+        cassette.lookup("question one", "another model")
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_benchmark_cassette_replays_the_agent(tmp_path, monkeypatch, mode):
+    monkeypatch.setenv("LESS_CACHE_DIR", str(tmp_path / "cache"))
+    repo = make_fixture_repo(str(tmp_path / "repo"), 10)
+    cassette = Cassette(agent_run_bench.CASSETTES[mode])
+    use_llm_cache(cassette)
+    try:
+        agent = RefactoringAgent(llm=CassetteChatModel(cassette=cassette), mode=mode)
+        result = agent_run_bench.run_once(agent, repo)
+    finally:
+        use_llm_cache(None)
+
+    assert result["feedback"] == []
+    with open(os.path.join(repo, TARGET_FILE.lstrip("/"))) as file:
+        assert agent_run_bench.RENAMED_SOURCE in file.read()
@@ -0,0 +1,133 @@
+import pickle
+
+import pytest
+from langchain_core.messages import ToolMessage
+
+from src.actions.code_search import SearchInput
+from src.agent import RefactoringAgent
+from src.common.definitions import CodeSpan, FailureReason, ProjectContext
+from src.llm.fake import ScriptedChatModel
+from src.planning.state import FeedbackMessage
+from src.utilities.checkpoints import CheckpointStore, StateSerializer
+from src.utilities.span_index import CodeBlockStore
+
+
+class Crash(Exception):
+    pass
+
+
+class Script:
+    """
+    Two think/execute steps, each inserting a line. Step `crash_at` crashes
+    in its thought, or deciding whether to go on (after its edit) if
+    `after_edit`.
+    """
+
+    def __init__(self, crash_at=None, after_edit=False):
+        self.crash_at = crash_at
+        self.after_edit = after_edit
+        self.thoughts = 0
+        self.prompts = []
+
+    def respond(self, messages):
+        content = messages[-1].content
+        self.prompts.append(content)
+        if isinstance(messages[-1], ToolMessage):
+            return "Done"
+        if "Decide whether to think & execute again" in content:
+            if self.after_edit and self.thoughts == self.crash_at:
+                raise Crash()
+            return "true" if self.thoughts < 2 else "false"
+        if "Select the next actions to execute" in content:
+            edit = {
+                "file": "module.py",
+                "start_line": 1,
+                "end_line": 1,
+                "replacement_code": f"step = {self.thoughts}",
+                "change_summary": "step",
+            }
+            return {"tool_calls": [{"name": "edit_code", "args": edit}]}
+        if "Log any results" in content:
+            return {
+                "tool_calls": [{"name": "print_message", "args": {"message": "ok"}}]
+            }
+        self.thoughts += 1
+        if self.thoughts == self.crash_at and not self.after_edit:
+            raise Crash()
+        return f"thought {self.thoughts}"
+
+
+def make_agent(script, store):
+    llm = ScriptedChatModel(responder=script.respond)
+    return RefactoringAgent(llm=llm, checkpointer=store)
+
+
+def make_run(tmp_path, flush_policy):
+    (tmp_path / "module.py").write_text("step = 0\n")
+    context = ProjectContext(
+        folder_path=str(tmp_path), eval_project_id="test", flush_policy=flush_policy
+    )
+    return context, CheckpointStore(str(tmp_path / "checkpoints.sqlite"))
+
+
+def resume(store, run_id, thoughts):
+    resumed = Script()
+    resumed.thoughts = thoughts
+    state = make_agent(resumed, CheckpointStore(store.path)).resume(run_id)
+    return resumed, state
+
+
+def test_resume_continues_after_the_last_step(tmp_path):
+    context, store = make_run(tmp_path, "run")
+    with pytest.raises(Crash):
+        make_agent(Script(crash_at=2), store).run("goal", context, run_id="run-1")
+    # The first step was saved with its edit, which the policy keeps in memory
+    saved = store.latest("run-1")["channel_values"]
+    assert saved["thoughts"] == ["thought 1"]
+    assert saved["history"][0]["request"]["args"].replacement_code == "step = 1"
+    assert (tmp_path / "module.py").read_text() == "step = 0\n"
+    path = str(tmp_path / "module.py")
+    assert saved["unflushed"] == {path: "step = 1\nstep = 0\n"}
+
+    resumed, state = resume(store, "run-1", thoughts=1)
+    assert state["thoughts"] == ["thought 1", "thought 2"]
+    requests = [record["request"]["id"] for record in state["history"]]
+    assert requests == ["edit_code", "edit_code", "print_message"]
+    assert state["console"] == ["ok"]
+    assert (tmp_path / "module.py").read_text() == "step = 2\nstep = 1\nstep = 0\n"
+    # The first step was not asked for again
+    assert sum("Select the next actions" in p for p in resumed.prompts) == 1
+
+    with pytest.raises(KeyError):
+        make_agent(Script(), store).resume("missing")
+
+
+def test_a_failed_step_leaves_the_files_of_the_last_checkpoint(tmp_path):
+    context, store = make_run(tmp_path, "action")
+    crashing = Script(crash_at=2, after_edit=True)
+    with pytest.raises(Crash):
+        make_agent(crashing, store).run("goal", context, run_id="run-1")
+    # The second step's edit was made, but is neither saved nor written out
+    assert store.latest("run-1")["channel_values"]["unflushed"] == {}
+    assert (tmp_path / "module.py").read_text() == "step = 1\nstep = 0\n"
+
+    # Resumed from the second thought
+    _, state = resume(store, "run-1", thoughts=2)
+    assert len(state["history"]) == 3
+    assert (tmp_path / "module.py").read_text() == "step = 2\nstep = 1\nstep = 0\n"
+
+
+def test_state_round_trips():
+    blocks = CodeBlockStore([CodeSpan("a.py", 1, 3), CodeSpan("a.py", 10, 12)])
+    request = {"id": "code_search", "args": SearchInput(query="rename")}
+    feedback = FeedbackMessage(FailureReason.ACTION_FAILED, "failed", request)
+    serde = StateSerializer()
+
+    copy = serde.loads(serde.dumps({"code_blocks": blocks, "feedback": [feedback]}))
+    assert copy["code_blocks"].blocks() == blocks.blocks()
+    copy["code_blocks"].append(CodeSpan("a.py", 4, 5))
+    assert [s.end_line for s in copy["code_blocks"]] == [5, 12]
+    (message,) = copy["feedback"]
+    assert (message.reason, message.message) == (feedback.reason, "failed")
+    assert message.request["args"] == request["args"]
+    assert pickle.loads(pickle.dumps(feedback)).request == feedback.request
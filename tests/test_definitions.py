@@ -0,0 +1,35 @@
+from langchain_core.utils.function_calling import convert_to_openai_function
+
+from src.actions.code_search import GotoDefinitionInput
+from src.common.definitions import CodeChange, CodeSpan, Symbol
+from src.planning.state import record_to_str
+
+
+def test_records_are_slotted_and_share_paths():
+    path = "".join(["/pkg/", "module.py"])
+    span = CodeSpan(file_path=path, start_line=1, end_line=3)
+    other = CodeSpan("/pkg/module.py", 5, 8)
+    assert not hasattr(span, "__dict__")
+    assert span.file_path is other.file_path
+    assert span == CodeSpan("/pkg/module.py", 1, 3)
+    change = CodeChange("".join(["/pkg/", "module.py"]), 1, 2, "")
+    assert change.file is span.file_path
+
+
+def test_records_render_their_fields_in_the_history():
+    symbol = Symbol("f", "a.py", 3, 0)
+    assert str(symbol) == "name='f' file_path='a.py' line=3 column=0"
+    record = {"request": {"id": "code_goto_definition", "args": {}}, "result": symbol}
+    assert "Symbol(name='f' file_path='a.py' line=3 column=0)" in record_to_str(record)
+
+
+def test_tool_arguments_are_validated_and_converted():
+    args = GotoDefinitionInput.parse_obj(
+        {"symbol": {"name": "f", "file_path": "a.py", "line": "3", "column": 0}}
+    )
+    assert args.symbol.to_symbol() == Symbol("f", "a.py", 3, 0)
+    # The LLM sees the schema the pydantic Symbol had
+    function = convert_to_openai_function(GotoDefinitionInput)
+    [symbol] = function["parameters"]["properties"]["symbol"]["allOf"]
+    assert symbol["title"] == "Symbol"
+    assert symbol["required"] == ["name", "file_path", "line", "column"]
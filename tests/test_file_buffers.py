@@ -0,0 +1,85 @@
+import os
+import time
+
+from src.common.definitions import CodeChange, CodeSpan, ProjectContext
+from src.utilities.file_buffers import BufferCache, FlushPolicy, get_buffer_cache
+from src.utilities.span_index import SpanIndex
+
+
+def write(path, code):
+    with open(path, "w") as file:
+        file.write(code)
+
+
+def read(path):
+    with open(path) as file:
+        return file.read()
+
+
+def test_spans_are_served_from_memory(tmp_path):
+    write(os.path.join(tmp_path, "a.py"), "a\nb\nc\n")
+    cache = BufferCache(str(tmp_path))
+    assert cache.read_span("a.py", 2, 3) == "b\nc\n"
+    assert cache.read_span("/a.py", 1, 1) == "a\n"
+    assert cache.bytes_read == 6
+
+
+def test_changes_flush_according_to_policy(tmp_path):
+    path = os.path.join(tmp_path, "a.py")
+    write(path, "a\nb\nc\n")
+    cache = BufferCache(str(tmp_path), FlushPolicy.STEP)
+    cache.apply_change(
+        CodeChange(file="a.py", start_line=2, end_line=3, replacement_code="B1\nB2")
+    )
+    assert cache.read_span("a.py", 1, 4) == "a\nB1\nB2\nc\n"
+    assert cache.dirty_text("a.py") == "a\nB1\nB2\nc\n"
+
+    cache.flush_point(FlushPolicy.ACTION)
+    assert read(path) == "a\nb\nc\n"
+    cache.flush_point(FlushPolicy.STEP)
+    assert read(path) == "a\nB1\nB2\nc\n"
+    assert cache.dirty_text("a.py") is None
+
+
+def test_external_changes_are_detected(tmp_path):
+    path = os.path.join(tmp_path, "a.py")
+    write(path, "a\n")
+    cache = BufferCache(str(tmp_path))
+    version = cache.version("a.py")
+    write(path, "changed\n")
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert cache.read_span("a.py", 1, 1) == "changed\n"
+    assert cache.version("a.py") != version
+
+
+def test_callers_flush_by_their_own_policy(tmp_path):
+    path = os.path.join(tmp_path, "a.py")
+    write(path, "a\n")
+    run = ProjectContext(
+        folder_path=str(tmp_path), eval_project_id="test", flush_policy="run"
+    )
+    cache = get_buffer_cache(run)
+    step = ProjectContext(
+        folder_path=str(tmp_path), eval_project_id="test", flush_policy="step"
+    )
+    assert get_buffer_cache(step) is cache
+    assert cache.flush_policy == FlushPolicy.RUN
+
+    cache.apply_change(
+        CodeChange(file="a.py", start_line=1, end_line=2, replacement_code="b")
+    )
+    cache.flush_point(FlushPolicy.STEP, run.flush_policy)
+    assert read(path) == "a\n"
+    cache.flush_point(FlushPolicy.STEP, step.flush_policy)
+    assert read(path) == "b\n"
+
+
+def test_spans_follow_a_deletion_in_the_buffer(tmp_path):
+    write(os.path.join(tmp_path, "a.py"), "a\nb\nc\nd\n")
+    cache = BufferCache(str(tmp_path))
+    index = SpanIndex([CodeSpan("a.py", 4, 4)])
+    deletion = CodeChange(file="a.py", start_line=2, end_line=4, replacement_code="")
+    cache.apply_change(deletion)
+    index.apply_change(deletion)
+    (span,) = index
+    assert cache.read_span("a.py", span.start_line, span.end_line) == "d\n"
@@ -0,0 +1,75 @@
+from src.agent import FUSED, RefactoringAgent
+from src.common.definitions import FailureReason, ProjectContext
+from src.llm.fake import ScriptedChatModel
+
+
+def step(thought, action=None, args=None, should_continue=True):
+    args = {
+        "thought": thought,
+        "action": action,
+        "args": args or {},
+        "should_continue": should_continue,
+    }
+    return {"tool_calls": [{"name": "step", "args": args}]}
+
+
+EDIT = {
+    "file": "module.py",
+    "start_line": 1,
+    "end_line": 2,
+    "replacement_code": "renamed = 1",
+    "change_summary": "rename",
+}
+
+
+def run(tmp_path, steps):
+    (tmp_path / "module.py").write_text("x = 1\n")
+    prompts = []
+
+    def respond(messages):
+        content = messages[-1].content
+        if "Log any results" in content:
+            return {
+                "tool_calls": [{"name": "print_message", "args": {"message": "ok"}}]
+            }
+        if messages[-1].type == "tool":
+            return "Done"
+        prompts.append(content)
+        return steps[len(prompts) - 1]
+
+    context = ProjectContext(folder_path=str(tmp_path), eval_project_id="test")
+    agent = RefactoringAgent(llm=ScriptedChatModel(responder=respond), mode=FUSED)
+    return agent.run("goal", context), prompts
+
+
+def test_one_call_thinks_executes_and_decides(tmp_path):
+    state, prompts = run(
+        tmp_path,
+        [
+            step("look around", "no_such_action"),
+            step("rename x", "edit_code", EDIT, should_continue=False),
+        ],
+    )
+
+    # One LLM call per step, then the finish node's
+    assert len(prompts) == 2
+    assert state["thoughts"] == ["look around", "rename x"]
+    assert [f.reason for f in state["feedback"]] == [FailureReason.ACTION_NOT_FOUND]
+    requests = [record["request"] for record in state["history"]]
+    assert [r["id"] for r in requests] == ["edit_code", "print_message"]
+    assert requests[0]["args"].replacement_code == "renamed = 1"
+    assert (tmp_path / "module.py").read_text() == "renamed = 1\n"
+    assert state["next_node"] == "finish"
+    # The next step sees what the first one did
+    assert "Action no_such_action not found" in prompts[1]
+
+
+def test_unparsed_step_is_asked_again(tmp_path):
+    state, prompts = run(
+        tmp_path,
+        ["no function call", step("nothing to do", should_continue=False)],
+    )
+
+    assert len(prompts) == 2
+    assert state["thoughts"] == ["nothing to do"]
+    assert state["console"] == ["ok"]
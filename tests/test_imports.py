@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+from benchmarks.import_time_bench import ROOT, loaded_heavy_modules
+
+
+def test_cli_help_loads_no_agent_dependencies(tmp_path):
+    assert loaded_heavy_modules("cli") == []
+    completed = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "cli.py"), "--help"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+    assert completed.returncode == 0 and "init-repo" in completed.stdout
+    # Nothing opened the trulens database
+    assert os.listdir(tmp_path) == []
+
+
+def test_evaluation_is_imported_only_when_enabled():
+    assert "trulens_eval" not in loaded_heavy_modules("src.agent")
+    assert "trulens_eval" in loaded_heavy_modules("src.evaluation.feedback_functions")
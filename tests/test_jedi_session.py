@@ -0,0 +1,57 @@
+import os
+import time
+
+from src.utilities.jedi_session import JediSession
+
+
+def write(path, code):
+    with open(path, "w") as file:
+        file.write(code)
+
+
+def test_script_is_reused_until_file_changes(tmp_path):
+    path = os.path.join(tmp_path, "module.py")
+    write(path, "def foo():\n    return 1\n")
+    session = JediSession(str(tmp_path))
+
+    first = session.script(path)
+    assert session.script(path) is first
+    assert session.hits == 1
+
+    write(path, "def bar():\n    return 2\n")
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert session.script(path) is not first
+    assert session.misses == 2
+
+
+def test_touch_without_content_change_keeps_script(tmp_path):
+    path = os.path.join(tmp_path, "module.py")
+    write(path, "x = 1\n")
+    session = JediSession(str(tmp_path))
+    first = session.script(path)
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert session.script(path) is first
+
+
+def test_lru_eviction_under_memory_cap(tmp_path):
+    paths = []
+    for i in range(3):
+        path = os.path.join(tmp_path, f"m{i}.py")
+        write(path, "x = 1\n" * 10)
+        paths.append(path)
+    session = JediSession(str(tmp_path), memory_cap=1)
+    for path in paths:
+        session.script(path)
+    assert session.estimated_memory > 0
+    assert len(session._scripts) == 1
+    assert os.path.abspath(paths[-1]) in session._scripts
+
+
+def test_complete_search_and_goto(tmp_path):
+    path = os.path.join(tmp_path, "module.py")
+    write(path, "def lowest_cost():\n    return 1\n\n\nlowest_cost()\n")
+    session = JediSession(str(tmp_path))
+    names = session.complete_search("lowest", path)
+    assert [n.name for n in names] == ["lowest_cost"]
+    (definition,) = session.goto(path, 5, 0)
+    assert definition.line == 1
@@ -0,0 +1,42 @@
+import os
+
+from src.common.definitions import ProjectContext
+from src.utilities.jedi_session import get_jedi_session
+from src.utilities.jedi_utils import (
+    completions_to_definitions,
+    jedi_name_to_symbol,
+    symbol_to_definition,
+)
+
+MODULE = """import os
+
+
+class Getter:
+    def get_value(self):
+        return 1
+
+
+def get_all():
+    return 2
+
+
+get_var = 3
+"""
+
+
+def test_batched_definitions_match_goto(tmp_path):
+    with open(os.path.join(tmp_path, "module.py"), "w") as file:
+        file.write(MODULE)
+    context = ProjectContext(folder_path=str(tmp_path), eval_project_id="test")
+    completions = get_jedi_session(str(tmp_path)).complete_search("get")
+
+    batched = completions_to_definitions(completions, context)
+    with_goto = [
+        symbol_to_definition(jedi_name_to_symbol(c, context), context)
+        for c in completions
+        if c.get_definition_start_position() is not None
+    ]
+
+    key = lambda d: (d.symbol.name, d.span.start_line, d.span.end_line)
+    assert sorted(map(key, batched)) == sorted(map(key, with_goto))
+    assert ("get_all", 9, 10) in map(key, batched)
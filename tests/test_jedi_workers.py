@@ -0,0 +1,54 @@
+import os
+import pickle
+
+import pytest
+
+from src.common.definitions import ProjectContext
+from src.utilities.jedi_utils import completions_to_definitions
+from src.utilities.jedi_workers import JediWorkers
+
+MODULE = """def lowest_cost():
+    return 1
+
+
+lowest_cost()
+"""
+
+
+@pytest.fixture(params=[0, 2], ids=["in-process", "processes"])
+def workers(request):
+    workers = JediWorkers(request.param)
+    yield workers
+    workers.shutdown()
+
+
+def test_search_and_goto(tmp_path, workers):
+    path = os.path.join(tmp_path, "module.py")
+    with open(path, "w") as file:
+        file.write(MODULE)
+    folder = str(tmp_path)
+
+    names = workers.complete_search(folder, "lowest", path).result()
+    assert [(n.name, n.line) for n in names] == [("lowest_cost", 1)]
+    assert pickle.loads(pickle.dumps(names)) == names
+    context = ProjectContext(folder_path=folder, eval_project_id="test")
+    [definition] = completions_to_definitions(names, context)
+    assert (definition.span.start_line, definition.span.end_line) == (1, 2)
+
+    # Unsaved code is searched instead of the file on disk
+    code = "\n\n" + MODULE
+    (name,) = workers.goto(folder, path, 7, 0, code).result()
+    assert name.line == 3
+
+    names = workers.complete_search(folder, "lowest").result()
+    assert "lowest_cost" in [n.name for n in names]
+
+
+def test_requests_for_a_file_go_to_one_worker(tmp_path):
+    workers = JediWorkers(3)
+    try:
+        paths = [os.path.join(tmp_path, f"m{i}.py") for i in range(6)]
+        assert all(workers._pool(p) is workers._pool(p) for p in paths)
+        assert len({id(workers._pool(p)) for p in paths}) > 1
+    finally:
+        workers.shutdown()
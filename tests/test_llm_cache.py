@@ -0,0 +1,143 @@
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from src.actions.basic_actions import create_logging_action, create_no_op_action
+from src.evaluation import feedback_functions
+from src.execution import LLMController
+from src.llm import cache as cache_module
+from src.llm.cache import (
+    LRUResponseCache,
+    ResponseCache,
+    SQLiteResponseCache,
+    use_llm_cache,
+)
+from src.llm.fake import ScriptedChatModel
+from src.llm.fake_server import FakeOpenAIServer
+from src.planning.planner import ShouldContinue
+
+
+@pytest.fixture
+def llm_cache():
+    cache = LRUResponseCache()
+    use_llm_cache(cache)
+    yield cache
+    use_llm_cache(None)
+
+
+def generation(text):
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUResponseCache(maxsize=2)
+    cache.update("a", "llm", generation("A"))
+    cache.update("b", "llm", generation("B"))
+    cache.lookup("a", "llm")
+    cache.update("c", "llm", generation("C"))
+
+    assert cache.lookup("b", "llm") is None
+    assert cache.lookup("a", "llm")[0].text == "A"
+    assert cache.lookup("a", "other llm") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_entries_expire(monkeypatch):
+    cache = LRUResponseCache(ttl=10)
+    monkeypatch.setattr(cache_module.time, "time", lambda: 1000.0)
+    cache.update("a", "llm", generation("A"))
+    monkeypatch.setattr(cache_module.time, "time", lambda: 1005.0)
+    assert cache.lookup("a", "llm") is not None
+    monkeypatch.setattr(cache_module.time, "time", lambda: 1011.0)
+    assert cache.lookup("a", "llm") is None
+
+
+def test_incomplete_caches_cannot_be_created():
+    class NoDelete(ResponseCache):
+        def _get(self, key):
+            return None
+
+        def _set(self, key, created, value):
+            pass
+
+        def clear(self, **kwargs):
+            pass
+
+    with pytest.raises(TypeError, match="_delete"):
+        NoDelete()
+
+
+def test_sqlite_persists_across_instances(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    first = SQLiteResponseCache(path)
+    first.update("prompt", "llm", generation("cached"))
+    first.close()
+
+    second = SQLiteResponseCache(path)
+    [hit] = second.lookup("prompt", "llm")
+    assert hit.message.content == "cached"
+    second.clear()
+    assert second.lookup("prompt", "llm") is None
+
+
+def test_controller_calls_are_keyed_on_prompt_and_tools(llm_cache, make_state):
+    llm = ScriptedChatModel(responses=["a thought"])
+    controller = LLMController([], "Think", verbose=False, llm=llm)
+    state = make_state("goal")
+
+    assert controller.run(state)[1] == "a thought"
+    assert controller.run(state)[1] == "a thought"
+    assert llm.calls == 1
+    controller.run(make_state("another goal"))
+    assert llm.calls == 2
+
+    # Same state, but the tools offered differ
+    llm = ScriptedChatModel(
+        responses=[
+            {"tool_calls": [{"name": "print_message", "args": {"message": "hi"}}]},
+            "Done",
+        ]
+    )
+    logging = LLMController([create_logging_action()], "Act", verbose=False, llm=llm)
+    both = LLMController(
+        [create_logging_action(), create_no_op_action("wait", "Waits")],
+        "Act",
+        verbose=False,
+        llm=llm,
+    )
+    logging.run(make_state("goal"))
+    assert llm.calls == 2
+    logging.run(make_state("goal"))
+    assert llm.calls == 2
+    both.run(make_state("goal"))
+    assert llm.calls == 4
+
+
+def test_should_continue_retries_bypass_the_cache(llm_cache, make_state):
+    llm = ScriptedChatModel(responses=["maybe", "false"])
+    should_continue = ShouldContinue(llm=llm)
+    should_continue.controller.verbose = False
+
+    assert should_continue(make_state("goal")) == "finish"
+    assert llm_cache.stats()["misses"] == 1
+
+
+def test_feedback_questions_are_cached_and_their_cost_tracked(llm_cache, monkeypatch):
+    from trulens_eval.feedback.provider.endpoint.base import Endpoint
+
+    asked = []
+
+    def respond(body):
+        asked.append(body["messages"])
+        return "0.5"
+
+    messages = [{"role": "user", "content": "How good?"}]
+    with FakeOpenAIServer(respond) as server:
+        monkeypatch.setenv("OPENAI_API_KEY", "fake")
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        ask = lambda: feedback_functions.ask_feedback_model(messages)
+        answer, cost = Endpoint.track_all_costs_tally(ask)
+        assert (answer, cost.n_requests) == ("0.5", 1)
+        answer, cost = Endpoint.track_all_costs_tally(ask)
+        assert (answer, cost.n_requests) == ("0.5", 0)
+    assert len(asked) == 1
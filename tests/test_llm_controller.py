@@ -0,0 +1,39 @@
+from src.actions.basic_actions import create_logging_action
+from src.execution import LLMController
+from src.llm.cache import LRUResponseCache, use_llm_cache
+from src.llm.fake import ScriptedChatModel
+
+
+def test_executor_is_reused_and_bound_to_each_state(make_state):
+    llm = ScriptedChatModel(
+        responses=[
+            {"tool_calls": [{"name": "print_message", "args": {"message": "hi"}}]},
+            "Done",
+        ]
+    )
+    controller = LLMController([create_logging_action()], "Log", verbose=False, llm=llm)
+    first, second = make_state("first"), make_state("second")
+
+    controller.run(first)
+    executor = controller.get_agent_executor()
+    controller.run(second)
+
+    assert controller.get_agent_executor() is executor
+    assert first["console"] == ["hi"] and second["console"] == ["hi"]
+    assert [r["request"]["id"] for r in second["history"]] == ["print_message"]
+    assert first["feedback"] == [] and second["feedback"] == []
+
+
+def test_executor_follows_the_installed_llm_cache():
+    controller = LLMController(
+        [create_logging_action()], "Log", verbose=False, llm=ScriptedChatModel()
+    )
+    streaming = controller.get_agent_executor()
+    use_llm_cache(LRUResponseCache())
+    try:
+        cached = controller.get_agent_executor()
+        assert cached is not streaming
+        assert controller.get_agent_executor() is cached
+    finally:
+        use_llm_cache(None)
+    assert controller.get_agent_executor() is not cached
@@ -0,0 +1,146 @@
+import threading
+import time
+from typing import Optional
+
+from langchain_core.pydantic_v1 import BaseModel
+
+from src.actions.action import Action, Effects
+from src.common.definitions import CodeSpan
+from src.execution import ExecutePlan, _apply_view, _deferred_view
+from src.planning.state import ActionRequest
+
+
+class FileArgs(BaseModel):
+    file: Optional[str]
+    label: str
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.finished = []
+
+    def action(self, id, effects, delay=0.2, fail=False):
+        def f(state, args: FileArgs):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(delay)
+            with self.lock:
+                self.running -= 1
+                self.finished.append(args.label)
+            if fail:
+                raise ValueError(f"{args.label} failed")
+            return args.label
+
+        return Action(id, id, FileArgs, f, effects=effects)
+
+
+def request(id, file, label):
+    return ActionRequest(id=id, args=FileArgs(file=file, label=label))
+
+
+def test_independent_searches_run_concurrently(make_state):
+    recorder = Recorder()
+    search = recorder.action("search", lambda args: Effects.reading(args.file))
+    plan = [request("search", f"/{i}.py", f"s{i}") for i in range(4)]
+    state = make_state(plan=plan)
+
+    start = time.perf_counter()
+    ExecutePlan([search])(state)
+    assert time.perf_counter() - start < 0.6
+    assert recorder.max_running == 4
+    assert [r["result"] for r in state["history"]] == ["s0", "s1", "s2", "s3"]
+    assert state["plan"] == []
+
+
+def test_edits_to_a_file_run_in_plan_order(make_state):
+    recorder = Recorder()
+    search = recorder.action("search", lambda args: Effects.reading(args.file))
+    edit = recorder.action("edit", lambda args: Effects.writing(args.file), 0.05)
+    plan = [
+        request("edit", "/a.py", "edit a 1"),
+        request("search", "a.py", "read a"),
+        request("edit", "/b.py", "edit b"),
+        request("edit", "a.py", "edit a 2"),
+        request("search", None, "read all"),
+    ]
+    state = make_state(plan=plan)
+    ExecutePlan([search, edit])(state)
+
+    finished = recorder.finished
+    assert finished.index("edit a 1") < finished.index("read a")
+    assert finished.index("read a") < finished.index("edit a 2")
+    # Reading the whole project waits for every earlier edit
+    assert finished[-1] == "read all"
+    assert recorder.max_running == 2
+    assert [r["result"] for r in state["history"]] == [r["args"].label for r in plan]
+
+
+def test_failures_become_feedback_and_undeclared_actions_run_alone(make_state):
+    recorder = Recorder()
+    search = recorder.action("search", lambda args: Effects.reading(args.file))
+    broken = recorder.action(
+        "broken", lambda args: Effects.reading(args.file), 0.05, fail=True
+    )
+    log = recorder.action("log", None, 0.05)
+    plan = [
+        request("search", "/a.py", "s1"),
+        request("broken", "/a.py", "b"),
+        request("log", "/a.py", "log"),
+        request("missing", "/a.py", "m"),
+        request("search", "/b.py", "s2"),
+    ]
+    state = make_state(plan=plan)
+    ExecutePlan([search, broken, log])(state)
+
+    assert recorder.finished.index("log") == 2
+    assert [r["result"] for r in state["history"]] == ["s1", "log", "s2"]
+    assert [f.request["id"] for f in state["feedback"]] == ["broken", "missing"]
+
+
+def test_concurrent_changes_to_the_state_apply_in_plan_order(make_state):
+    def search(state, args: FileArgs):
+        # Later entries finish first
+        time.sleep(0.05 * (4 - int(args.label)))
+        state["code_blocks"].append(CodeSpan(args.file, 1, 2))
+        state["console"].append(args.label)
+        return args.label
+
+    changes = ("code_blocks", "console")
+    action = Action(
+        "search",
+        "search",
+        FileArgs,
+        search,
+        effects=lambda a: Effects.reading(a.file, changes=changes),
+    )
+    plan = [request("search", f"/{i}.py", str(i)) for i in range(4)]
+    state = make_state(plan=plan)
+    ExecutePlan([action])(state)
+
+    assert [(i, s.file_path) for i, s, _ in state["code_blocks"].blocks()] == [
+        (1, "/0.py"),
+        (2, "/1.py"),
+        (3, "/2.py"),
+        (4, "/3.py"),
+    ]
+    assert state["console"] == ["0", "1", "2", "3"]
+
+
+def test_views_defer_only_declared_fields_and_read_a_copy(make_state):
+    state = make_state()
+    lock = threading.Lock()
+    effects = Effects(changes=frozenset({"console"}))
+    first = _deferred_view(state, effects, lock)
+    second = _deferred_view(state, effects, lock)
+    assert second["code_blocks"] is state["code_blocks"]
+
+    assert len(second["console"]) == 0
+    first["console"].append("first")
+    _apply_view(first)
+    assert state["console"] == ["first"]
+    # Read before the first view was applied
+    assert list(second["console"]) == []
@@ -0,0 +1,20 @@
+from src.llm import prompts
+
+
+def test_agent_prompt_loads_offline(tmp_path, monkeypatch):
+    monkeypatch.setenv("LESS_CACHE_DIR", str(tmp_path))
+    prompts.load_agent_prompt.cache_clear()
+    prompt = prompts.load_agent_prompt()
+    assert prompts.load_agent_prompt() is prompt
+    assert set(prompt.input_variables) == {"input", "agent_scratchpad"}
+    assert prompts.prompt_to_spec(prompt) == prompts.VENDORED_AGENT_PROMPT
+
+
+def test_cached_prompt_takes_precedence(tmp_path, monkeypatch):
+    monkeypatch.setenv("LESS_CACHE_DIR", str(tmp_path))
+    spec = [dict(m) for m in prompts.VENDORED_AGENT_PROMPT]
+    spec[0]["template"] = "You are a careful assistant"
+    prompts.store_prompt(prompts.AGENT_PROMPT_REF, spec)
+    prompts.load_agent_prompt.cache_clear()
+    assert prompts.prompt_to_spec(prompts.load_agent_prompt()) == spec
+    prompts.load_agent_prompt.cache_clear()
@@ -0,0 +1,222 @@
+import json
+import re
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pygit2 as git
+import pytest
+from langchain_core.messages import ToolMessage
+
+from src.llm.fake import ScriptedChatModel
+from src.server import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    AgentService,
+    serve,
+)
+
+
+def edit(goal):
+    return {
+        "file": "module.py",
+        "start_line": 1,
+        "end_line": 2,
+        "replacement_code": f"# {goal}",
+        "change_summary": "mark",
+    }
+
+
+class Gates:
+    """A fake LLM whose thought for `goal-x` waits until `goal-x` is opened."""
+
+    def __init__(self):
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def gate(self, goal):
+        with self.lock:
+            return self.events.setdefault(goal, threading.Event())
+
+    def open(self, *goals):
+        for goal in goals:
+            self.gate(goal).set()
+
+    def respond(self, messages):
+        content = messages[-1].content
+        if isinstance(messages[-1], ToolMessage):
+            return "Done"
+        goal = re.search(r"goal-\w+", content).group()
+        if goal == "goal-exit":
+            raise SystemExit(1)
+        if "Decide whether to think & execute again" in content:
+            return "false"
+        if "Select the next actions to execute" in content:
+            return {"tool_calls": [{"name": "edit_code", "args": edit(goal)}]}
+        if "Log any results" in content:
+            return {
+                "tool_calls": [{"name": "print_message", "args": {"message": goal}}]
+            }
+        self.gate(goal).wait(10)
+        return "check usages; rename"
+
+
+@pytest.fixture
+def gates():
+    gates = Gates()
+    yield gates
+    gates.open(*list(gates.events))
+
+
+def make_service(gates, **kwargs):
+    llm = ScriptedChatModel(responder=gates.respond)
+    return AgentService(llm=llm, eval_project_id="test", **kwargs)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_repos_run_concurrently_and_each_repo_in_order(gates, tmp_path):
+    repo_a, repo_b = tmp_path / "a", tmp_path / "b"
+    repo_a.mkdir(), repo_b.mkdir()
+    with make_service(gates, max_sessions=3) as service:
+        a1 = service.submit("goal-a1", str(repo_a))
+        a2 = service.submit("goal-a2", str(repo_a))
+        b1 = service.submit("goal-b1", str(repo_b))
+
+        wait_for(lambda: a1.status == b1.status == RUNNING)
+        # A free session does not take a job on a repo that is in use
+        time.sleep(0.1)
+        assert a2.status == QUEUED
+        assert service.health()["running"] == 2
+
+        gates.open("goal-a1", "goal-a2", "goal-b1")
+        for job in (a1, a2, b1):
+            assert job.wait(10)
+
+    assert [job.status for job in (a1, a2, b1)] == [DONE] * 3
+    assert a2.started >= a1.finished
+    assert b1.started < a1.finished
+    assert a1.result["console"] == ["goal-a1"]
+    assert a1.result["thoughts"] == ["check usages; rename"]
+
+
+def test_sessions_edit_one_repo_in_their_own_worktrees(gates, tmp_path):
+    repo = git.init_repository(str(tmp_path))
+    (tmp_path / "module.py").write_text("original\n")
+    repo.index.add_all()
+    signature = git.Signature("test", "test@localhost")
+    tree = repo.index.write_tree()
+    repo.create_commit("HEAD", signature, signature, "initial", tree, [])
+
+    with make_service(gates, max_sessions=2) as service:
+        jobs = [service.submit(f"goal-{i}", str(tmp_path)) for i in range(2)]
+        wait_for(lambda: all(job.status == RUNNING for job in jobs))
+        gates.open("goal-0", "goal-1")
+        assert all(job.wait(10) for job in jobs)
+        # The next job on a session starts from HEAD again
+        again = service.submit("goal-2", str(tmp_path))
+        gates.open("goal-2")
+        assert again.wait(10)
+
+    for i, job in enumerate(jobs + [again]):
+        assert job.status == DONE, job.error
+        assert job.result["branch"] == f"less/{job.id}"
+        commit = repo.branches.local[job.result["branch"]].peel(git.Commit)
+        assert str(commit.id) == job.result["commit"]
+        assert commit.tree["module.py"].data == f"# goal-{i}\n".encode()
+        assert commit.parents[0].id == repo.head.target
+    assert (tmp_path / "module.py").read_text() == "original\n"
+
+
+def request(base, method, path, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    req = urllib.request.Request(base + path, data=data, method=method)
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_http_api_backpressure_and_cancellation(gates, tmp_path):
+    repo = str(tmp_path)
+    with make_service(gates, max_sessions=1, max_queue=1) as service:
+        http = serve(service, port=0)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        base = "http://127.0.0.1:%d" % http.server_address[1]
+        try:
+            status, running = request(
+                base, "POST", "/jobs", {"goal": "goal-1", "repo": repo}
+            )
+            assert status == 202 and running["status"] == QUEUED
+            wait_for(lambda: service.jobs[running["id"]].status == RUNNING)
+
+            status, queued = request(
+                base, "POST", "/jobs", {"goal": "goal-2", "repo": repo}
+            )
+            assert status == 202
+            status, _ = request(base, "POST", "/jobs", {"goal": "goal-3", "repo": repo})
+            assert status == 429
+            assert request(base, "POST", "/jobs", {"goal": "goal-4"})[0] == 400
+            assert request(base, "GET", "/health")[1]["queued"] == 1
+
+            # A queued job is dropped; a running one stops at its next step
+            status, cancelled = request(base, "DELETE", f"/jobs/{queued['id']}")
+            assert status == 200 and cancelled["status"] == CANCELLED
+            request(base, "DELETE", f"/jobs/{running['id']}")
+            gates.open("goal-1")
+            assert service.jobs[running["id"]].wait(10)
+
+            status, job = request(base, "GET", f"/jobs/{running['id']}")
+            assert job["status"] == CANCELLED and job["result"] is None
+            assert len(request(base, "GET", "/jobs")[1]) == 2
+            assert request(base, "GET", "/jobs/missing")[0] == 404
+        finally:
+            http.shutdown()
+            http.server_close()
+
+
+# The session that exits ends its thread with the SystemExit
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_sessions_release_their_repo_and_old_jobs_are_forgotten(gates, tmp_path):
+    repo = str(tmp_path)
+    with make_service(gates, max_sessions=2, max_finished=1) as service:
+        exited = service.submit("goal-exit", repo)
+        assert exited.wait(10)
+        assert exited.status == FAILED and exited.error.startswith("SystemExit")
+
+        # The session that exited released the repository for the other one
+        gates.open("goal-1")
+        job = service.submit("goal-1", repo)
+        assert job.wait(10) and job.status == DONE
+        assert service.health()["running"] == 0
+        assert service.get_job(exited.id) is None
+        assert service.list_jobs() == [job]
+
+
+def test_unix_socket(gates, tmp_path):
+    path = str(tmp_path / "agent.sock")
+    with make_service(gates, max_sessions=1) as service:
+        http = serve(service, unix_socket=path)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        try:
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(path)
+                client.sendall(b"GET /health HTTP/1.0\r\n\r\n")
+                response = b"".join(iter(lambda: client.recv(4096), b""))
+            head, body = response.split(b"\r\n\r\n", 1)
+            assert head.startswith(b"HTTP/1.0 200")
+            assert json.loads(body)["max_sessions"] == 1
+        finally:
+            http.shutdown()
+            http.server_close()
@@ -0,0 +1,168 @@
+import random
+
+from src.common.definitions import CodeChange, CodeSpan
+from src.utilities.span_index import CodeBlockStore, SpanIndex
+
+
+def change(start, end, lines):
+    return CodeChange(
+        file="a.py",
+        start_line=start,
+        end_line=end,
+        replacement_code="\n".join(f"x{i}" for i in range(lines)),
+    )
+
+
+def bounds(index):
+    return [(s.start_line, s.end_line) for s in index]
+
+
+def test_preceding_following_and_containing_spans():
+    index = SpanIndex(
+        [
+            CodeSpan(file_path="a.py", start_line=1, end_line=3),
+            CodeSpan(file_path="a.py", start_line=5, end_line=10),
+            CodeSpan(file_path="/a.py", start_line=12, end_line=14),
+            CodeSpan(file_path="b.py", start_line=12, end_line=14),
+        ]
+    )
+    # Replace lines 6-7 with four lines
+    index.apply_change(change(6, 8, 4))
+    assert bounds(index) == [(1, 3), (5, 12), (14, 16), (12, 14)]
+
+
+def test_partial_overlaps_and_deleted_spans():
+    index = SpanIndex(
+        [
+            CodeSpan(file_path="a.py", start_line=1, end_line=5),
+            CodeSpan(file_path="a.py", start_line=6, end_line=7),
+            CodeSpan(file_path="a.py", start_line=8, end_line=12),
+        ]
+    )
+    # Replace lines 4-9 with a single line
+    index.apply_change(change(4, 10, 1))
+    assert bounds(index) == [(1, 4), (4, 7)]
+    assert index.invalidated == 1
+
+
+def test_matches_linear_reference():
+    rng = random.Random(3)
+    spans = []
+    for _ in range(200):
+        start = rng.randint(1, 500)
+        spans.append((start, start + rng.randint(0, 20)))
+    reference = list(spans)
+    index = SpanIndex(
+        [CodeSpan(file_path="a.py", start_line=a, end_line=b) for a, b in spans]
+    )
+
+    for _ in range(100):
+        start = rng.randint(1, 500)
+        end = start + rng.randint(0, 10)
+        lines = rng.randint(0, 5)
+        index.apply_change(change(start, end, lines))
+
+        delta = lines - (end - start)
+        last = end - 1
+        updated = []
+        for a, b in reference:
+            if a >= end:
+                a, b = a + delta, b + delta
+            elif b < start:
+                pass
+            elif a <= start and b >= last:
+                b += delta
+            elif a >= start and b <= last:
+                continue
+            elif a < start:
+                b = start + lines - 1
+            else:
+                a, b = start, b + delta
+            if b >= a:
+                updated.append((a, b))
+        reference = updated
+    assert sorted(bounds(index)) == sorted(reference)
+
+
+def test_code_blocks_merge_and_keep_their_ids():
+    store = CodeBlockStore()
+    store.append(CodeSpan(file_path="a.py", start_line=10, end_line=20))
+    store.append(CodeSpan(file_path="b.py", start_line=1, end_line=5))
+    # A duplicate, a method of the class and the same span again
+    store.append(CodeSpan(file_path="/a.py", start_line=10, end_line=20))
+    store.append(CodeSpan(file_path="a.py", start_line=12, end_line=15))
+    assert [(i, s.start_line, s.end_line) for i, s, _ in store.blocks()] == [
+        (1, 10, 20),
+        (2, 1, 5),
+    ]
+
+    # Overlapping and adjacent spans are merged into the oldest block
+    store.append(CodeSpan(file_path="a.py", start_line=30, end_line=40))
+    store.append(CodeSpan(file_path="a.py", start_line=21, end_line=29))
+    assert [(i, s.start_line, s.end_line) for i, s, _ in store.blocks()] == [
+        (1, 10, 40),
+        (2, 1, 5),
+    ]
+
+    # Edits keep shifting the merged blocks
+    store.apply_change(change(1, 1, 2))
+    assert bounds(store) == [(12, 42), (1, 5)]
+
+
+def test_edits_merge_blocks_that_come_to_touch():
+    store = CodeBlockStore(
+        [
+            CodeSpan(file_path="a.py", start_line=1, end_line=5),
+            CodeSpan(file_path="a.py", start_line=10, end_line=12),
+        ]
+    )
+    # Lines 6-9 are deleted
+    store.apply_change(change(6, 10, 0))
+    assert [(i, s.start_line, s.end_line) for i, s, _ in store.blocks()] == [(1, 1, 8)]
+    assert len(store) == 1
+
+
+def test_code_blocks_match_a_full_merge():
+    rng = random.Random(7)
+    store = CodeBlockStore()
+    reference = []
+
+    def merge(spans):
+        merged = []
+        for a, b in sorted(spans):
+            if merged and a <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+            else:
+                merged.append((a, b))
+        return merged
+
+    for step in range(400):
+        if step % 5 == 4:
+            start = rng.randint(1, 300)
+            end = start + rng.randint(0, 8)
+            lines = rng.randint(0, 4)
+            store.apply_change(change(start, end, lines))
+            delta, last = lines - (end - start), end - 1
+            updated = []
+            for a, b in reference:
+                if a >= end:
+                    a, b = a + delta, b + delta
+                elif b < start:
+                    pass
+                elif a <= start and b >= last:
+                    b += delta
+                elif a >= start and b <= last:
+                    continue
+                elif a < start:
+                    b = start + lines - 1
+                else:
+                    a, b = start, b + delta
+                if b >= a:
+                    updated.append((a, b))
+            reference = merge(updated)
+        else:
+            start = rng.randint(1, 300)
+            end = start + rng.randint(0, 6)
+            store.append(CodeSpan(file_path="a.py", start_line=start, end_line=end))
+            reference = merge(reference + [(start, end)])
+        assert sorted(bounds(store)) == reference
@@ -0,0 +1,92 @@
+import os
+
+from src.common.definitions import CodeChange, CodeSpan
+from src.planning.state import StateRenderer
+from src.utilities.span_index import SpanIndex
+
+
+def test_records_are_rendered_once(tmp_path, monkeypatch, make_state):
+    calls = []
+    import src.planning.state as state_module
+
+    original = state_module.record_to_str
+    monkeypatch.setattr(
+        state_module, "record_to_str", lambda r: calls.append(r) or original(r)
+    )
+    renderer = StateRenderer()
+    state = make_state(folder=tmp_path)
+    state["history"].append({"request": {"id": "a", "args": {}}, "result": "ok"})
+    renderer.render(state)
+    state["history"].append({"request": {"id": "b", "args": {}}, "result": "ok"})
+    text = renderer.render(state)
+    assert len(calls) == 2
+    assert "#H2" in text
+
+
+def test_snippets_reload_only_when_file_changes(tmp_path, make_state):
+    path = os.path.join(tmp_path, "a.py")
+    with open(path, "w") as file:
+        file.write("x = 1\ny = 2\n")
+    renderer = StateRenderer()
+    state = make_state(folder=tmp_path)
+    state["code_blocks"].append(CodeSpan(file_path="a.py", start_line=1, end_line=2))
+    assert "1: x = 1" in renderer.render(state)
+    assert len(renderer._snippets) == 1
+
+    with open(path, "w") as file:
+        file.write("x = 10\ny = 2\n")
+    assert "1: x = 10" in renderer.render(state)
+
+
+def test_state_within_budget_renders_unchanged(tmp_path, make_state):
+    renderer = StateRenderer()
+    state = make_state(folder=tmp_path)
+    state["history"].append({"request": {"id": "a", "args": {}}, "result": "ok"})
+    text, report = renderer.render_with_report(state, token_budget=700)
+    assert text == renderer.render(state)
+    assert report.dropped == 0 and report.summarised_history == 0
+
+
+def test_older_history_is_summarised_then_dropped(tmp_path, make_state):
+    renderer = StateRenderer()
+    state = make_state(folder=tmp_path)
+    for i in range(10):
+        record = {"request": {"id": f"a{i}", "args": {}}, "result": "x " * 400}
+        state["history"].append(record)
+    state["thoughts"] = ["first", "second"]
+    unbounded = renderer.render_with_report(state, token_budget=10**6)[1].tokens
+
+    text, report = renderer.render_with_report(state, token_budget=unbounded // 2)
+    # Oldest first, and only as many as needed
+    assert 0 < report.summarised_history < 8 and report.dropped == 0
+    assert report.tokens <= unbounded // 2
+    assert text.count("…") == report.summarised_history
+    assert "…" in text.split("#H2 ")[0] and "…" not in text.split("#H8 ")[1]
+
+    text, report = renderer.render_with_report(state, token_budget=700)
+    assert report.dropped_history > 0 and report.tokens <= 700
+    assert f"(#H1-#H{report.dropped_history} omitted" in text
+    # The newest records are kept whole
+    assert "#H9 " in text and "#H10 " in text and "#T2 second" in text
+
+
+def test_least_recently_used_snippets_are_evicted(tmp_path, make_state):
+    with open(os.path.join(tmp_path, "a.py"), "w") as file:
+        file.write(
+            "".join(f"value_{i} = {i}  # {'padding ' * 20}\n" for i in range(90))
+        )
+    state = make_state(folder=tmp_path)
+    state["code_blocks"] = SpanIndex(
+        [CodeSpan(file_path="a.py", start_line=s, end_line=s + 29) for s in (1, 31, 61)]
+    )
+    # Editing the first span makes it the most recently used
+    state["code_blocks"].apply_change(
+        CodeChange(file="a.py", start_line=2, end_line=3, replacement_code="b = 2")
+    )
+    renderer = StateRenderer()
+    full = renderer.render_with_report(state, token_budget=10**6)[1].tokens
+
+    text, report = renderer.render_with_report(state, token_budget=full - 100)
+    assert report.dropped_snippets == 1
+    assert "#CODE-BLOCK-1 " in text and "#CODE-BLOCK-2 " not in text
+    assert "1 least recently used snippets omitted" in text
@@ -0,0 +1,105 @@
+import io
+import json
+import time
+
+from langchain_core.messages import ToolMessage
+
+from src.agent import RefactoringAgent
+from src.common.definitions import ProjectContext
+from src.llm.fake import ScriptedChatModel
+from src.streaming import (
+    ConsoleEventWriter,
+    JSONLEventWriter,
+    RunEvents,
+    write_events,
+)
+
+THOUGHT = "check usages of the loop variables; rename them"
+
+
+def respond(messages):
+    content = messages[-1].content
+    if isinstance(messages[-1], ToolMessage):
+        return "Done"
+    if "Decide whether to think & execute again" in content:
+        return "false"
+    if "Select the next actions to execute" in content:
+        edit = {
+            "file": "module.py",
+            "start_line": 1,
+            "end_line": 2,
+            "replacement_code": "renamed = 1",
+            "change_summary": "rename",
+        }
+        return {"tool_calls": [{"name": "edit_code", "args": edit}]}
+    if "Log any results" in content:
+        return {"tool_calls": [{"name": "print_message", "args": {"message": "ok"}}]}
+    return THOUGHT
+
+
+def make_events(tmp_path, **kwargs):
+    (tmp_path / "module.py").write_text("x = 1\n")
+    context = ProjectContext(folder_path=str(tmp_path), eval_project_id="test")
+    agent = RefactoringAgent(llm=ScriptedChatModel(responder=respond))
+    return RunEvents(agent, "goal", context, **kwargs)
+
+
+def test_events_arrive_in_order(tmp_path, capsys):
+    jsonl, console = io.StringIO(), io.StringIO()
+    events = make_events(tmp_path)
+    state = write_events(events, [JSONLEventWriter(jsonl), ConsoleEventWriter(console)])
+
+    received = [json.loads(line) for line in jsonl.getvalue().splitlines()]
+    tokens = [e for e in received if e["event"] == "token"]
+    assert "".join(e["text"] for e in tokens if e["node"] == "think") == THOUGHT
+    assert [(e["event"], e.get("node")) for e in received if e["event"] != "token"] == [
+        ("run_start", None),
+        ("node_start", "think"),
+        ("thought", "think"),
+        ("node_end", "think"),
+        ("node_start", "execute"),
+        ("action", "execute"),
+        ("edit", "execute"),
+        ("decision", None),
+        ("node_end", "execute"),
+        ("node_start", "finish"),
+        ("action", "finish"),
+        ("console", "finish"),
+        ("node_end", "finish"),
+        ("run_end", None),
+    ]
+    edit = next(e for e in received if e["event"] == "edit")
+    assert (edit["file"], edit["start_line"], edit["summary"]) == (
+        "module.py",
+        1,
+        "rename",
+    )
+    assert next(e for e in received if e["event"] == "decision")["next"] == "finish"
+    # The thought streamed before the node that produced it ended
+    first_token = received.index(tokens[0])
+    assert first_token < [e["event"] for e in received].index("thought")
+
+    assert state["thoughts"] == [THOUGHT]
+    assert (tmp_path / "module.py").read_text() == "renamed = 1\n"
+    assert THOUGHT + "\n[think] thought: " + THOUGHT in console.getvalue()
+    # Prompts are no longer printed
+    assert "### Instructions ###" not in capsys.readouterr().out
+
+
+def test_a_slow_reader_loses_only_tokens(tmp_path):
+    events = make_events(tmp_path, max_buffer=2)
+    received = []
+    for event in events:
+        if not received:
+            # The run gets ahead while the first event is handled
+            time.sleep(0.5)
+        received.append(event["event"])
+
+    assert events.dropped_tokens > 0
+    assert received.count("token") < len(THOUGHT.split())
+    assert [e for e in received if e in ("thought", "edit", "decision", "run_end")] == [
+        "thought",
+        "edit",
+        "decision",
+        "run_end",
+    ]
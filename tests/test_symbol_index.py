@@ -0,0 +1,129 @@
+import os
+import time
+
+from src.indexing.symbol_index import SymbolIndex
+
+MODULE = """import os
+
+
+class Getter:
+    value: int = 1
+
+    def get_value(self):
+        return 1
+
+
+async def get_all():
+    return 2
+
+
+get_var, other = 3, 4
+"""
+
+
+def write(path, code):
+    with open(path, "w") as file:
+        file.write(code)
+
+
+def make_index(tmp_path):
+    os.makedirs(os.path.join(tmp_path, "repo", "pkg"))
+    write(os.path.join(tmp_path, "repo", "pkg", "a.py"), MODULE)
+    index = SymbolIndex(
+        os.path.join(tmp_path, "repo"), os.path.join(tmp_path, "index.sqlite")
+    )
+    index.update()
+    return index
+
+
+def test_definitions_are_indexed(tmp_path):
+    index = make_index(tmp_path)
+    found = {
+        (s.qualified_name, s.kind, s.line, s.end_line) for s in index.lookup("get")
+    }
+    assert found == {
+        ("Getter", "class", 4, 8),
+        ("Getter.get_value", "method", 7, 8),
+        ("get_all", "function", 11, 12),
+        ("get_var", "variable", 15, 15),
+    }
+    (exact,) = index.lookup("get_all", prefix=False, file_path="pkg/a.py")
+    assert (exact.path, exact.column) == ("/pkg/a.py", 10)
+    assert index.lookup("get", file_path="pkg/missing.py") == []
+
+
+def test_update_is_incremental_and_persistent(tmp_path):
+    index = make_index(tmp_path)
+    assert index.update() == 0
+
+    path = os.path.join(tmp_path, "repo", "pkg", "a.py")
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert index.update() == 0  # touched, same content
+
+    write(path, "def renamed():\n    pass\n")
+    assert index.update() == 1
+    index.close()
+
+    reopened = SymbolIndex(
+        os.path.join(tmp_path, "repo"), os.path.join(tmp_path, "index.sqlite")
+    )
+    assert [s.name for s in reopened.lookup("")] == ["renamed"]
+
+
+def test_dirty_files_are_reparsed_from_memory(tmp_path):
+    index = make_index(tmp_path)
+    index.mark_dirty("pkg/a.py", "def fresh():\n    pass\n")
+    assert [s.name for s in index.lookup("fresh")] == ["fresh"]
+    assert index.lookup("get_all") == []
+
+
+def test_unflushed_files_keep_their_in_memory_symbols(tmp_path):
+    index = make_index(tmp_path)
+    path = os.path.join(tmp_path, "repo", "pkg", "a.py")
+    fresh = "def fresh():\n    pass\n"
+    index.mark_dirty("pkg/a.py", fresh)
+    index.lookup("fresh")
+    # Not written out yet: the file on disk is older than the buffer
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert index.update(unflushed={path}) == 0
+    assert [s.name for s in index.lookup("fresh")] == ["fresh"]
+
+    write(path, fresh)
+    assert index.update() == 0  # flushed: the content is what was indexed
+    assert [s.name for s in index.lookup("fresh")] == ["fresh"]
+
+
+def test_one_file_is_rechecked_on_its_own(tmp_path):
+    index = make_index(tmp_path)
+    path = os.path.join(tmp_path, "repo", "pkg", "a.py")
+    assert index.update_file("pkg/a.py") == 0
+
+    write(path, "def renamed():\n    pass\n")
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert index.update_file("pkg/a.py", unflushed={path}) == 0
+    assert index.update_file("pkg/a.py") == 1
+    assert [s.name for s in index.lookup("", file_path="pkg/a.py")] == ["renamed"]
+
+    os.remove(path)
+    assert index.update_file("pkg/a.py") == 0
+    assert index.paths() == set()
+
+
+def test_fuzzy_search_ranks_and_caps(tmp_path):
+    index = make_index(tmp_path)
+    write(
+        os.path.join(tmp_path, "repo", "pkg", "b.py"),
+        "def get_valve():\n    pass\n\n\ndef unrelated():\n    pass\n",
+    )
+    index.update()
+
+    results = index.search("getvalue", fuzzy=True, limit=3)
+    assert results[0].qualified_name == "Getter.get_value"
+    assert len(results) <= 3
+    assert "unrelated" not in [s.name for s in results]
+
+    near = index.search("get_val", fuzzy=True, file_path="pkg/b.py", limit=1)
+    assert near[0].path == "/pkg/b.py"
+
+    exact = index.search("get", file_path="pkg/a.py", limit=2)
+    assert [s.path for s in exact] == ["/pkg/a.py", "/pkg/a.py"]
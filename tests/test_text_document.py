@@ -0,0 +1,31 @@
+import random
+
+from src.utilities.text_document import LineDocument
+
+
+def test_matches_list_model_under_random_edits():
+    rng = random.Random(1)
+    reference = [f"line {i}\n" for i in range(200)]
+    document = LineDocument(reference)
+    for step in range(500):
+        start = rng.randint(0, len(reference))
+        end = rng.randint(start, min(len(reference), start + 5))
+        new_lines = [f"edit {step}.{j}\n" for j in range(rng.randint(0, 3))]
+        reference[start:end] = new_lines
+        document.replace_lines(start, end, new_lines)
+
+        assert len(document) == len(reference)
+        lo = rng.randint(0, len(reference))
+        hi = rng.randint(lo, len(reference))
+        assert document.slice_lines(lo, hi) == reference[lo:hi]
+        assert document.line_offset(lo) == len("".join(reference[:lo]))
+    assert document.text() == "".join(reference)
+
+
+def test_empty_document():
+    document = LineDocument()
+    assert len(document) == 0
+    assert document.text() == ""
+    document.replace_lines(0, 0, ["a\n"])
+    assert document.lines() == ["a\n"]
+    assert document.line_offset(1) == 2
@@ -0,0 +1,93 @@
+import json
+import time
+
+from benchmarks import agent_run_bench
+from benchmarks.fixtures import make_fixture_repo
+from src.actions.basic_actions import create_logging_action
+from src.agent import RefactoringAgent
+from src.execution import LLMController
+from src.llm.cache import use_llm_cache
+from src.llm.cassette import Cassette, CassetteChatModel
+from src.llm.fake import ScriptedChatModel
+from src.utilities import tracing
+from src.utilities.jedi_session import get_jedi_session
+from src.utilities.tracing import (
+    ChromeTraceSink,
+    JSONLSink,
+    SamplingProfiler,
+    SummarySink,
+)
+
+
+def test_actions_are_traced_once_inside_their_node(make_state):
+    llm = ScriptedChatModel(
+        responses=[
+            {"tool_calls": [{"name": "print_message", "args": {"message": "hi"}}]},
+            "Done",
+        ]
+    )
+    controller = LLMController([create_logging_action()], "Log", verbose=False, llm=llm)
+    summary = SummarySink()
+    with tracing.tracing(summary):
+        with tracing.span("finish", "node"):
+            controller.run(make_state("goal"))
+    # Nothing is recorded once the tracer is removed
+    controller.run(make_state("goal"))
+
+    totals = summary.summary()
+    assert totals["action"]["print_message"]["calls"] == 1
+    node = totals["node"]["finish"]
+    assert node["calls"] == 1
+    assert node["prompt_chars"] > node["prompt_tokens"] > 0
+    assert node["wall_s"] >= totals["action"]["print_message"]["wall_s"]
+
+
+def test_agent_run_writes_every_sink(tmp_path, monkeypatch):
+    monkeypatch.setenv("LESS_CACHE_DIR", str(tmp_path / "cache"))
+    repo = make_fixture_repo(str(tmp_path / "repo"), 10)
+    cassette = Cassette(agent_run_bench.CASSETTE)
+    summary = SummarySink()
+    jsonl, chrome = tmp_path / "trace.jsonl", tmp_path / "trace.json"
+    use_llm_cache(cassette)
+    try:
+        agent = RefactoringAgent(llm=CassetteChatModel(cassette=cassette))
+        with tracing.tracing(
+            summary, JSONLSink(str(jsonl)), ChromeTraceSink(str(chrome))
+        ):
+            agent_run_bench.run_once(agent, repo)
+    finally:
+        use_llm_cache(None)
+
+    totals = summary.summary()
+    assert set(totals["node"]) == {"think", "execute", "should_continue", "finish"}
+    assert set(totals["action"]) >= {"code_search", "edit_code", "print_message"}
+    assert totals["node"]["execute"]["bytes_read"] > 0
+
+    spans = [json.loads(line) for line in jsonl.read_text().splitlines()]
+    events = json.loads(chrome.read_text())["traceEvents"]
+    assert len(spans) == len(events) == sum(t["calls"] for t in summary.totals.values())
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+    # The symbol index answered the search; Jedi is the fallback
+    summary = SummarySink()
+    with tracing.tracing(summary), tracing.span("search", "action"):
+        get_jedi_session(repo).complete_search("legacy_total")
+    assert summary.summary()["action"]["search"]["jedi_calls"] == 1
+
+
+def test_sampling_profiler_folds_stacks(tmp_path):
+    def busy_wait():
+        deadline = time.perf_counter() + 0.2
+        while time.perf_counter() < deadline:
+            pass
+
+    with SamplingProfiler(interval=0.002) as profiler:
+        busy_wait()
+
+    assert any("busy_wait" in function for function, _ in profiler.top())
+    path = tmp_path / "profile.folded"
+    profiler.write_folded(str(path))
+    # Other threads (e.g. trulens' workers) are sampled as well
+    [line] = [line for line in path.read_text().splitlines() if "busy_wait" in line]
+    stack, samples = line.rsplit(" ", 1)
+    assert stack.startswith("MainThread;") and int(samples) > 0
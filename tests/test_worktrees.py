@@ -0,0 +1,121 @@
+import os
+
+import pygit2 as git
+import pytest
+
+from src.agent import as_node
+from src.common.definitions import CodeChange, ProjectContext
+from src.utilities.file_buffers import get_buffer_cache
+from src.utilities.worktrees import open_worktree
+
+
+def make_repo(path):
+    repo = git.init_repository(str(path))
+    (path / "module.py").write_text("a = 1\nb = 2\n")
+    (path / "docs").mkdir()
+    (path / "docs" / "notes.py").write_text("c = 3\n")
+    repo.index.add_all()
+    repo.index.write()
+    signature = git.Signature("test", "test@localhost")
+    tree = repo.index.write_tree()
+    repo.create_commit("HEAD", signature, signature, "initial", tree, [])
+    return repo
+
+
+def read(worktree, name):
+    with open(os.path.join(worktree.path, name)) as file:
+        return file.read()
+
+
+def test_snapshot_rollback_and_commit(tmp_path):
+    repo = make_repo(tmp_path)
+    worktree = open_worktree(str(tmp_path), "session-0")
+    worktree.reset()
+    assert read(worktree, "module.py") == "a = 1\nb = 2\n"
+    assert worktree.path_of(str(tmp_path / "docs")) == os.path.join(
+        worktree.path, "docs"
+    )
+
+    module = os.path.join(worktree.path, "module.py")
+    with open(module, "w") as file:
+        file.write("a = 10\n")
+    first = worktree.snapshot()
+    with open(module, "w") as file:
+        file.write("a = 100\n")
+    with open(os.path.join(worktree.path, "new.py"), "w") as file:
+        file.write("d = 4\n")
+
+    worktree.rollback()
+    assert worktree.snapshots[-1] == first
+    assert read(worktree, "module.py") == "a = 10\n"
+    assert not os.path.exists(os.path.join(worktree.path, "new.py"))
+    worktree.rollback(worktree.snapshots[0])
+    assert read(worktree, "module.py") == "a = 1\nb = 2\n"
+    assert len(worktree.snapshots) == 1
+
+    # Nothing changed: nothing to commit
+    assert worktree.commit("no-op") is None
+    with open(module, "w") as file:
+        file.write("a = 2\n")
+    commit_id = worktree.commit("bump a")
+    assert worktree.head == commit_id != worktree.base
+    branch = worktree.branch("job")
+    committed = repo.branches.local[branch].peel(git.Commit)
+    assert committed.tree["module.py"].data == b"a = 2\n"
+    # The repository's own checkout and HEAD are untouched
+    assert (tmp_path / "module.py").read_text() == "a = 1\nb = 2\n"
+    assert repo.head.target == worktree.base
+
+    # Reopening reuses the checkout; resetting returns it to HEAD
+    again = open_worktree(str(tmp_path), "session-0")
+    again.reset()
+    assert read(again, "module.py") == "a = 1\nb = 2\n"
+    again.remove()
+    assert repo.list_worktrees() == []
+
+
+def test_snapshots_record_deleted_files(tmp_path):
+    repo = make_repo(tmp_path)
+    worktree = open_worktree(str(tmp_path), "session-0")
+    worktree.reset()
+
+    os.remove(os.path.join(worktree.path, "docs", "notes.py"))
+    deleted = worktree.snapshot()
+    assert "docs" not in repo[deleted]
+    worktree.rollback(worktree.snapshots[0])
+    assert read(worktree, "docs/notes.py") == "c = 3\n"
+
+    os.remove(os.path.join(worktree.path, "module.py"))
+    commit_id = worktree.commit("remove module")
+    assert "module.py" not in repo[commit_id].peel(git.Tree)
+    worktree.remove()
+
+
+def test_a_failed_step_is_rolled_back(tmp_path):
+    make_repo(tmp_path)
+    worktree = open_worktree(str(tmp_path), "session-0")
+    worktree.reset()
+    context = ProjectContext(folder_path=worktree.path, eval_project_id="test")
+    state = {"project_context": context}
+    buffers = get_buffer_cache(context)
+
+    def edit(line, fail=False):
+        def node(state):
+            buffers.apply_change(CodeChange(**line))
+            buffers.flush()
+            if fail:
+                raise ValueError("step failed")
+            return state
+
+        return as_node(node, "execute", step=True)
+
+    config = {"configurable": {"worktree": worktree}}
+    change = dict(file="module.py", start_line=1, end_line=2)
+    edit({**change, "replacement_code": "a = 10"}).invoke(state, config)
+    assert len(worktree.snapshots) == 2
+
+    with pytest.raises(ValueError):
+        edit({**change, "replacement_code": "a = 100"}, fail=True).invoke(state, config)
+    assert read(worktree, "module.py") == "a = 10\nb = 2\n"
+    assert buffers.read_span("module.py", 1, 1) == "a = 10\n"
+    worktree.remove()